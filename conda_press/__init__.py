@@ -1,6 +1,31 @@
-from xonsh.main import setup
-
-setup()
-del setup
+import os
+import sys
 
 __version__ = "0.0.6"
+
+
+class _XonshSetupFinder:
+    """Sets up xonsh the first time that one of the xonsh (.xsh) modules of
+    conda-press is imported. The pure Python modules, and with them the fast
+    paths of the command line interface, do not pay for it.
+    """
+
+    def __init__(self, pkgdir):
+        self.pkgdir = pkgdir
+
+    def find_spec(self, fullname, path=None, target=None):
+        if not fullname.startswith(__name__ + "."):
+            return None
+        modname = fullname[len(__name__) + 1:]
+        if not os.path.isfile(os.path.join(self.pkgdir, modname + ".xsh")):
+            return None
+        if self in sys.meta_path:
+            sys.meta_path.remove(self)
+        from xonsh.main import setup
+        from importlib.util import find_spec
+
+        setup()
+        return find_spec(fullname)
+
+
+sys.meta_path.insert(0, _XonshSetupFinder(os.path.dirname(os.path.abspath(__file__))))
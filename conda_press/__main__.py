@@ -1,3 +1,5 @@
+import sys
+
 from conda_press.main import main
 
-main()
+sys.exit(main())
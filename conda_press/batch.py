@@ -0,0 +1,326 @@
+"""Converting many specs at once, from a manifest file"""
+import os
+import time
+import hashlib
+import contextlib
+from dataclasses import dataclass, field, fields, replace
+from typing import Dict, List, Optional
+from collections import Counter
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, as_completed, wait
+
+from xonsh.tools import print_color
+
+from conda_press.config import CONVERSION_FIELDS, Config
+from conda_press.download import get_artifact_cache, iter_prefetched_package_recs
+
+# directory, under the current one, that the wheels of a package record are
+# written to when the record is converted more than one way, see convert_entries()
+VARIANTS_DIR = "variants"
+
+# Config fields that may not be overridden per spec, since they apply to the
+# run as a whole.
+RUN_FIELDS = frozenset({
+    "merge",
+    "jobs",
+    "download_jobs",
+    "prefetch_depth",
+    "artifact_cache_dir",
+    "artifact_cache_max_size",
+    "wheel_cache_dir",
+    "wheel_cache_max_size",
+    "repodata_cache",
+    "repodata_cache_dir",
+    "repodata_cache_ttl",
+})
+
+
+@dataclass
+class BatchEntry:
+    """A spec to convert, along with the configuration to convert it with."""
+
+    spec: str
+    config: Config
+
+
+@dataclass
+class SpecReport:
+    spec: str
+    packages: int = 0
+    built: int = 0
+    shared: int = 0
+    skipped: int = 0
+    solve_time: float = 0.0
+    fat_wheel: Optional[str] = None
+
+
+@dataclass
+class BatchReport:
+    """Summary of a batch conversion. The build times are keyed by the build
+    key of each conversion, a (match spec string, conversion fingerprint,
+    converted as top) tuple, since a package record may be converted more
+    than one way. Downloads run alongside the conversions, so the download
+    time is only the time that conversions spent waiting for them.
+    """
+
+    specs: List[SpecReport] = field(default_factory=list)
+    build_times: Dict[tuple, float] = field(default_factory=dict)
+    solve_time: float = 0.0
+    download_time: float = 0.0
+    build_time: float = 0.0
+    fatten_time: float = 0.0
+    total_time: float = 0.0
+
+    def format(self):
+        """Returns the report as a human readable table."""
+        lines = ["spec                                      packages  built  shared  skipped  solve (s)"]
+        for s in self.specs:
+            lines.append(f"{s.spec:<40}  {s.packages:>8}  {s.built:>5}  {s.shared:>6}  "
+                         f"{s.skipped:>7}  {s.solve_time:>9.2f}")
+            if s.fat_wheel:
+                lines.append(f"    fat wheel: {s.fat_wheel}")
+        slowest = sorted(self.build_times.items(), key=lambda kv: kv[1], reverse=True)[:5]
+        if slowest:
+            lines.append("slowest conversions:")
+            conversions = Counter(key[0] for key in self.build_times)
+            for key, t in slowest:
+                lines.append(f"    {t:>8.2f} s  {key[0]}")
+                if conversions[key[0]] > 1:
+                    lines[-1] += f" (variant {_variant_id(key)})"
+        lines.append(f"{len(self.build_times)} unique packages converted for "
+                     f"{len(self.specs)} specs")
+        lines.append(f"solve {self.solve_time:.2f} s, download {self.download_time:.2f} s, "
+                     f"convert {self.build_time:.2f} s, fatten {self.fatten_time:.2f} s, "
+                     f"total {self.total_time:.2f} s")
+        return "\n".join(lines)
+
+
+def _convert_override(name, value):
+    if name in ("exclude_deps", "add_deps"):
+        return {value} if isinstance(value, str) else set(value)
+    elif name == "channels":
+        return [value] if isinstance(value, str) else list(value)
+    return value
+
+
+def entries_from_manifest(manifest, config=None):
+    """Creates the batch entries described by a manifest. The manifest is
+    either a list of specs, or a dict with such a list under "specs". Each
+    spec is either a spec string or a dict with the spec string under "spec"
+    and any per-spec overrides of the config, e.g.::
+
+        specs:
+          - numpy=1.17
+          - spec: scipy=1.3
+            skip_python: true
+            fatten: true
+            output: scipy-fat.whl
+    """
+    config = Config() if config is None else config
+    if isinstance(manifest, dict):
+        manifest = manifest.get("specs", [])
+    config_fields = {f.name for f in fields(Config)}
+    entries = []
+    for item in manifest:
+        if isinstance(item, str):
+            entries.append(BatchEntry(item, config))
+            continue
+        overrides = dict(item)
+        spec = overrides.pop("spec")
+        for name in overrides:
+            if name not in config_fields:
+                raise ValueError(f"{name!r} is not a configuration option, for spec {spec!r}")
+            elif name in RUN_FIELDS:
+                raise ValueError(f"{name!r} applies to the whole run, it cannot be "
+                                 f"set for spec {spec!r}")
+        overrides = {k: _convert_override(k, v) for k, v in overrides.items()}
+        entries.append(BatchEntry(spec, replace(config, **overrides)))
+    return entries
+
+
+def load_manifest(filename, config=None):
+    """Reads the batch entries from a YAML or JSON manifest file."""
+    from ruamel.yaml import YAML
+
+    with open(filename) as f:
+        manifest = YAML(typ="safe").load(f)
+    return entries_from_manifest(manifest or [], config=config)
+
+
+@contextlib.contextmanager
+def _in_directory(dirname):
+    prev = os.getcwd()
+    os.makedirs(dirname, exist_ok=True)
+    os.chdir(dirname)
+    try:
+        yield
+    finally:
+        os.chdir(prev)
+
+
+def _timed_package_rec_data_to_wheel(package_rec_data, config, _top, output_dir=None):
+    """Converts a package record in a worker, into the current directory or
+    output_dir. Wheels in an output_dir are returned as read from their file,
+    so that they may be merged from there.
+    """
+    from conda_press.condatools import _package_rec_data_to_wheel
+    from conda_press.wheel import Wheel
+
+    t0 = time.monotonic()
+    if output_dir is None:
+        wheel = _package_rec_data_to_wheel(package_rec_data, config, _top)
+    else:
+        with _in_directory(output_dir):
+            wheel = _package_rec_data_to_wheel(package_rec_data, config, _top)
+        if wheel is not None:
+            wheel = Wheel.from_file(os.path.join(output_dir, wheel.filename))
+    return wheel, time.monotonic() - t0
+
+
+def _timed_downloads(downloaded, report):
+    """Yields from the downloaded iterator, adding the time spent waiting
+    for it to the download time of the report.
+    """
+    while True:
+        t0 = time.monotonic()
+        item = next(downloaded, None)
+        report.download_time += time.monotonic() - t0
+        if item is None:
+            return
+        yield item
+
+
+def _build_key(match_spec_str, config, is_top):
+    # the top package is only converted differently when skipping python
+    return (match_spec_str, config.fingerprint(CONVERSION_FIELDS), is_top and config.skip_python)
+
+
+def _variant_id(key):
+    return hashlib.sha256(repr(key).encode()).hexdigest()[:12]
+
+
+def _output_dirs(build_keys):
+    """Maps build keys to the directory that their wheel is written to, None
+    being the current directory. The wheels of a package record have the same
+    filename however the record is converted, so only the first of the builds
+    of a record is written to the current directory, and each of the others
+    to a directory of its own.
+    """
+    output_dirs = {}
+    firsts = set()
+    for key in build_keys:
+        if key[0] in firsts:
+            output_dirs[key] = os.path.abspath(os.path.join(VARIANTS_DIR, _variant_id(key)))
+        else:
+            firsts.add(key[0])
+            output_dirs[key] = None
+    return output_dirs
+
+
+def convert_entries(entries, config=None):
+    """Converts the dependency trees of many batch entries to wheels. All of
+    the specs are solved up front, so that each unique package record (and
+    conversion configuration) is converted exactly once, no matter how many
+    of the specs depend on it. Conversions are spread across config.jobs
+    worker processes. When per-spec overrides make a record be converted
+    more than one way, the extra variants are written under VARIANTS_DIR,
+    rather than over each other. Returns a BatchReport.
+    """
+    from conda_press.condatools import plan_dependency_tree, solve_artifact_ref
+    from conda_press.wheel import fatten_from_seen
+
+    config = Config() if config is None else config
+    report = BatchReport()
+    start = time.monotonic()
+
+    # solve everything and work out what needs to be built
+    plans = []
+    builds = {}
+    for entry in entries:
+        t0 = time.monotonic()
+        package_recs = solve_artifact_ref(entry.spec, config=entry.config)
+        seen = {}
+        to_build = plan_dependency_tree(entry.spec, package_recs, config=entry.config, seen=seen)
+        spec_report = SpecReport(entry.spec, packages=len(package_recs),
+                                 skipped=len(seen) - len(to_build),
+                                 solve_time=time.monotonic() - t0)
+        keys = []
+        for match_spec_str, package_rec, is_top in to_build:
+            key = _build_key(match_spec_str, entry.config, is_top)
+            if key in builds:
+                spec_report.shared += 1
+            else:
+                spec_report.built += 1
+                builds[key] = (match_spec_str, package_rec, entry.config, is_top)
+            keys.append((match_spec_str, key, is_top))
+        plans.append((entry, seen, keys))
+        report.specs.append(spec_report)
+    report.solve_time = time.monotonic() - start
+
+    # convert each unique package once. Records download in the background,
+    # config.prefetch_depth ahead of the ones being converted, and are only
+    # pinned in the artifact cache until they are converted, so that it may
+    # still be kept within its maximum size.
+    t0 = time.monotonic()
+    print_color("Converting {YELLOW}" + str(len(builds)) + "{NO_COLOR} unique packages for "
+                "{GREEN}" + str(len(entries)) + "{NO_COLOR} specs")
+    wheels = {}
+    output_dirs = _output_dirs(builds)
+    cache = get_artifact_cache(config)
+    downloaded = iter_prefetched_package_recs(
+        [package_rec for _, package_rec, _, _ in builds.values()], depth=config.prefetch_depth,
+        jobs=config.download_jobs, cache=cache)
+    with contextlib.closing(downloaded):
+        downloaded = _timed_downloads(downloaded, report)
+        if config.jobs > 1 and len(builds) > 1:
+            with ProcessPoolExecutor(max_workers=config.jobs) as executor:
+                futures = {}
+
+                def collect(futures_done):
+                    for future in futures_done:
+                        key, pin = futures.pop(future)
+                        pin.release()
+                        wheels[key], report.build_times[key] = future.result()
+
+                # records are only handed to the pool while it has a free
+                # worker, each pinned until its conversion is done
+                try:
+                    for (key, (_, package_rec, build_config, is_top)), _ in zip(
+                            builds.items(), downloaded):
+                        if len(futures) >= config.jobs:
+                            collect(wait(futures, return_when=FIRST_COMPLETED).done)
+                        pin = cache.pin(package_rec.fn)
+                        future = executor.submit(_timed_package_rec_data_to_wheel,
+                                                 package_rec.dump(), build_config, is_top,
+                                                 output_dirs[key])
+                        futures[future] = (key, pin)
+                    collect(as_completed(list(futures)))
+                finally:
+                    for _, pin in futures.values():
+                        pin.release()
+        else:
+            for (key, (_, package_rec, build_config, is_top)), _ in zip(builds.items(),
+                                                                        downloaded):
+                wheels[key], report.build_times[key] = _timed_package_rec_data_to_wheel(
+                    package_rec.dump(), build_config, is_top, output_dirs[key])
+    report.build_time = time.monotonic() - t0 - report.download_time
+
+    # fill in the seen dicts of the specs, and fatten them
+    t0 = time.monotonic()
+    for (entry, seen, keys), spec_report in zip(plans, report.specs):
+        for match_spec_str, key, is_top in keys:
+            seen[match_spec_str] = wheels[key]
+        if not entry.config.fatten:
+            continue
+        # the same wheel may be the top of one spec and a dependency of another
+        top_keys = {key for _, key, is_top in keys if is_top}
+        for match_spec_str, key, _ in keys:
+            if wheels[key] is not None:
+                wheels[key]._top = key in top_keys
+        fat = fatten_from_seen(seen, output=entry.config.output,
+                               skipped_deps=entry.config.exclude_deps, copy=True,
+                               fingerprint=entry.config.fingerprint(CONVERSION_FIELDS),
+                               reproducible=entry.config.reproducible)
+        spec_report.fat_wheel = next(iter(fat))
+    report.fatten_time = time.monotonic() - t0
+    report.total_time = time.monotonic() - start
+    return report
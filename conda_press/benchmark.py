@@ -0,0 +1,546 @@
+"""Benchmarks of the conversion pipeline, run on synthetic conda artifacts
+
+The artifacts are generated locally, at a controllable scale, and their
+dependencies are served from a local channel, so that no network access is
+needed. Each stage of the conversion is timed separately and the results are
+saved as JSON, so that runs on different versions of conda-press may be
+compared. Run ``python -m conda_press.benchmark --help`` for the options.
+"""
+import io
+import os
+import sys
+import json
+import time
+import random
+import shutil
+import tarfile
+import datetime
+import platform
+import tempfile
+import contextlib
+import subprocess
+from hashlib import md5, sha256
+from dataclasses import asdict, dataclass
+from concurrent.futures import ProcessPoolExecutor
+
+from conda_press import __version__ as VERSION
+from conda_press.cache import parse_size
+from conda_press.config import Config
+
+RESULTS_FORMAT = 1
+STAGES = ("extract", "strip", "replace_symlinks", "rewrite_rpaths", "write", "fatten")
+DEFAULT_REPEAT = 3
+DEFAULT_THRESHOLD = 1.25
+DEFAULT_MIN_TIME = 0.05
+
+# the run path that most synthetic libraries are linked with. Prepending the
+# run path that conda-press computes for them only reorders the entries, so
+# that the new run path fits in place and patchelf is not needed.
+SYNTHETIC_RPATH = "$ORIGIN/../../lib:$ORIGIN/../lib"
+# the run path of the others, which is too short to hold the new one, so that
+# rewriting it falls back to patchelf, as it does for many real libraries.
+SHORT_RPATH = "$ORIGIN"
+
+
+@dataclass
+class Scenario:
+    """The shape of the synthetic artifacts of a benchmark.
+
+    Parameters
+    ----------
+    name : str
+        Name of the scenario, results are compared by name.
+    files : int
+        Number of regular files in the artifact.
+    size : int
+        Total size of the regular files, in bytes.
+    elf : int
+        Number of ELF shared libraries in the artifact, these need symbols
+        stripped and run paths rewritten.
+    patchelf : int
+        How many of the ELF shared libraries have a run path that the new one
+        does not fit in, so that it is rewritten with patchelf.
+    symlinks : int
+        Number of symbolic links to other files of the artifact.
+    fanout : int
+        Number of dependencies of the artifact. The artifact has a symbolic
+        link into each of them, which has to be resolved.
+    seed : int
+        Seed for generating the file contents.
+    """
+
+    name: str
+    files: int = 100
+    size: int = 1 << 20
+    elf: int = 0
+    patchelf: int = 0
+    symlinks: int = 0
+    fanout: int = 0
+    seed: int = 42
+
+
+SCENARIOS = {
+    s.name: s for s in [
+        Scenario("small", files=200, size=2 << 20, elf=4, patchelf=1, symlinks=20, fanout=2),
+        Scenario("many-files", files=5000, size=20 << 20, symlinks=200),
+        Scenario("large-files", files=20, size=200 << 20),
+        Scenario("binaries", files=50, size=1 << 20, elf=200, patchelf=50,
+                 symlinks=50),
+        Scenario("fanout", files=100, size=1 << 20, symlinks=50, fanout=20),
+    ]
+}
+
+
+def _random_bytes(rng, n):
+    """Returns n bytes, half random and half repetitive, so that the files
+    compress about as well as typical package contents.
+    """
+    half = n // 2
+    noise = rng.getrandbits(8 * half).to_bytes(half, "little") if half else b""
+    text = (b"conda-press synthetic benchmark data\n" * (n // 37 + 1))[:n - half]
+    return noise + text
+
+
+def _elf_template(directory, rpath=SYNTHETIC_RPATH, name="synthetic"):
+    """Compiles a shared library with the given run path, which synthetic
+    ELF files are copies of. Returns its contents, or None if it cannot be
+    built here.
+    """
+    if not sys.platform.startswith("linux") or shutil.which("gcc") is None:
+        return None
+    src = os.path.join(directory, f"{name}.c")
+    lib = os.path.join(directory, f"lib{name}.so")
+    with open(src, "w") as f:
+        for i in range(64):
+            f.write(f"int synthetic_{i}(int x) {{ return x * {i} + {i % 7}; }}\n")
+    subprocess.run(["gcc", "-g", "-O1", "-shared", "-fPIC", "-o", lib, src,
+                    f"-Wl,--enable-new-dtags,-rpath,{rpath}"], check=True)
+    with open(lib, "rb") as f:
+        return f.read()
+
+
+def _write_artifact(path, name, files, links, depends=(), version="1.0"):
+    """Writes a .tar.bz2 conda artifact, files maps relative paths to bytes
+    and links maps relative paths to link targets.
+    """
+    index = {"name": name, "version": version, "build": "0", "build_number": 0,
+             "depends": list(depends), "subdir": "linux-64"}
+    paths = [{"_path": p, "path_type": "hardlink", "size_in_bytes": len(data),
+              "sha256": sha256(data).hexdigest()} for p, data in sorted(files.items())]
+    paths += [{"_path": p, "path_type": "softlink"} for p in sorted(links)]
+    info = {
+        "info/index.json": json.dumps(index).encode(),
+        "info/files": "\n".join(sorted(list(files) + list(links))).encode(),
+        "info/paths.json": json.dumps({"paths": paths, "paths_version": 1}).encode(),
+    }
+    with tarfile.open(path, mode="w:bz2") as tf:
+        for arcname, data in list(info.items()) + sorted(files.items()):
+            tinfo = tarfile.TarInfo(arcname)
+            tinfo.size = len(data)
+            tinfo.mode = 0o755 if data.startswith(b"\x7fELF") else 0o644
+            tinfo.mtime = 1500000000
+            tf.addfile(tinfo, io.BytesIO(data))
+        for arcname, target in sorted(links.items()):
+            tinfo = tarfile.TarInfo(arcname)
+            tinfo.type = tarfile.SYMTYPE
+            tinfo.linkname = target
+            tinfo.mtime = 1500000000
+            tf.addfile(tinfo)
+    return index
+
+
+def _write_channel(channel_dir, artifacts):
+    """Writes the repodata of a local channel holding the artifacts, a
+    dict mapping artifact paths to their index.json data. Returns the URL
+    of the channel.
+    """
+    packages = {}
+    for path, index in artifacts.items():
+        with open(path, "rb") as f:
+            data = f.read()
+        packages[os.path.basename(path)] = dict(index, md5=md5(data).hexdigest(),
+                                                sha256=sha256(data).hexdigest(),
+                                                size=len(data))
+    for subdir in ("linux-64", "noarch"):
+        os.makedirs(os.path.join(channel_dir, subdir), exist_ok=True)
+        recs = packages if subdir == "linux-64" else {}
+        with open(os.path.join(channel_dir, subdir, "repodata.json"), "w") as f:
+            json.dump({"info": {"subdir": subdir}, "packages": recs,
+                       "packages.conda": {}}, f)
+    return "file://" + os.path.abspath(channel_dir)
+
+
+def make_scenario_artifacts(scenario, directory):
+    """Generates the synthetic artifacts of a scenario in a directory.
+
+    Returns
+    -------
+    top : str
+        Path to the artifact to convert.
+    channel : str
+        URL of the local channel that holds its dependencies.
+    deps : list of str
+        Paths to the artifacts of the dependencies.
+    scenario : Scenario
+        The scenario that was actually generated. This only differs from the
+        one given when no ELF files can be built here, in which case elf is 0,
+        or when patchelf is not installed, in which case patchelf is 0.
+    """
+    rng = random.Random(scenario.seed)
+    elf = _elf_template(directory) if scenario.elf or scenario.fanout else None
+    if elf is None and scenario.elf:
+        print(f"cannot build ELF files here, leaving them out of {scenario.name!r}")
+        scenario = Scenario(**dict(asdict(scenario), elf=0))
+    short = None
+    if min(scenario.patchelf, scenario.elf) > 0 and shutil.which("patchelf") is not None:
+        short = _elf_template(directory, rpath=SHORT_RPATH, name="synthetic_short")
+    elif scenario.elf and scenario.patchelf:
+        print(f"patchelf is not installed, all ELF files of {scenario.name!r} "
+              "are rewritten in place")
+    patchelf = min(scenario.patchelf, scenario.elf) if short is not None else 0
+    if patchelf != scenario.patchelf:
+        scenario = Scenario(**dict(asdict(scenario), patchelf=patchelf))
+    channel_dir = os.path.join(directory, "channel")
+    os.makedirs(os.path.join(channel_dir, "linux-64"), exist_ok=True)
+    deps = {}
+    depends = []
+    for k in range(scenario.fanout):
+        name = f"synthdep{k}"
+        path = os.path.join(channel_dir, "linux-64", f"{name}-1.0-0.tar.bz2")
+        files = {f"lib/lib{name}.so.1": elf or _random_bytes(rng, 4096),
+                 f"share/{name}/README": b"a synthetic dependency\n"}
+        deps[path] = _write_artifact(path, name, files, {})
+        depends.append(f"{name} 1.0 0")
+    # links are searched for in all of the dependencies, python included
+    python = os.path.join(channel_dir, "linux-64", "python-3.99-0.tar.bz2")
+    artifacts = dict(deps)
+    artifacts[python] = _write_artifact(python, "python", {"share/python/README": b"stub\n"}, {},
+                                        version="3.99")
+    channel = _write_channel(channel_dir, artifacts)
+
+    # the regular files, ELF files and links of the artifact to convert
+    site_packages = "lib/python3.8/site-packages/synth"
+    files = {}
+    per_file = scenario.size // max(1, scenario.files)
+    for i in range(scenario.files):
+        files[f"{site_packages}/data/file_{i:05d}.dat"] = _random_bytes(rng, per_file)
+    for i in range(scenario.elf):
+        files[f"{site_packages}/_ext{i:04d}.so"] = short if i < scenario.patchelf else elf
+    links = {}
+    data_files = sorted(files)
+    for i in range(scenario.symlinks if data_files else 0):
+        target = data_files[i % len(data_files)]
+        links[f"{site_packages}/links/link_{i:05d}"] = os.path.relpath(
+            target, f"{site_packages}/links")
+    for k in range(scenario.fanout):
+        links[f"lib/libsynthdep{k}.so"] = f"libsynthdep{k}.so.1"
+    top = os.path.join(directory, "synth-1.0-0.tar.bz2")
+    _write_artifact(top, "synth", files, links, depends=depends + ["python >=3.6"])
+    return top, channel, sorted(deps), scenario
+
+
+def peak_rss():
+    """Returns the peak resident set sizes, in bytes, of this process and of
+    its (waited for) child processes, or (None, None) if unknown.
+    """
+    try:
+        import resource
+    except ImportError:
+        return None, None
+    # linux reports kilobytes, macOS bytes
+    scale = 1 if sys.platform == "darwin" else 1024
+    return (resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * scale,
+            resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss * scale)
+
+
+@contextlib.contextmanager
+def _timed(times, stage):
+    t0 = time.perf_counter()
+    yield
+    times[stage] = (time.perf_counter() - t0, peak_rss()[0])
+
+
+def _run_pipeline(top, channel, dep_wheels, workdir):
+    """Converts the top artifact and fattens it with the dependency wheels,
+    timing each stage. Returns a dict mapping stages to (seconds, peak RSS
+    once done) tuples.
+    """
+    from conda_press.condatools import (ArtifactInfo, DependencyFileIndex, _group_files,
+                                        _remap_site_packages, wheel_from_artifact_info)
+    from conda_press.wheel import fatten_from_seen
+
+    config = Config()
+    times = {}
+    with _timed(times, "extract"):
+        info = ArtifactInfo.from_tarball(top, config=Config(strip_symbols=False),
+                                         replace_symlinks=False)
+    info.config = config
+    try:
+        with _timed(times, "strip"):
+            info.strip_symbols()
+        index = DependencyFileIndex(channels=[channel], strip_symbols=config.strip_symbols)
+        try:
+            with _timed(times, "replace_symlinks"):
+                info.replace_symlinks(dep_index=index)
+        finally:
+            index.clean()
+        wheel = wheel_from_artifact_info(info)
+        wheel.basedir = info.artifactdir
+        _group_files(wheel, info)
+        _remap_site_packages(wheel, info)
+        wheel.rewrite_python_shebang()
+        with _timed(times, "rewrite_rpaths"):
+            wheel.rewrite_rpaths()
+        wheel.rewrite_scripts_linking()
+        wheel.entry_points = info.entry_points
+        with _timed(times, "write"):
+            wheel.write(include_requirements=config.include_requirements,
+                        compresslevel=config.compress_level)
+    finally:
+        info.clean()
+    wheel._top = True
+    seen = dict(dep_wheels, synth=wheel)
+    output = os.path.join(workdir, "fat", wheel.filename)
+    os.makedirs(os.path.dirname(output), exist_ok=True)
+    with _timed(times, "fatten"):
+        fatten_from_seen(seen, output=output, copy=True)
+    return times
+
+
+def _summarize(samples, rss):
+    s = sorted(samples)
+    n = len(s)
+    median = s[n // 2] if n % 2 else (s[n // 2 - 1] + s[n // 2]) / 2
+    rss = [r for r in rss if r is not None]
+    return {"min": s[0], "median": median, "times": samples,
+            "peak_rss": max(rss) if rss else None}
+
+
+def run_scenario(scenario, repeat=DEFAULT_REPEAT, workdir=None, quiet=True):
+    """Generates the artifacts of a scenario and times each stage of their
+    conversion, repeat times. The peak memory use is that of the whole
+    process, so it is most meaningful when each scenario is run in a fresh
+    process, as run_scenarios() does.
+
+    Returns
+    -------
+    result : dict
+        With the "params" of the scenario, per stage the "min" and "median"
+        seconds, the "times" of each repetition and the "peak_rss" of the
+        process once the stage was done, and the overall "peak_rss" of the
+        process and "children_peak_rss" of the tools it ran, such as strip.
+    """
+    from xonsh.lib.os import indir, rmtree
+    from conda_press import download, repodata
+    from conda_press.cache import ArtifactCache
+    from conda_press.condatools import artifact_to_wheel
+
+    own_workdir = workdir is None
+    workdir = tempfile.mkdtemp(prefix="conda-press-bench-") if own_workdir else workdir
+    workdir = os.path.abspath(workdir)
+    # keep the downloads of the dependencies out of the real caches
+    old_cache, old_index = download._CACHE, repodata._INDEX
+    download.set_artifact_cache(ArtifactCache(os.path.join(workdir, "artifacts")))
+    repodata.set_repodata_index(repodata.RepodataIndex())
+    out = io.StringIO() if quiet else sys.stdout
+    try:
+        with contextlib.redirect_stdout(out), indir(workdir):
+            top, channel, deps, scenario = make_scenario_artifacts(scenario, workdir)
+            dep_wheels = {os.path.basename(d): artifact_to_wheel(d) for d in deps}
+            samples = {stage: [] for stage in STAGES}
+            rss = {stage: [] for stage in STAGES}
+            for _ in range(repeat):
+                with indir(workdir):
+                    times = _run_pipeline(top, channel, dep_wheels, workdir)
+                for stage in STAGES:
+                    samples[stage].append(times[stage][0])
+                    rss[stage].append(times[stage][1])
+        self_rss, children_rss = peak_rss()
+    finally:
+        download.set_artifact_cache(old_cache)
+        repodata.set_repodata_index(old_index)
+        if own_workdir:
+            rmtree(workdir, force=True)
+    return {
+        "params": asdict(scenario),
+        "stages": {stage: _summarize(samples[stage], rss[stage]) for stage in STAGES},
+        "peak_rss": self_rss,
+        "children_peak_rss": children_rss,
+    }
+
+
+def run_scenarios(scenarios, repeat=DEFAULT_REPEAT, quiet=True):
+    """Runs each scenario in a fresh process, so that their peak memory use
+    is measured separately. Returns the results, ready to be saved.
+    """
+    results = {}
+    for scenario in scenarios:
+        print(f"running scenario {scenario.name!r}", file=sys.stderr)
+        with ProcessPoolExecutor(max_workers=1) as executor:
+            results[scenario.name] = executor.submit(run_scenario, scenario, repeat=repeat,
+                                                     quiet=quiet).result()
+    return {
+        "format": RESULTS_FORMAT,
+        "meta": {
+            "conda_press": VERSION,
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "machine": platform.machine(),
+            "cpus": os.cpu_count(),
+            "created": datetime.datetime.now().isoformat(timespec="seconds"),
+            "repeat": repeat,
+        },
+        "scenarios": results,
+    }
+
+
+def save_results(results, filename):
+    with open(filename, "w") as f:
+        json.dump(results, f, indent=2, sort_keys=True)
+
+
+def load_results(filename):
+    with open(filename) as f:
+        results = json.load(f)
+    if results.get("format") != RESULTS_FORMAT:
+        raise ValueError(f"{filename} is not a conda-press benchmark results file "
+                         f"of format {RESULTS_FORMAT}")
+    return results
+
+
+@dataclass
+class Regression:
+    """A stage of a scenario that got slower, or a scenario that needs more
+    memory, than the baseline.
+    """
+
+    scenario: str
+    metric: str
+    baseline: float
+    current: float
+
+    @property
+    def ratio(self):
+        return self.current / self.baseline if self.baseline else float("inf")
+
+
+def compare_results(baseline, current, threshold=DEFAULT_THRESHOLD, min_time=DEFAULT_MIN_TIME):
+    """Finds the regressions of the current results with respect to the
+    baseline. A stage regressed if its fastest time grew by more than the
+    threshold factor, and by more than min_time seconds, which keeps noise
+    in very fast stages from being reported. The peak memory use is compared
+    with the same threshold. Scenarios that are missing from either results,
+    or that were run with different parameters, are not compared.
+
+    Returns
+    -------
+    regressions : list of Regression
+    skipped : list of str
+        Names of the scenarios that could not be compared.
+    """
+    regressions = []
+    skipped = []
+    for name, cur in sorted(current["scenarios"].items()):
+        base = baseline["scenarios"].get(name)
+        if base is None or base["params"] != cur["params"]:
+            skipped.append(name)
+            continue
+        for stage, cur_stage in cur["stages"].items():
+            if stage not in base["stages"]:
+                continue
+            b, c = base["stages"][stage]["min"], cur_stage["min"]
+            if c > b * threshold and c - b > min_time:
+                regressions.append(Regression(name, stage, b, c))
+        b, c = base.get("peak_rss"), cur.get("peak_rss")
+        if b and c and c > b * threshold:
+            regressions.append(Regression(name, "peak_rss", b, c))
+    return regressions, skipped
+
+
+def format_results(results, baseline=None):
+    """Returns the results as a human readable table, with the ratio of
+    each time to the baseline, if given.
+    """
+    lines = []
+    for name, res in sorted(results["scenarios"].items()):
+        base = (baseline or {}).get("scenarios", {}).get(name)
+        if base is not None and base["params"] != res["params"]:
+            base = None
+        params = ", ".join(f"{k}={v}" for k, v in res["params"].items() if k not in ("name", "seed"))
+        lines.append(f"{name} ({params})")
+        for stage, s in res["stages"].items():
+            line = f"    {stage:<18} {s['min']:>9.3f} s  (median {s['median']:.3f} s)"
+            if base is not None and stage in base["stages"] and base["stages"][stage]["min"]:
+                line += f"  x{s['min'] / base['stages'][stage]['min']:.2f}"
+            lines.append(line)
+        if res.get("peak_rss"):
+            line = f"    {'peak_rss':<18} {res['peak_rss'] / (1 << 20):>9.1f} MiB"
+            if base is not None and base.get("peak_rss"):
+                line += f"  x{res['peak_rss'] / base['peak_rss']:.2f}"
+            lines.append(line)
+    return "\n".join(lines)
+
+
+def main(args=None):
+    import argparse
+
+    p = argparse.ArgumentParser(prog="python -m conda_press.benchmark",
+                                description="Benchmarks conda-press on synthetic artifacts.")
+    p.add_argument("--scenario", dest="scenarios", action="append", default=None,
+                   choices=sorted(SCENARIOS),
+                   help="Scenario to run, may be given many times. All are run by default.")
+    p.add_argument("--files", type=int, default=None, help="Number of regular files, "
+                   "for a custom scenario.")
+    p.add_argument("--size", default=None, help="Total size of the regular files, "
+                   "such as 10M, for a custom scenario.")
+    p.add_argument("--elf", type=int, default=None, help="Number of ELF libraries, "
+                   "for a custom scenario.")
+    p.add_argument("--patchelf", type=int, default=None, help="Number of the ELF "
+                   "libraries whose run path is rewritten with patchelf, for a custom "
+                   "scenario.")
+    p.add_argument("--symlinks", type=int, default=None, help="Number of symbolic links, "
+                   "for a custom scenario.")
+    p.add_argument("--fanout", type=int, default=None, help="Number of dependencies, "
+                   "for a custom scenario.")
+    p.add_argument("--repeat", type=int, default=DEFAULT_REPEAT,
+                   help="Number of times each scenario is run.")
+    p.add_argument("-o", "--output", default=None, help="File to save the results to, as JSON.")
+    p.add_argument("--compare", default=None, metavar="BASELINE",
+                   help="Results file to compare with. Exits with an error if any "
+                        "stage regressed.")
+    p.add_argument("--threshold", type=float, default=DEFAULT_THRESHOLD,
+                   help="Slowdown factor that counts as a regression.")
+    p.add_argument("--min-time", type=float, default=DEFAULT_MIN_TIME,
+                   help="Smallest slowdown, in seconds, that counts as a regression.")
+    p.add_argument("-v", "--verbose", action="store_true", default=False,
+                   help="Show the output of the conversions.")
+    ns = p.parse_args(args)
+
+    fields = ("files", "size", "elf", "patchelf", "symlinks", "fanout")
+    custom = {k: getattr(ns, k) for k in fields if getattr(ns, k) is not None}
+    if custom:
+        if "size" in custom:
+            custom["size"] = parse_size(custom["size"])
+        scenarios = [Scenario("custom", **custom)]
+    else:
+        scenarios = [SCENARIOS[name] for name in (ns.scenarios or SCENARIOS)]
+    baseline = None if ns.compare is None else load_results(ns.compare)
+
+    results = run_scenarios(scenarios, repeat=ns.repeat, quiet=not ns.verbose)
+    if ns.output:
+        save_results(results, ns.output)
+    print(format_results(results, baseline=baseline))
+    if baseline is None:
+        return 0
+    regressions, skipped = compare_results(baseline, results, threshold=ns.threshold,
+                                           min_time=ns.min_time)
+    for name in skipped:
+        print(f"scenario {name!r} is not comparable with the baseline")
+    for r in regressions:
+        print(f"REGRESSION: {r.scenario} {r.metric}: {r.baseline:.3f} -> {r.current:.3f} "
+              f"(x{r.ratio:.2f})")
+    return 1 if regressions else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,561 @@
+"""Persistent, size-bounded caches for conda-press"""
+import os
+import json
+import time
+import shutil
+import tempfile
+from hashlib import md5, sha256
+
+from conda_press import __version__ as VERSION
+from conda_press.config import CONVERSION_FIELDS, Config
+
+HASH_CHUNK_SIZE = 1 << 20
+SIZE_SUFFIXES = {"K": 1 << 10, "M": 1 << 20, "G": 1 << 30, "T": 1 << 40}
+
+
+def parse_size(size):
+    """Converts a human readable size, such as "10G" or "512MB", into
+    a number of bytes. Integers are passed through unchanged.
+    """
+    if isinstance(size, int):
+        return size
+    s = size.strip().upper().rstrip("B")
+    if s and s[-1] in SIZE_SUFFIXES:
+        return int(float(s[:-1]) * SIZE_SUFFIXES[s[-1]])
+    return int(s)
+
+
+def file_sha256(path):
+    """Computes the hex sha256 digest of a file, without reading all of it
+    into memory at once.
+    """
+    hasher = sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(HASH_CHUNK_SIZE), b""):
+            hasher.update(chunk)
+    return hasher.hexdigest()
+
+
+def file_digests(path):
+    """Computes the hex md5 and sha256 digests of a file in a single pass."""
+    md5_hasher = md5()
+    sha256_hasher = sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(HASH_CHUNK_SIZE), b""):
+            md5_hasher.update(chunk)
+            sha256_hasher.update(chunk)
+    return md5_hasher.hexdigest(), sha256_hasher.hexdigest()
+
+
+class FileLock:
+    """An exclusive, advisory lock on a file that works between processes,
+    as well as between threads that each acquire their own FileLock.
+
+    Shared locks may be held by many at once, but not along with an exclusive
+    lock. Windows has no shared locks, so there they are not taken at all.
+    """
+
+    def __init__(self, path, shared=False):
+        self.path = path
+        self.shared = shared
+        self._f = None
+
+    def acquire(self, blocking=True):
+        """Acquires the lock, returning whether or not this succeeded. This
+        can only fail when not blocking.
+        """
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        f = open(self.path, "a+b")
+        try:
+            if os.name == "nt" and not self.shared:
+                import msvcrt
+
+                f.seek(0)
+                msvcrt.locking(f.fileno(), msvcrt.LK_LOCK if blocking else msvcrt.LK_NBLCK, 1)
+            elif os.name != "nt":
+                import fcntl
+
+                op = fcntl.LOCK_SH if self.shared else fcntl.LOCK_EX
+                fcntl.flock(f.fileno(), op | (0 if blocking else fcntl.LOCK_NB))
+        except OSError:
+            f.close()
+            if blocking:
+                raise
+            return False
+        self._f = f
+        return True
+
+    def release(self):
+        if self._f is None:
+            return
+        if os.name == "nt" and not self.shared:
+            import msvcrt
+
+            self._f.seek(0)
+            msvcrt.locking(self._f.fileno(), msvcrt.LK_UNLCK, 1)
+        self._f.close()  # closing releases flock()s
+        self._f = None
+
+    def __enter__(self):
+        self.acquire()
+        return self
+
+    def __exit__(self, *exc):
+        self.release()
+
+
+def _dir_size(path):
+    total = 0
+    for root, dirs, files in os.walk(path):
+        for fname in files:
+            total += os.path.getsize(os.path.join(root, fname))
+    return total
+
+
+class WheelCache:
+    """A content addressed cache of converted wheels. Entries are keyed by the
+    sha256 of the artifact, a canonical hash of the configuration fields that
+    affect the conversion, and the conda-press version. When the cache grows
+    beyond its maximum size, the least recently used entries are evicted.
+    """
+
+    entry_filename = "entry.json"
+
+    def __init__(self, cachedir, max_size):
+        """
+        Parameters
+        ----------
+        cachedir : str
+            Directory to keep the cached wheels in.
+        max_size : int or str
+            Maximum size of the cache, in bytes or as a human readable size.
+        """
+        self.cachedir = cachedir
+        self.max_size = parse_size(max_size)
+
+    @classmethod
+    def from_config(cls, config):
+        return cls(config.wheel_cache_dir, config.wheel_cache_max_size)
+
+    def key(self, artifact_path, config=None, sha256_digest=None):
+        """Computes the cache key of the wheel converted from an artifact
+        with a given configuration. The artifact is only hashed if its hex
+        sha256 digest is not given, e.g. because its download verified it.
+        """
+        config = Config() if config is None else config
+        hasher = sha256()
+        hasher.update((sha256_digest or file_sha256(artifact_path)).encode())
+        hasher.update(config.fingerprint(CONVERSION_FIELDS).encode())
+        hasher.update(VERSION.encode())
+        return hasher.hexdigest()
+
+    def _entry_dir(self, key):
+        return os.path.join(self.cachedir, key[:2], key)
+
+    def _read_entry(self, entry_dir):
+        with open(os.path.join(entry_dir, self.entry_filename)) as f:
+            entry = json.load(f)
+        entry["path"] = entry_dir
+        entry["last_used"] = os.path.getmtime(os.path.join(entry_dir, self.entry_filename))
+        return entry
+
+    def get(self, key):
+        """Returns the entry dict for a key, or None if it is not in the cache.
+        Getting an entry marks it as recently used.
+        """
+        entry_dir = self._entry_dir(key)
+        if not os.path.isfile(os.path.join(entry_dir, self.entry_filename)):
+            return None
+        os.utime(os.path.join(entry_dir, self.entry_filename))
+        return self._read_entry(entry_dir)
+
+    def restore(self, entry, dest="."):
+        """Copies the wheel of a cache entry to the dest directory, returning
+        the new filename.
+        """
+        src = os.path.join(entry["path"], entry["wheel"])
+        dst = os.path.join(dest, entry["wheel"])
+        shutil.copyfile(src, dst)
+        return dst
+
+    def put(self, key, wheel_filename=None, **metadata):
+        """Adds a wheel (which may be None, for artifacts that do not produce a
+        wheel) to the cache along with any extra metadata. Returns the entry.
+        """
+        os.makedirs(self.cachedir, exist_ok=True)
+        tmpdir = tempfile.mkdtemp(prefix="entry-", dir=self.cachedir)
+        entry = dict(metadata, key=key, version=VERSION)
+        if wheel_filename is None:
+            entry["wheel"] = None
+        else:
+            entry["wheel"] = os.path.basename(wheel_filename)
+            shutil.copyfile(wheel_filename, os.path.join(tmpdir, entry["wheel"]))
+        with open(os.path.join(tmpdir, self.entry_filename), "w") as f:
+            json.dump(entry, f, sort_keys=True)
+        entry_dir = self._entry_dir(key)
+        os.makedirs(os.path.dirname(entry_dir), exist_ok=True)
+        try:
+            os.replace(tmpdir, entry_dir)
+        except OSError:
+            # some other process got here first, which is just as good.
+            shutil.rmtree(tmpdir, ignore_errors=True)
+        self.evict()
+        return self.get(key)
+
+    def entries(self):
+        """Returns a list of all of the entries in the cache, least recently
+        used first.
+        """
+        entries = []
+        if not os.path.isdir(self.cachedir):
+            return entries
+        for prefix in os.listdir(self.cachedir):
+            prefix_dir = os.path.join(self.cachedir, prefix)
+            if len(prefix) != 2 or not os.path.isdir(prefix_dir):
+                continue
+            for key in os.listdir(prefix_dir):
+                entry_dir = os.path.join(prefix_dir, key)
+                if not os.path.isfile(os.path.join(entry_dir, self.entry_filename)):
+                    continue
+                entry = self._read_entry(entry_dir)
+                entry["size"] = _dir_size(entry_dir)
+                entries.append(entry)
+        entries.sort(key=lambda e: e["last_used"])
+        return entries
+
+    def size(self):
+        """Total size of the cache, in bytes."""
+        return sum(e["size"] for e in self.entries())
+
+    def remove(self, key):
+        shutil.rmtree(self._entry_dir(key), ignore_errors=True)
+
+    def purge(self, keys=None):
+        """Removes the given keys from the cache, or everything if no keys
+        are given. Returns the number of entries removed.
+        """
+        if keys is None:
+            keys = [e["key"] for e in self.entries()]
+        for key in keys:
+            self.remove(key)
+        return len(keys)
+
+    def evict(self):
+        """Removes the least recently used entries until the cache fits in
+        its maximum size. Returns the keys that were evicted.
+        """
+        entries = self.entries()
+        total = sum(e["size"] for e in entries)
+        evicted = []
+        for entry in entries:
+            if total <= self.max_size:
+                break
+            self.remove(entry["key"])
+            total -= entry["size"]
+            evicted.append(entry["key"])
+        return evicted
+
+
+class SolveCache:
+    """A cache of solved dependency trees. Entries are keyed by the spec, the
+    channels, the subdirs and a fingerprint of the repodata that the solver
+    would see, so that any change to the channels results in a new solve.
+    """
+
+    def __init__(self, cachedir):
+        """
+        Parameters
+        ----------
+        cachedir : str
+            Directory to keep the solved package records in.
+        """
+        self.cachedir = cachedir
+
+    @classmethod
+    def from_config(cls, config):
+        return cls(config.solve_cache_dir)
+
+    def key(self, spec, channels, subdirs, fingerprint):
+        """Computes the cache key of the solution for a spec."""
+        data = {"spec": spec, "channels": list(channels), "subdirs": list(subdirs),
+                "fingerprint": fingerprint, "version": VERSION}
+        return sha256(json.dumps(data, sort_keys=True).encode()).hexdigest()
+
+    def _entry_file(self, key):
+        return os.path.join(self.cachedir, key[:2], key + ".json")
+
+    def get(self, key):
+        """Returns the list of package records for a key, in the order that
+        the solver returned them, or None if it is not in the cache.
+        """
+        entry_file = self._entry_file(key)
+        if not os.path.isfile(entry_file):
+            return None
+        from conda.models.records import PackageRecord
+
+        with open(entry_file) as f:
+            entry = json.load(f)
+        return [PackageRecord(**r) for r in entry["records"]]
+
+    def put(self, key, package_recs, **metadata):
+        """Stores the package records of a solution."""
+        entry_file = self._entry_file(key)
+        os.makedirs(os.path.dirname(entry_file), exist_ok=True)
+        entry = dict(metadata, key=key, version=VERSION,
+                     records=[r.dump() for r in package_recs])
+        fd, tmpname = tempfile.mkstemp(suffix=".json.part", dir=os.path.dirname(entry_file))
+        with os.fdopen(fd, "w") as f:
+            json.dump(entry, f, sort_keys=True)
+        os.replace(tmpname, entry_file)
+
+    def purge(self):
+        """Removes all of the cached solutions."""
+        shutil.rmtree(self.cachedir, ignore_errors=True)
+
+
+class ArtifactCache:
+    """A cache of downloaded conda artifacts. Artifacts are kept under their
+    filenames, alongside metadata recording their verified checksums, and
+    per-artifact locks so that several processes may safely download into
+    the same cache. When the cache grows beyond its maximum size, the least
+    recently used artifacts are evicted, apart from those that are pinned,
+    i.e. in use by this or another process.
+    """
+
+    meta_dirname = ".meta"
+    lock_dirname = ".locks"
+    stale_part_age = 86400
+
+    def __init__(self, cachedir, max_size=None):
+        """
+        Parameters
+        ----------
+        cachedir : str
+            Directory to keep the artifacts in.
+        max_size : int, str, or None, optional
+            Maximum size of the cache, in bytes or as a human readable size.
+            The cache is unbounded if None.
+        """
+        self.cachedir = cachedir
+        self.max_size = None if max_size is None else parse_size(max_size)
+
+    @classmethod
+    def from_config(cls, config):
+        return cls(config.artifact_cache_dir, config.artifact_cache_max_size)
+
+    def path(self, fn):
+        return os.path.join(self.cachedir, fn)
+
+    def _meta_file(self, fn):
+        return os.path.join(self.cachedir, self.meta_dirname, fn + ".json")
+
+    def lock(self, fn):
+        """Returns the (unacquired) lock of an artifact."""
+        return FileLock(os.path.join(self.cachedir, self.lock_dirname, fn + ".lock"))
+
+    def _use_lock(self, fn, shared=True):
+        return FileLock(os.path.join(self.cachedir, self.lock_dirname, fn + ".use"),
+                        shared=shared)
+
+    def pin(self, fn):
+        """Pins an artifact, whether or not it is in the cache yet, so that it
+        is not removed while it is in use. Returns the acquired (shared) lock,
+        which unpins the artifact when released. An artifact may be pinned by
+        many at once.
+        """
+        lock = self._use_lock(fn)
+        lock.acquire()
+        return lock
+
+    def _read_meta(self, fn):
+        try:
+            with open(self._meta_file(fn)) as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def _write_meta(self, fn, meta):
+        meta_dir = os.path.dirname(self._meta_file(fn))
+        os.makedirs(meta_dir, exist_ok=True)
+        fd, tmpname = tempfile.mkstemp(suffix=".json.part", dir=meta_dir)
+        with os.fdopen(fd, "w") as f:
+            json.dump(meta, f, sort_keys=True)
+        os.replace(tmpname, self._meta_file(fn))
+
+    @staticmethod
+    def _matches(meta, pkg_record):
+        for name in ("md5", "sha256"):
+            expected = getattr(pkg_record, name, None)
+            if expected and meta.get(name) != expected:
+                return False
+        return True
+
+    def get(self, pkg_record):
+        """Returns the local filename of a package record's artifact, or None
+        if it is not in the cache or does not match the record's checksums.
+        Artifacts whose size or modification time have changed since they
+        were last verified are hashed again. Getting an artifact marks it as
+        recently used.
+        """
+        path = self.path(pkg_record.fn)
+        try:
+            st = os.stat(path)
+        except OSError:
+            return None
+        meta = self._read_meta(pkg_record.fn)
+        verified = (meta is not None and meta.get("size") == st.st_size and
+                    meta.get("mtime_ns") == st.st_mtime_ns)
+        if not verified:
+            md5_digest, sha256_digest = file_digests(path)
+            meta = dict(fn=pkg_record.fn, url=getattr(pkg_record, "url", None), md5=md5_digest,
+                        sha256=sha256_digest, size=st.st_size, mtime_ns=st.st_mtime_ns)
+        if not self._matches(meta, pkg_record):
+            return None
+        if verified:
+            os.utime(self._meta_file(pkg_record.fn))
+        else:
+            self._write_meta(pkg_record.fn, meta)
+        return path
+
+    def verified_sha256(self, path):
+        """Returns the hex sha256 digest of an artifact of the cache that was
+        recorded when it was last verified, or None if the path is not in the
+        cache, or the artifact changed since it was verified.
+        """
+        if os.path.dirname(os.path.abspath(path)) != os.path.abspath(self.cachedir):
+            return None
+        meta = self._read_meta(os.path.basename(path))
+        try:
+            st = os.stat(path)
+        except OSError:
+            return None
+        if (meta is None or meta.get("size") != st.st_size or
+                meta.get("mtime_ns") != st.st_mtime_ns):
+            return None
+        return meta.get("sha256")
+
+    def put(self, pkg_record, filename, md5=None, sha256=None):
+        """Moves a verified download into the cache, returning its new
+        filename. This should be done while holding the artifact's lock.
+        """
+        path = self.path(pkg_record.fn)
+        os.replace(filename, path)
+        st = os.stat(path)
+        meta = dict(fn=pkg_record.fn, url=getattr(pkg_record, "url", None), md5=md5,
+                    sha256=sha256, size=st.st_size, mtime_ns=st.st_mtime_ns)
+        self._write_meta(pkg_record.fn, meta)
+        return path
+
+    def entries(self):
+        """Returns a list of all of the artifacts in the cache, least recently
+        used first.
+        """
+        entries = []
+        if not os.path.isdir(self.cachedir):
+            return entries
+        for fn in os.listdir(self.cachedir):
+            path = self.path(fn)
+            if fn.startswith(".") or fn.endswith(".part") or not os.path.isfile(path):
+                continue
+            meta = self._read_meta(fn)
+            meta_file = self._meta_file(fn)
+            last_used = os.path.getmtime(meta_file if meta is not None else path)
+            entries.append(dict(fn=fn, path=path, size=os.path.getsize(path),
+                                last_used=last_used, meta=meta))
+        entries.sort(key=lambda e: e["last_used"])
+        return entries
+
+    def size(self):
+        """Total size of the artifacts in the cache, in bytes."""
+        return sum(e["size"] for e in self.entries())
+
+    def _remove_unlocked(self, fn):
+        for path in (self.path(fn), self._meta_file(fn)):
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+
+    def remove(self, fn, blocking=True):
+        """Removes an artifact from the cache, returning whether or not it
+        was removed. Artifacts that are locked or pinned by others are skipped,
+        rather than waited for, if not blocking.
+        """
+        lock = self.lock(fn)
+        if not lock.acquire(blocking=blocking):
+            return False
+        try:
+            use_lock = self._use_lock(fn, shared=False)
+            if not use_lock.acquire(blocking=blocking):
+                return False
+            try:
+                self._remove_unlocked(fn)
+            finally:
+                use_lock.release()
+        finally:
+            lock.release()
+        return True
+
+    def evict(self, keep=()):
+        """Removes the least recently used artifacts, other than those in
+        keep or that are currently locked or pinned, until the cache fits in
+        its maximum size. Returns the filenames that were evicted.
+        """
+        if self.max_size is None:
+            return []
+        entries = self.entries()
+        total = sum(e["size"] for e in entries)
+        evicted = []
+        for entry in entries:
+            if total <= self.max_size:
+                break
+            if entry["fn"] in keep or not self.remove(entry["fn"], blocking=False):
+                continue
+            total -= entry["size"]
+            evicted.append(entry["fn"])
+        return evicted
+
+    def prune(self):
+        """Evicts artifacts beyond the maximum size, and removes the partial
+        downloads left behind by processes that were killed. Returns the
+        filenames that were removed.
+        """
+        removed = self.evict()
+        if not os.path.isdir(self.cachedir):
+            return removed
+        now = time.time()
+        for fn in os.listdir(self.cachedir):
+            path = self.path(fn)
+            if fn.endswith(".part") and now - os.path.getmtime(path) > self.stale_part_age:
+                os.remove(path)
+                removed.append(fn)
+        return removed
+
+    def verify(self, remove=True):
+        """Checks all of the artifacts against their recorded checksums.
+        Returns a list of the filenames that failed, which are also removed
+        from the cache if requested. Failed artifacts that are locked or
+        pinned by others are not removed, see remove(), and are left in the
+        cache. Artifacts without any recorded checksums are hashed and recorded.
+        """
+        failed = []
+        for entry in self.entries():
+            fn = entry["fn"]
+            with self.lock(fn):
+                if not os.path.isfile(entry["path"]):
+                    continue
+                md5_digest, sha256_digest = file_digests(entry["path"])
+                meta = self._read_meta(fn) or {}
+                if ((meta.get("md5") or md5_digest) != md5_digest or
+                        (meta.get("sha256") or sha256_digest) != sha256_digest):
+                    failed.append(fn)
+                    continue
+                st = os.stat(entry["path"])
+                meta.update(fn=fn, md5=md5_digest, sha256=sha256_digest, size=st.st_size,
+                            mtime_ns=st.st_mtime_ns)
+                self._write_meta(fn, meta)
+        if remove:
+            # after the lock is released, since remove() takes it as well
+            for fn in failed:
+                self.remove(fn, blocking=False)
+        return failed
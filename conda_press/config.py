@@ -1,11 +1,37 @@
 import os
+import json
 import platform
-import tempfile
+from hashlib import sha256
 from dataclasses import asdict, dataclass, field
 from typing import List, Set, Union
 
-CACHE_DIR = os.path.join(tempfile.gettempdir(), "artifact-cache")
 DEFAULT_CHANNELS = ("conda-forge", "anaconda", "main", "r")
+USER_CACHE_DIR = os.path.join(
+    os.environ.get("XDG_CACHE_HOME", os.path.join(os.path.expanduser("~"), ".cache")),
+    "conda-press",
+)
+CACHE_DIR = os.path.join(USER_CACHE_DIR, "artifacts")
+WHEEL_CACHE_DIR = os.path.join(USER_CACHE_DIR, "wheels")
+REPODATA_CACHE_DIR = os.path.join(USER_CACHE_DIR, "repodata")
+DEFAULT_REPODATA_TTL = 3600
+SOLVE_CACHE_DIR = os.path.join(USER_CACHE_DIR, "solves")
+PYPI_CACHE_DIR = os.path.join(USER_CACHE_DIR, "pypi")
+DEFAULT_PYPI_INDEX_URL = "https://pypi.org/pypi"
+DEFAULT_PYPI_TTL = 86400
+# Config fields that change what the wheel converted from an artifact looks like
+CONVERSION_FIELDS = (
+    "subdir",
+    "channels",
+    "exclude_deps",
+    "add_deps",
+    "skip_python",
+    "strip_symbols",
+    "only_pypi",
+    "pypi_index_url",
+    "include_requirements",
+    "compress_level",
+    "reproducible",
+)
 SYSTEM = platform.system()
 if SYSTEM == "Linux":
     SO_EXT = ".so"
@@ -27,9 +53,31 @@ class Config:
     skip_python: bool = False
     strip_symbols: bool = True
     fatten: bool = False
+    incremental: str = field(default=None)
     merge: bool = False
     only_pypi: bool = False
+    pypi_index_url: str = DEFAULT_PYPI_INDEX_URL
+    pypi_cache: bool = False
+    pypi_cache_dir: str = PYPI_CACHE_DIR
+    pypi_cache_ttl: int = DEFAULT_PYPI_TTL
     include_requirements: bool = True
+    jobs: int = 1
+    download_jobs: int = 4
+    prefetch_depth: int = 4
+    stream: bool = False
+    compress_level: int = field(default=None)
+    reproducible: bool = False
+    artifact_cache_dir: str = CACHE_DIR
+    artifact_cache_max_size: Union[int, str] = "20G"
+    wheel_cache: bool = False
+    wheel_cache_dir: str = WHEEL_CACHE_DIR
+    wheel_cache_max_size: Union[int, str] = "10G"
+    repodata_cache: bool = False
+    repodata_cache_dir: str = REPODATA_CACHE_DIR
+    repodata_cache_ttl: int = DEFAULT_REPODATA_TTL
+    solve_cache: bool = False
+    solve_cache_dir: str = SOLVE_CACHE_DIR
+    force_solve: bool = False
 
     def get_all_channels(self):
         return self.channels + list(DEFAULT_CHANNELS)
@@ -55,6 +103,25 @@ class Config:
         """
         return set(list_deps).union(self.add_deps).difference(self.exclude_deps)
 
+    def fingerprint(self, fields=None) -> str:
+        """Computes a canonical hash of the configuration.
+
+        Parameters
+        ----------
+        fields : sequence of str, optional
+            Only these fields will be part of the hash, if given.
+
+        Returns
+        -------
+        str
+            Hex sha256 digest of the configuration
+        """
+        data = asdict(self)
+        if fields is not None:
+            data = {name: data[name] for name in fields}
+        canon = json.dumps(data, sort_keys=True, default=sorted)
+        return sha256(canon.encode("utf-8")).hexdigest()
+
 
 def get_config_by_yaml(yaml_path, config=None):
     """Free function responsible to create or fill a `Config` object
@@ -102,6 +169,7 @@ def get_config_by_yaml(yaml_path, config=None):
     config.output = yaml_attr("output")
     config.channels = convert_to_list(yaml_attr("channels"))
     config.fatten = yaml_attr("fatten")
+    config.incremental = yaml_attr("incremental")
     config.skip_python = yaml_attr("skip_python")
     config.strip_symbols = yaml_attr("strip_symbols")
     config.merge = yaml_attr("merge")
@@ -116,5 +184,26 @@ def get_config_by_yaml(yaml_path, config=None):
     config.add_deps = convert_to_set(yaml_attr("add_deps"))
     config.exclude_deps = convert_to_set(yaml_attr("exclude_deps"))
     config.only_pypi = yaml_attr("only_pypi")
+    config.pypi_index_url = yaml_attr("pypi_index_url")
+    config.pypi_cache = yaml_attr("pypi_cache")
+    config.pypi_cache_dir = yaml_attr("pypi_cache_dir")
+    config.pypi_cache_ttl = yaml_attr("pypi_cache_ttl")
     config.include_requirements = yaml_attr("include_requirements")
+    config.jobs = yaml_attr("jobs")
+    config.download_jobs = yaml_attr("download_jobs")
+    config.prefetch_depth = yaml_attr("prefetch_depth")
+    config.stream = yaml_attr("stream")
+    config.compress_level = yaml_attr("compress_level")
+    config.reproducible = yaml_attr("reproducible")
+    config.artifact_cache_dir = yaml_attr("artifact_cache_dir")
+    config.artifact_cache_max_size = yaml_attr("artifact_cache_max_size")
+    config.wheel_cache = yaml_attr("wheel_cache")
+    config.wheel_cache_dir = yaml_attr("wheel_cache_dir")
+    config.wheel_cache_max_size = yaml_attr("wheel_cache_max_size")
+    config.repodata_cache = yaml_attr("repodata_cache")
+    config.repodata_cache_dir = yaml_attr("repodata_cache_dir")
+    config.repodata_cache_ttl = yaml_attr("repodata_cache_ttl")
+    config.solve_cache = yaml_attr("solve_cache")
+    config.solve_cache_dir = yaml_attr("solve_cache_dir")
+    config.force_solve = yaml_attr("force_solve")
     return config
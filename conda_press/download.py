@@ -0,0 +1,224 @@
+"""Tools for downloading conda artifacts"""
+import os
+import tempfile
+import threading
+import contextlib
+from hashlib import md5, sha256
+from collections import deque
+from urllib.parse import urlparse
+from urllib.request import url2pathname
+from concurrent.futures import ThreadPoolExecutor
+
+from conda_press.cache import ArtifactCache
+from conda_press.config import CACHE_DIR
+from conda_press.instrument import stage
+
+DOWNLOAD_CHUNK_SIZE = 1 << 20
+DEFAULT_DOWNLOAD_JOBS = 4
+DEFAULT_PREFETCH_DEPTH = 4
+
+_SESSION = None
+_SESSION_LOCK = threading.Lock()
+_CACHE = None
+_CACHE_LOCK = threading.Lock()
+
+
+def get_session():
+    """Returns the requests session that is shared by all downloads, so
+    that connections to the channels get pooled and reused.
+    """
+    global _SESSION
+    with _SESSION_LOCK:
+        if _SESSION is None:
+            import requests
+            from requests.adapters import HTTPAdapter
+
+            session = requests.Session()
+            adapter = HTTPAdapter(pool_connections=16, pool_maxsize=32, max_retries=3)
+            session.mount("http://", adapter)
+            session.mount("https://", adapter)
+            _SESSION = session
+    return _SESSION
+
+
+def get_artifact_cache(config=None):
+    """Returns the artifact cache that downloads go into by default. The
+    first call creates it, from the config if given. It is also recreated if
+    the config points at a different cache.
+    """
+    global _CACHE
+    with _CACHE_LOCK:
+        if config is not None and (_CACHE is None or
+                                   _CACHE.cachedir != config.artifact_cache_dir):
+            _CACHE = ArtifactCache.from_config(config)
+        elif _CACHE is None:
+            _CACHE = ArtifactCache(CACHE_DIR)
+    return _CACHE
+
+
+def set_artifact_cache(cache):
+    """Replaces the artifact cache that downloads go into by default."""
+    global _CACHE
+    with _CACHE_LOCK:
+        _CACHE = cache
+
+
+def _iter_url_chunks(url, session=None):
+    if url.startswith("file://"):
+        with open(url2pathname(urlparse(url).path), "rb") as f:
+            yield from iter(lambda: f.read(DOWNLOAD_CHUNK_SIZE), b"")
+        return
+    session = get_session() if session is None else session
+    with session.get(url, stream=True) as resp:
+        resp.raise_for_status()
+        yield from resp.iter_content(chunk_size=DOWNLOAD_CHUNK_SIZE)
+
+
+def download_package_rec(pkg_record, cachedir=None, session=None, cache=None, pins=None):
+    """Downloads a package record into an artifact cache, returning the
+    local filename. The download is streamed to a temporary file, verified
+    against the md5 and sha256 of the record (when available), and only then
+    moved into its final place. While downloading, the artifact is locked so
+    that other processes wait for it rather than downloading it again.
+
+    The cache may be given directly, or as a directory. Otherwise, the
+    default artifact cache is used.
+
+    If pins, a contextlib.ExitStack, is given, the artifact is pinned before
+    it is looked up, and stays pinned until the stack is closed, so that it
+    is not evicted from the cache while it is in use.
+    """
+    if cache is None:
+        cache = get_artifact_cache() if cachedir is None else ArtifactCache(cachedir)
+    if pins is not None:
+        pins.callback(cache.pin(pkg_record.fn).release)
+    local_fn = cache.get(pkg_record)
+    if local_fn is not None:
+        return local_fn
+    with cache.lock(pkg_record.fn):
+        # someone else may have downloaded it while we waited for the lock
+        local_fn = cache.get(pkg_record)
+        if local_fn is None:
+            local_fn = _download_into_cache(pkg_record, cache, session=session)
+    cache.evict(keep={pkg_record.fn})
+    return local_fn
+
+
+def _download_into_cache(pkg_record, cache, session=None):
+    cachedir = cache.cachedir
+    os.makedirs(cachedir, exist_ok=True)
+    print(f"Downloading {pkg_record.url}")
+    md5_hasher = md5()
+    sha256_hasher = sha256()
+    fd, tmpname = tempfile.mkstemp(prefix=pkg_record.fn + ".", suffix=".part", dir=cachedir)
+    try:
+        with os.fdopen(fd, "wb") as f, stage("download", pkg_record.fn) as s:
+            for chunk in _iter_url_chunks(pkg_record.url, session=session):
+                md5_hasher.update(chunk)
+                sha256_hasher.update(chunk)
+                f.write(chunk)
+                s.add_bytes(len(chunk))
+        expected_md5 = getattr(pkg_record, "md5", None)
+        expected_sha256 = getattr(pkg_record, "sha256", None)
+        if expected_md5 and md5_hasher.hexdigest() != expected_md5:
+            raise RuntimeError(f"md5 of {pkg_record.url} is {md5_hasher.hexdigest()}, "
+                               f"expected {expected_md5}")
+        if expected_sha256 and sha256_hasher.hexdigest() != expected_sha256:
+            raise RuntimeError(f"sha256 of {pkg_record.url} is {sha256_hasher.hexdigest()}, "
+                               f"expected {expected_sha256}")
+        local_fn = cache.put(pkg_record, tmpname, md5=md5_hasher.hexdigest(),
+                             sha256=sha256_hasher.hexdigest())
+    finally:
+        if os.path.exists(tmpname):
+            os.remove(tmpname)
+    print("Download complete")
+    return local_fn
+
+
+def prefetch_package_recs(pkg_records, jobs=DEFAULT_DOWNLOAD_JOBS, cachedir=None, cache=None,
+                          pins=None):
+    """Downloads many package records concurrently. Returns a list of the
+    local filenames, in the same order as the records. If pins is given, the
+    artifacts stay pinned until it is closed, see download_package_rec().
+    """
+    pkg_records = list(pkg_records)
+    if jobs <= 1 or len(pkg_records) <= 1:
+        return [download_package_rec(r, cachedir=cachedir, cache=cache, pins=pins)
+                for r in pkg_records]
+    with ThreadPoolExecutor(max_workers=jobs) as executor:
+        futures = [executor.submit(download_package_rec, r, cachedir=cachedir, cache=cache,
+                                   pins=pins)
+                   for r in pkg_records]
+        return [future.result() for future in futures]
+
+
+def _download_pinned(pkg_record, cachedir=None, cache=None):
+    """Downloads a package record, returning the local filename and the
+    ExitStack that unpins it.
+    """
+    pins = contextlib.ExitStack()
+    try:
+        return download_package_rec(pkg_record, cachedir=cachedir, cache=cache, pins=pins), pins
+    except BaseException:
+        pins.close()
+        raise
+
+
+def _unpin_when_done(future):
+    if not future.cancelled() and future.exception() is None:
+        future.result()[1].close()
+
+
+def iter_prefetched_package_recs(pkg_records, depth=DEFAULT_PREFETCH_DEPTH,
+                                 jobs=DEFAULT_DOWNLOAD_JOBS, cachedir=None, cache=None):
+    """Downloads package records in the background, while they are consumed.
+    Yields (record, local filename) tuples in the same order as the records.
+    Each artifact stays pinned in the cache from before it is downloaded until
+    the next one is asked for, so that other downloads do not evict it.
+
+    Parameters
+    ----------
+    pkg_records : iterable of PackageRecord
+        The records to download.
+    depth : int, optional
+        Number of records that are downloaded ahead of the one being consumed.
+        This bounds the scratch space taken up by downloads that are waiting
+        to be consumed. If 0, each record is only downloaded when it is next.
+    jobs : int, optional
+        Number of threads that download, at most depth of them.
+    cachedir : str, optional
+        Artifact cache directory, as for download_package_rec().
+    cache : ArtifactCache, optional
+        Artifact cache, as for download_package_rec().
+    """
+    records = iter(pkg_records)
+    if depth < 1:
+        for r in records:
+            with contextlib.ExitStack() as pins:
+                yield r, download_package_rec(r, cachedir=cachedir, cache=cache, pins=pins)
+        return
+    pending = deque()
+    with ThreadPoolExecutor(max_workers=max(1, min(jobs, depth))) as executor:
+
+        def submit_next():
+            r = next(records, None)
+            if r is not None:
+                pending.append((r, executor.submit(_download_pinned, r, cachedir=cachedir,
+                                                   cache=cache)))
+
+        try:
+            for _ in range(depth):
+                submit_next()
+            while pending:
+                r, future = pending.popleft()
+                local_fn, pins = future.result()
+                with pins:
+                    # keeps the next downloads going while this one is consumed
+                    submit_next()
+                    yield r, local_fn
+        finally:
+            # the consumer stopped early, don't download what it won't use,
+            # and unpin what was downloaded anyway
+            for _, future in pending:
+                if not future.cancel():
+                    future.add_done_callback(_unpin_when_done)
@@ -0,0 +1,249 @@
+"""Pure-Python tools for inspecting and editing ELF binaries"""
+import os
+import struct
+
+ELF_MAGIC = b"\x7fELF"
+ELFCLASS32 = 1
+ELFCLASS64 = 2
+ELFDATA2LSB = 1
+ELFDATA2MSB = 2
+ET_REL = 1
+ET_EXEC = 2
+ET_DYN = 3
+# object file types that are linked, and so may be stripped of all symbols
+STRIPPABLE_TYPES = (ET_EXEC, ET_DYN)
+PT_LOAD = 1
+PT_DYNAMIC = 2
+SHT_SYMTAB = 2
+DT_NULL = 0
+DT_STRTAB = 5
+DT_STRSZ = 10
+DT_RPATH = 15
+DT_RUNPATH = 29
+RPATH_TAGS = (DT_RPATH, DT_RUNPATH)
+
+# struct formats, without the byte order, for each ELF class
+EHDR_FORMATS = {ELFCLASS32: "HHIIIIIHHHHHH", ELFCLASS64: "HHIQQQIHHHHHH"}
+DYN_FORMATS = {ELFCLASS32: "iI", ELFCLASS64: "qQ"}
+
+
+def is_elf(fname):
+    """Whether or not a file is an ELF binary file, from its magic bytes."""
+    try:
+        with open(fname, "rb") as f:
+            return f.read(4) == ELF_MAGIC
+    except OSError:
+        return False
+
+
+class ElfFile:
+    """Reads the headers, dynamic section and section names of an ELF file.
+    Only the parts of the file that are needed are read, the file is not
+    kept open.
+    """
+
+    def __init__(self, fname):
+        self.fname = fname
+        with open(fname, "rb") as f:
+            self._read(f)
+
+    def _unpack(self, fmt, data, offset=0):
+        return struct.unpack_from(self.byteorder + fmt, data, offset)
+
+    def _read(self, f):
+        ident = f.read(16)
+        if len(ident) < 16 or ident[:4] != ELF_MAGIC:
+            raise ValueError(f"{self.fname} is not an ELF file")
+        self.elfclass = ident[4]
+        if self.elfclass not in EHDR_FORMATS or ident[5] not in (ELFDATA2LSB, ELFDATA2MSB):
+            raise ValueError(f"{self.fname} has an unsupported ELF class or data encoding")
+        self.byteorder = "<" if ident[5] == ELFDATA2LSB else ">"
+        fmt = EHDR_FORMATS[self.elfclass]
+        ehdr = self._unpack(fmt, f.read(struct.calcsize(fmt)))
+        self.type = ehdr[0]
+        phoff, shoff = ehdr[4], ehdr[5]
+        phentsize, phnum, shentsize, shnum, shstrndx = ehdr[8:13]
+        self.segments = self._read_segments(f, phoff, phentsize, phnum)
+        self.sections = self._read_sections(f, shoff, shentsize, shnum, shstrndx)
+        self.dynamic = self._read_dynamic(f)
+        self.strtab_offset = self.strtab_size = None
+        for tag, val, _ in self.dynamic:
+            if tag == DT_STRTAB:
+                self.strtab_offset = self.vaddr_to_offset(val)
+            elif tag == DT_STRSZ:
+                self.strtab_size = val
+        self.rpaths = {}
+        if self.strtab_offset is not None:
+            for tag, val, _ in self.dynamic:
+                if tag in RPATH_TAGS:
+                    self.rpaths[tag] = (self.strtab_offset + val, self._read_cstr(f, self.strtab_offset + val))
+
+    def _read_segments(self, f, phoff, phentsize, phnum):
+        segments = []
+        f.seek(phoff)
+        data = f.read(phentsize * phnum)
+        for i in range(phnum):
+            if self.elfclass == ELFCLASS64:
+                p_type, _, p_offset, p_vaddr, _, p_filesz, _, _ = self._unpack("IIQQQQQQ", data, i * phentsize)
+            else:
+                p_type, p_offset, p_vaddr, _, p_filesz, _, _, _ = self._unpack("IIIIIIII", data, i * phentsize)
+            segments.append((p_type, p_offset, p_vaddr, p_filesz))
+        return segments
+
+    def _read_sections(self, f, shoff, shentsize, shnum, shstrndx):
+        """Returns a list of (name, type) tuples for the sections."""
+        if not shoff:
+            return []
+        fmt = "IIQQQQIIQQ" if self.elfclass == ELFCLASS64 else "IIIIIIIIII"
+        f.seek(shoff)
+        if shnum == 0:
+            # the real number of sections is stored in the size of section 0
+            shnum = self._unpack(fmt, f.read(shentsize))[5]
+            f.seek(shoff)
+        data = f.read(shentsize * shnum)
+        headers = [self._unpack(fmt, data, i * shentsize) for i in range(shnum)]
+        if shstrndx >= len(headers):
+            return [("", h[1]) for h in headers]
+        f.seek(headers[shstrndx][4])
+        names = f.read(headers[shstrndx][5])
+        return [(names[h[0]:names.find(b"\0", h[0])].decode("utf-8", "replace"), h[1])
+                for h in headers]
+
+    def _read_dynamic(self, f):
+        """Returns a list of (tag, value, file offset) tuples for the dynamic
+        section entries, up to the DT_NULL terminator.
+        """
+        for p_type, p_offset, _, p_filesz in self.segments:
+            if p_type == PT_DYNAMIC:
+                break
+        else:
+            return []
+        fmt = DYN_FORMATS[self.elfclass]
+        size = struct.calcsize(fmt)
+        f.seek(p_offset)
+        data = f.read(p_filesz)
+        entries = []
+        for offset in range(0, len(data) - size + 1, size):
+            tag, val = self._unpack(fmt, data, offset)
+            if tag == DT_NULL:
+                break
+            entries.append((tag, val, p_offset + offset))
+        return entries
+
+    def _read_cstr(self, f, offset):
+        f.seek(offset)
+        buf = b""
+        while b"\0" not in buf:
+            chunk = f.read(256)
+            if not chunk:
+                break
+            buf += chunk
+        return buf.partition(b"\0")[0].decode("utf-8", "surrogateescape")
+
+    def vaddr_to_offset(self, vaddr):
+        """Translates a virtual address into an offset in the file."""
+        for p_type, p_offset, p_vaddr, p_filesz in self.segments:
+            if p_type == PT_LOAD and p_vaddr <= vaddr < p_vaddr + p_filesz:
+                return p_offset + vaddr - p_vaddr
+        raise ValueError(f"address {vaddr:#x} is not mapped in {self.fname}")
+
+    @property
+    def rpath(self):
+        """The run path of the file, DT_RUNPATH taking precedence over DT_RPATH,
+        as the dynamic loader does. Empty if neither is set.
+        """
+        for tag in (DT_RUNPATH, DT_RPATH):
+            if tag in self.rpaths:
+                return self.rpaths[tag][1]
+        return ""
+
+    @property
+    def has_symbols(self):
+        """Whether or not the file still has a symbol table or debugging
+        information that stripping would remove.
+        """
+        return any(t == SHT_SYMTAB or name.startswith(".debug") for name, t in self.sections)
+
+    def set_rpath(self, rpath):
+        """Overwrites the existing DT_RPATH and/or DT_RUNPATH strings in place.
+        Returns False, without modifying the file, when there is no entry to
+        overwrite or the new run path is longer than the existing one.
+        """
+        new = rpath.encode("utf-8", "surrogateescape")
+        if not self.rpaths:
+            return False
+        if any(len(new) > len(old.encode("utf-8", "surrogateescape"))
+               for _, old in self.rpaths.values()):
+            return False
+        with open(self.fname, "r+b") as f:
+            for offset, old in self.rpaths.values():
+                f.seek(offset)
+                f.write(new.ljust(len(old.encode("utf-8", "surrogateescape")), b"\0"))
+        self.rpaths = {tag: (offset, rpath) for tag, (offset, _) in self.rpaths.items()}
+        return True
+
+
+def read_rpath(fname):
+    """Returns the run path of an ELF file, or an empty string if it has none."""
+    return ElfFile(fname).rpath
+
+
+def set_rpath(fname, rpath):
+    """Rewrites the run path of an ELF file in place, returns whether or not
+    this was possible. When the new run path does not fit into the space of
+    the existing one, False is returned and the file is left untouched.
+    """
+    return ElfFile(fname).set_rpath(rpath)
+
+
+def has_symbols(fname):
+    """Whether or not an ELF file has symbols that may be stripped."""
+    try:
+        return ElfFile(fname).has_symbols
+    except (OSError, ValueError, struct.error):
+        # be conservative and let strip decide
+        return True
+
+
+def is_strippable(fname):
+    """Whether or not an ELF file is an executable or shared library that
+    still has symbols to strip. Relocatable objects (such as .o files) and
+    files that cannot be read as ELF files are never strippable, since
+    stripping all of their symbols would make them unusable.
+    """
+    try:
+        elf = ElfFile(fname)
+    except (OSError, ValueError, struct.error):
+        return False
+    return elf.type in STRIPPABLE_TYPES and elf.has_symbols
+
+
+def prepend_rpaths(rpaths):
+    """Prepends entries to the run paths of many ELF files in one pass.
+    Files whose run paths already start with the entry are left alone.
+
+    Parameters
+    ----------
+    rpaths : dict
+        Maps file names to the run path entry to prepend.
+
+    Returns
+    -------
+    new_rpaths : dict
+        Maps file names to their full new run paths.
+    leftover : dict
+        The subset of new_rpaths that did not fit in place, and so still
+        need to be set by some other means, such as patchelf.
+    """
+    new_rpaths = {}
+    leftover = {}
+    for fname, prefix in rpaths.items():
+        elf = ElfFile(os.fspath(fname))
+        # keep the other entries, but do not repeat the prepended one
+        entries = [prefix] + [e for e in elf.rpath.split(":") if e and e != prefix]
+        new_rpaths[fname] = new = ":".join(entries)
+        if new == elf.rpath:
+            continue
+        if not elf.set_rpath(new):
+            leftover[fname] = new
+    return new_rpaths, leftover
@@ -0,0 +1,106 @@
+"""Single-pass classification of the files of an extracted artifact
+
+The stages of a conversion (stripping symbols, replacing links, rewriting
+shebangs and run paths, remapping site-packages and writing the wheel) all
+need to know what kind of file each file of an artifact is. Rather than each
+of them stat-ing and opening the files again, the files are classified once,
+with one lstat and, for regular files, one read of their first bytes. The
+stages that rewrite files refresh only the records of those files.
+"""
+import os
+import sys
+import stat
+from typing import NamedTuple
+
+from conda_press.elf import ELF_MAGIC
+
+FILE = "file"
+LINK = "link"
+DIR = "dir"
+OTHER = "other"
+MISSING = "missing"
+
+# enough bytes to tell ELF binaries and scripts apart
+HEAD_SIZE = 4
+
+
+def is_shared_lib(fname):
+    """Whether or not a file is a shared library on this platform, from its
+    extension.
+    """
+    _, ext = os.path.splitext(fname)
+    if sys.platform.startswith('linux'):
+        rtn = (ext == '.so')
+    elif sys.platform.startswith('darwin'):
+        rtn = (ext == '.dylib') or (ext == '.so')  # cpython extensions use .so because ...?
+    elif sys.platform.startswith('win'):
+        rtn = (ext == '.dll')
+    else:
+        rtn = False
+    return rtn
+
+
+class FileRecord(NamedTuple):
+    """What is known about a file of an artifact.
+
+    Parameters
+    ----------
+    kind : str
+        One of FILE, LINK, DIR, OTHER or MISSING. Links are not followed.
+    size : int
+        Size of the file, in bytes.
+    mode : int
+        The st_mode of the file, including its type bits.
+    mtime : float
+        Modification time of the file.
+    elf : bool
+        Whether the file is an ELF binary, from its magic bytes.
+    shebang : bool
+        Whether the file starts with "#!".
+    shared_lib : bool
+        Whether the file is a shared library, from its extension.
+    """
+
+    kind: str
+    size: int = 0
+    mode: int = 0
+    mtime: float = 0.0
+    elf: bool = False
+    shebang: bool = False
+    shared_lib: bool = False
+
+
+def classify_file(absname, name=None):
+    """Returns the FileRecord of a file. The name that the file has in the
+    artifact, which the shared library flag is based on, defaults to absname.
+    """
+    try:
+        st = os.lstat(absname)
+    except FileNotFoundError:
+        return FileRecord(MISSING)
+    shared_lib = is_shared_lib(absname if name is None else name)
+    if stat.S_ISLNK(st.st_mode):
+        kind = LINK
+    elif stat.S_ISDIR(st.st_mode):
+        kind = DIR
+    elif stat.S_ISREG(st.st_mode):
+        kind = FILE
+    else:
+        kind = OTHER
+    head = b""
+    if kind == FILE and st.st_size > 0:
+        try:
+            with open(absname, "rb") as f:
+                head = f.read(HEAD_SIZE)
+        except OSError:
+            pass
+    return FileRecord(kind, size=st.st_size, mode=st.st_mode, mtime=st.st_mtime,
+                      elf=(head == ELF_MAGIC), shebang=head.startswith(b"#!"),
+                      shared_lib=shared_lib)
+
+
+def scan_files(basedir, names):
+    """Classifies files relative to a base directory, returns a dict mapping
+    the names to their FileRecords.
+    """
+    return {name: classify_file(os.path.join(basedir, name), name) for name in names}
@@ -0,0 +1,251 @@
+"""Instrumentation of the stages of the conversion pipeline
+
+The stages of a conversion, such as downloading, extracting and writing, are
+wrapped in :func:`stage` blocks. When a stage finishes, a :class:`StageEvent`
+with its measurements is sent to all of the listeners that were added with
+:func:`add_listener`. When there are no listeners, nothing is measured.
+
+The :class:`TraceRecorder` is a listener that collects the events of a run,
+including those of its worker processes, and writes them to a Chrome trace
+file, which may be viewed in chrome://tracing or https://ui.perfetto.dev.
+"""
+import os
+import json
+import time
+import shutil
+import tempfile
+import threading
+import contextlib
+from dataclasses import asdict, dataclass
+
+from conda_press import __version__ as VERSION
+
+# directory that the events of worker processes are written to, while recording
+PROFILE_DIR_ENV = "CONDA_PRESS_PROFILE_DIR"
+
+_LISTENERS = []
+_LISTENERS_LOCK = threading.Lock()
+_SUBPROCESSES = 0
+_SUBPROCESSES_LOCK = threading.Lock()
+
+
+@dataclass
+class StageEvent:
+    """The measurements of one run of a stage.
+
+    Parameters
+    ----------
+    name : str
+        Name of the stage, such as "extract".
+    label : str
+        What the stage was run on, such as the name of an artifact.
+    start : float
+        When the stage started, in seconds since the epoch.
+    wall : float
+        Wall time of the stage, in seconds.
+    cpu : float
+        CPU time spent while the stage ran, in seconds. This includes all of
+        the threads of the process and the subprocesses that it waited for.
+    nbytes : int
+        Number of bytes that the stage processed.
+    subprocesses : int
+        Number of subprocesses run while the stage ran.
+    pid : int
+        Process that the stage ran in.
+    tid : int
+        Thread that the stage ran in.
+    """
+
+    name: str
+    label: str
+    start: float
+    wall: float
+    cpu: float
+    nbytes: int = 0
+    subprocesses: int = 0
+    pid: int = 0
+    tid: int = 0
+
+
+class Stage:
+    """A running stage, which the instrumented code may report the number of
+    bytes that it processed to.
+    """
+
+    def __init__(self, name, label=""):
+        self.name = name
+        self.label = label
+        self.nbytes = 0
+
+    def add_bytes(self, nbytes):
+        self.nbytes += nbytes
+
+
+def add_listener(listener):
+    """Adds a callable that is called with each StageEvent, in the thread
+    that ran the stage, once the stage finishes.
+    """
+    with _LISTENERS_LOCK:
+        _LISTENERS.append(listener)
+
+
+def remove_listener(listener):
+    with _LISTENERS_LOCK:
+        _LISTENERS.remove(listener)
+
+
+@contextlib.contextmanager
+def listening(listener):
+    """Context manager that adds a listener for the duration of the block."""
+    add_listener(listener)
+    try:
+        yield listener
+    finally:
+        remove_listener(listener)
+
+
+def emit(event):
+    """Sends an event to all of the listeners."""
+    with _LISTENERS_LOCK:
+        listeners = list(_LISTENERS)
+    for listener in listeners:
+        listener(event)
+
+
+def count_subprocess(n=1):
+    """Records that subprocesses were run, for the stages that are running."""
+    global _SUBPROCESSES
+    with _SUBPROCESSES_LOCK:
+        _SUBPROCESSES += n
+
+
+def _cpu_time():
+    t = os.times()
+    return t.user + t.system + t.children_user + t.children_system
+
+
+@contextlib.contextmanager
+def stage(name, label=""):
+    """Context manager that measures a stage, yielding a Stage that the bytes
+    processed may be added to. The event is emitted even if the stage fails.
+    """
+    s = Stage(name, label=label)
+    if not _LISTENERS:
+        yield s
+        return
+    start = time.time()
+    t0 = time.perf_counter()
+    cpu0 = _cpu_time()
+    subprocs0 = _SUBPROCESSES
+    try:
+        yield s
+    finally:
+        emit(StageEvent(name=name, label=str(label), start=start,
+                        wall=time.perf_counter() - t0, cpu=_cpu_time() - cpu0,
+                        nbytes=s.nbytes, subprocesses=_SUBPROCESSES - subprocs0,
+                        pid=os.getpid(), tid=threading.get_ident()))
+
+
+def summarize_events(events):
+    """Totals the measurements of the events by stage name. Returns a dict
+    mapping stage names to dicts of their "count", "wall", "cpu", "nbytes"
+    and "subprocesses", in the order that the stages were first seen.
+    """
+    summary = {}
+    for e in sorted(events, key=lambda e: e.start):
+        s = summary.setdefault(e.name, {"count": 0, "wall": 0.0, "cpu": 0.0, "nbytes": 0,
+                                        "subprocesses": 0})
+        s["count"] += 1
+        s["wall"] += e.wall
+        s["cpu"] += e.cpu
+        s["nbytes"] += e.nbytes
+        s["subprocesses"] += e.subprocesses
+    return summary
+
+
+def format_summary(summary):
+    """Returns the summary of the events as a human readable table."""
+    lines = ["stage                count    wall (s)     cpu (s)        MiB  subprocesses"]
+    for name, s in summary.items():
+        lines.append(f"{name:<18} {s['count']:>7} {s['wall']:>11.2f} {s['cpu']:>11.2f} "
+                     f"{s['nbytes'] / (1 << 20):>10.1f} {s['subprocesses']:>13}")
+    return "\n".join(lines)
+
+
+def chrome_trace(events):
+    """Converts stage events into the Chrome trace event format."""
+    events = sorted(events, key=lambda e: e.start)
+    t0 = events[0].start if events else 0.0
+    trace = []
+    for e in events:
+        trace.append({
+            "name": e.name,
+            "cat": "conda-press",
+            "ph": "X",
+            "ts": (e.start - t0) * 1e6,
+            "dur": e.wall * 1e6,
+            "pid": e.pid,
+            "tid": e.tid,
+            "args": {"label": e.label, "cpu": e.cpu, "bytes": e.nbytes,
+                     "subprocesses": e.subprocesses},
+        })
+    return {"traceEvents": trace, "displayTimeUnit": "ms",
+            "otherData": {"conda_press": VERSION, "stages": summarize_events(events)}}
+
+
+class _EventFileWriter:
+    """Listener that appends events to a file per process in a directory."""
+
+    def __init__(self, directory):
+        self.directory = directory
+        self._lock = threading.Lock()
+
+    def __call__(self, event):
+        fname = os.path.join(self.directory, f"events-{os.getpid()}.jsonl")
+        with self._lock, open(fname, "a") as f:
+            f.write(json.dumps(asdict(event)) + "\n")
+
+
+class TraceRecorder:
+    """Records the stage events of this process, and of the worker processes
+    that it starts while recording, and writes them to a Chrome trace file
+    when stopped. May be used as a context manager.
+    """
+
+    def __init__(self, filename):
+        # absolute, since converting may change directories
+        self.filename = os.path.abspath(filename)
+        self.events = []
+        self._dir = self._writer = None
+
+    def start(self):
+        self._dir = tempfile.mkdtemp(prefix="conda-press-profile-")
+        self._writer = _EventFileWriter(self._dir)
+        # worker processes pick this up when they import this module
+        os.environ[PROFILE_DIR_ENV] = self._dir
+        add_listener(self._writer)
+        return self
+
+    def stop(self):
+        """Stops recording and writes the trace file, returns the events."""
+        remove_listener(self._writer)
+        os.environ.pop(PROFILE_DIR_ENV, None)
+        self.events = []
+        for fname in sorted(os.listdir(self._dir)):
+            with open(os.path.join(self._dir, fname)) as f:
+                self.events.extend(StageEvent(**json.loads(line)) for line in f if line.strip())
+        shutil.rmtree(self._dir, ignore_errors=True)
+        with open(self.filename, "w") as f:
+            json.dump(chrome_trace(self.events), f)
+        return self.events
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+
+if os.environ.get(PROFILE_DIR_ENV):
+    # a worker process started by a process that is recording a trace
+    add_listener(_EventFileWriter(os.environ[PROFILE_DIR_ENV]))
@@ -0,0 +1,341 @@
+"""CLI entry point for conda-press. Only the modules that a command needs are
+imported, so that short invocations, such as merging wheels, start quickly.
+"""
+import os
+import sys
+from argparse import ArgumentParser
+
+from conda_press.config import (
+    CACHE_DIR,
+    CONVERSION_FIELDS,
+    DEFAULT_PYPI_INDEX_URL,
+    DEFAULT_PYPI_TTL,
+    DEFAULT_REPODATA_TTL,
+    PYPI_CACHE_DIR,
+    REPODATA_CACHE_DIR,
+    SOLVE_CACHE_DIR,
+    WHEEL_CACHE_DIR,
+    Config,
+    get_config_by_yaml,
+)
+
+
+def main_cache(args=None):
+    """Entry point for inspecting, pruning, verifying and purging the caches."""
+    p = ArgumentParser("conda-press cache")
+    p.add_argument("action", choices=["list", "prune", "verify", "purge"],
+                   help="list the cached artifacts and wheels, prune them down to their "
+                        "maximum sizes, verify the checksums of the cached artifacts, "
+                        "or purge the cached wheels")
+    p.add_argument("keys", nargs="*", default=None,
+                   help="wheel cache keys to purge, purges everything if not given")
+    p.add_argument("--wheel-cache-dir", dest="wheel_cache_dir", default=WHEEL_CACHE_DIR,
+                   help="Location of the wheel cache.")
+    p.add_argument("--wheel-cache-max-size", dest="wheel_cache_max_size",
+                   default=Config().wheel_cache_max_size,
+                   help="Maximum size of the wheel cache, when pruning.")
+    p.add_argument("--artifact-cache-dir", dest="artifact_cache_dir", default=CACHE_DIR,
+                   help="Location of the artifact cache.")
+    p.add_argument("--artifact-cache-max-size", dest="artifact_cache_max_size",
+                   default=Config().artifact_cache_max_size,
+                   help="Maximum size of the artifact cache, when pruning.")
+    ns = p.parse_args(args=args)
+    from conda_press.cache import ArtifactCache, WheelCache
+
+    cache = WheelCache(ns.wheel_cache_dir, ns.wheel_cache_max_size)
+    artifacts = ArtifactCache(ns.artifact_cache_dir, ns.artifact_cache_max_size)
+    if ns.action == "list":
+        entries = artifacts.entries()
+        for entry in entries:
+            print(f"{entry['size']:>12}  {entry['fn']}")
+        total = sum(e["size"] for e in entries)
+        print(f"{len(entries)} cached artifacts, {total} bytes in {artifacts.cachedir}")
+        entries = cache.entries()
+        for entry in entries:
+            print(f"{entry['key']}  {entry['size']:>12}  {entry['wheel']}")
+        total = sum(e["size"] for e in entries)
+        print(f"{len(entries)} cached wheels, {total} bytes in {cache.cachedir}")
+    elif ns.action == "prune":
+        removed = artifacts.prune()
+        print(f"Pruned {len(removed)} files from {artifacts.cachedir}")
+        evicted = cache.evict()
+        print(f"Pruned {len(evicted)} cached wheels from {cache.cachedir}")
+    elif ns.action == "verify":
+        failed = artifacts.verify()
+        for fn in failed:
+            if os.path.exists(artifacts.path(fn)):
+                print(f"Skipped removing corrupt artifact {fn}, it is in use")
+            else:
+                print(f"Removed corrupt artifact {fn}")
+        print(f"{len(failed)} corrupt artifacts found in {artifacts.cachedir}")
+        return 1 if failed else 0
+    elif ns.action == "purge":
+        n = cache.purge(ns.keys or None)
+        print(f"Purged {n} cached wheels from {cache.cachedir}")
+
+
+def main_inspect(args=None):
+    """Entry point for reporting the wheels that artifacts would convert into,
+    from only their metadata.
+    """
+    p = ArgumentParser("conda-press inspect")
+    p.add_argument("files", nargs="+", help="artifact files to inspect")
+    p.add_argument("--skip-python", dest="skip_python", default=False, action="store_true",
+                   help="Leaves Python out of the requirements.")
+    p.add_argument("--exclude-deps", dest="exclude_deps", default=None, nargs="+",
+                   help="Exclude dependencies from conda package.")
+    p.add_argument("--add-deps", dest="add_deps", default=None, nargs="+",
+                   help="Add dependencies to the wheel.")
+    ns = p.parse_args(args=args)
+    from conda_press.condatools import inspect_artifact
+
+    config = Config(
+        skip_python=ns.skip_python,
+        exclude_deps=set(ns.exclude_deps) if ns.exclude_deps else set(),
+        add_deps=set(ns.add_deps) if ns.add_deps else set(),
+    )
+    for fname in ns.files:
+        report = inspect_artifact(fname, config=config)
+        print(report["filename"])
+        for req in sorted(report["requirements"]):
+            print("    Requires-Dist: " + req)
+
+
+def main(args=None):
+    args = sys.argv[1:] if args is None else args
+    if args and args[0] == "cache":
+        return main_cache(args[1:])
+    elif args and args[0] == "inspect":
+        return main_inspect(args[1:])
+    p = ArgumentParser("conda-press")
+    p.add_argument("files", nargs="*")
+    p.add_argument("--manifest", dest="manifest", default=None,
+                   help="YAML or JSON file listing specs to convert, with optional "
+                        "per-spec configuration. All of the specs are solved up front "
+                        "and shared dependencies are only converted once.")
+    p.add_argument("--subdir", dest="subdir", default=None)
+    p.add_argument("--skip-python", dest="skip_python", default=False,
+                   action="store_true", help="Skips Python packages and "
+                   "their dependencies.")
+    p.add_argument("--strip-symbols", dest="strip_symbols", default=True,
+                   action="store_true", help="strips symbols from libraries (default)")
+    p.add_argument("--no-strip-symbols", "--dont-strip-symbols", dest="strip_symbols",
+                   action="store_false", help="don't strip symbols from libraries")
+    p.add_argument("--channels", dest="channels", nargs="+", default=())
+    p.add_argument("--fatten", dest="fatten", default=False, action="store_true",
+                   help="merges the wheel with all of its dependencies.")
+    p.add_argument("--incremental", dest="incremental", default=None, metavar="FAT_WHEEL",
+                   help="Rebuilds a --fatten wheel from a previous fat wheel. Only the "
+                        "conda records that were added or changed since then are "
+                        "converted. The members of the others are copied from the "
+                        "previous fat wheel as they are.")
+    p.add_argument("--merge", dest="merge", default=False, action="store_true",
+                   help="merges a list of wheels into a single wheel")
+    p.add_argument("-o", "--output", dest="output", default=None,
+                   help="Output file name for merge/fatten. If not given, "
+                        "this will be the last wheel listed.")
+    p.add_argument("--exclude-deps", dest="exclude_deps", default=None, nargs="+",
+                   help="Exclude dependencies from conda package.")
+    p.add_argument("--add-deps", dest="add_deps", default=None, nargs="+",
+                   help="Add dependencies to the wheel.")
+    p.add_argument(
+        "--only-pypi",
+        dest="only_pypi",
+        default=False,
+        action="store_true",
+        help="Remove dependencies which are not on PyPi when converting conda "
+            "package to Python wheel.",
+    )
+    p.add_argument("--pypi-index-url", dest="pypi_index_url", default=DEFAULT_PYPI_INDEX_URL,
+                   help="Index to check dependencies against with --only-pypi. This may "
+                        "be a JSON API, such as the default, or a PEP 503 simple "
+                        "repository, whose URL ends in '/simple'.")
+    p.add_argument("--pypi-cache", dest="pypi_cache", default=False, action="store_true",
+                   help="Persists which dependencies are on the index between runs.")
+    p.add_argument("--pypi-cache-dir", dest="pypi_cache_dir", default=PYPI_CACHE_DIR,
+                   help="Location of the PyPI cache.")
+    p.add_argument("--pypi-cache-ttl", dest="pypi_cache_ttl", default=DEFAULT_PYPI_TTL,
+                   type=int, help="Number of seconds that the PyPI cache is valid for.")
+    p.add_argument("-j", "--jobs", dest="jobs", default=1, type=int,
+                   help="Number of package records to convert concurrently "
+                        "when building a dependency tree.")
+    p.add_argument("--download-jobs", dest="download_jobs", default=4, type=int,
+                   help="Number of artifacts to download concurrently.")
+    p.add_argument("--prefetch-depth", dest="prefetch_depth", default=4, type=int,
+                   help="Number of artifacts of a dependency tree that are downloaded "
+                        "ahead of the ones being converted. This bounds the memory and "
+                        "scratch space used by downloads. With 0, each artifact is only "
+                        "downloaded when it is converted.")
+    p.add_argument("--stream", dest="stream", default=False, action="store_true",
+                   help="Streams artifact members straight into the wheel, only "
+                        "extracting the files that need to be rewritten.")
+    p.add_argument("--compress-level", dest="compress_level", default=None, type=int,
+                   choices=range(10), metavar="{0-9}",
+                   help="zlib compression level of the files in the wheels, from 0 "
+                        "(fastest) to 9 (smallest). Defaults to zlib's own default.")
+    p.add_argument("--reproducible", dest="reproducible", default=False, action="store_true",
+                   help="Writes the same bytes for the same wheel contents. Members get "
+                        "the timestamp of $SOURCE_DATE_EPOCH (or 1980-01-01) and normalized "
+                        "permissions, and are written in a stable order. An identical "
+                        "wheel at the output path is left untouched.")
+    p.add_argument("--artifact-cache-dir", dest="artifact_cache_dir", default=CACHE_DIR,
+                   help="Location of the cache of downloaded artifacts.")
+    p.add_argument("--artifact-cache-max-size", dest="artifact_cache_max_size", default="20G",
+                   help="Maximum size of the artifact cache, e.g. '500M' or '10G'. The "
+                        "least recently used artifacts are evicted beyond this.")
+    p.add_argument("--wheel-cache", dest="wheel_cache", default=False, action="store_true",
+                   help="Reuses previously converted wheels from a persistent cache "
+                        "when the artifact and configuration are identical. Use "
+                        "'conda-press cache list|purge' to inspect and purge it.")
+    p.add_argument("--wheel-cache-dir", dest="wheel_cache_dir", default=WHEEL_CACHE_DIR,
+                   help="Location of the wheel cache.")
+    p.add_argument("--wheel-cache-max-size", dest="wheel_cache_max_size", default="10G",
+                   help="Maximum size of the wheel cache, e.g. '500M' or '10G'. The "
+                        "least recently used wheels are evicted beyond this.")
+    p.add_argument("--repodata-cache", dest="repodata_cache", default=False,
+                   action="store_true",
+                   help="Persists the package records looked up in the channels, so "
+                        "that later runs do not need to query the channels again.")
+    p.add_argument("--repodata-cache-dir", dest="repodata_cache_dir",
+                   default=REPODATA_CACHE_DIR, help="Location of the repodata cache.")
+    p.add_argument("--repodata-cache-ttl", dest="repodata_cache_ttl",
+                   default=DEFAULT_REPODATA_TTL, type=int,
+                   help="Number of seconds that the repodata cache is valid for.")
+    p.add_argument("--solve-cache", dest="solve_cache", default=False, action="store_true",
+                   help="Reuses previously solved dependency trees for as long as the "
+                        "repodata of the channels has not changed.")
+    p.add_argument("--solve-cache-dir", dest="solve_cache_dir", default=SOLVE_CACHE_DIR,
+                   help="Location of the solve cache.")
+    p.add_argument("--force-solve", dest="force_solve", default=False, action="store_true",
+                   help="Always runs the solver, refreshing the solve cache if enabled.")
+    p.add_argument("--profile", dest="profile", default=None, metavar="TRACE_FILE",
+                   help="Records the wall time, CPU time, bytes processed and number of "
+                        "subprocesses of each stage of the conversions to a Chrome trace "
+                        "file, which may be viewed in chrome://tracing, and prints a "
+                        "summary of them.")
+    p.add_argument(
+        "--config",
+        dest="config_file",
+        default=None,
+        help="Receives an yaml configuration file which will set the options for conda-press.\n"
+             "This option has high priority over the others to configure conda-press.",
+    )
+    ns = p.parse_args(args=args)
+
+    config = Config(
+        output=ns.output,
+        subdir=ns.subdir,
+        channels=list(ns.channels),
+        exclude_deps=set(ns.exclude_deps) if ns.exclude_deps else set(),
+        add_deps=set(ns.add_deps) if ns.add_deps else set(),
+        merge=ns.merge,
+        fatten=ns.fatten,
+        incremental=ns.incremental,
+        strip_symbols=ns.strip_symbols,
+        skip_python=ns.skip_python,
+        only_pypi=ns.only_pypi,
+        pypi_index_url=ns.pypi_index_url,
+        pypi_cache=ns.pypi_cache,
+        pypi_cache_dir=ns.pypi_cache_dir,
+        pypi_cache_ttl=ns.pypi_cache_ttl,
+        jobs=ns.jobs,
+        download_jobs=ns.download_jobs,
+        prefetch_depth=ns.prefetch_depth,
+        stream=ns.stream,
+        compress_level=ns.compress_level,
+        reproducible=ns.reproducible,
+        artifact_cache_dir=ns.artifact_cache_dir,
+        artifact_cache_max_size=ns.artifact_cache_max_size,
+        wheel_cache=ns.wheel_cache,
+        wheel_cache_dir=ns.wheel_cache_dir,
+        wheel_cache_max_size=ns.wheel_cache_max_size,
+        repodata_cache=ns.repodata_cache,
+        repodata_cache_dir=ns.repodata_cache_dir,
+        repodata_cache_ttl=ns.repodata_cache_ttl,
+        solve_cache=ns.solve_cache,
+        solve_cache_dir=ns.solve_cache_dir,
+        force_solve=ns.force_solve,
+    )
+
+    if ns.config_file:
+        get_config_by_yaml(ns.config_file, config)
+    if not ns.manifest and not ns.files:
+        p.error("files or a manifest are required")
+
+    if ns.profile is None:
+        recorder = None
+    else:
+        from conda_press.instrument import TraceRecorder
+
+        recorder = TraceRecorder(ns.profile).start()
+    try:
+        run_main(ns, config)
+    finally:
+        if recorder is not None:
+            from conda_press.instrument import format_summary, summarize_events
+
+            events = recorder.stop()
+            print(format_summary(summarize_events(events)))
+            print(f"Wrote profile to {ns.profile}")
+
+
+def run_merge(files, output=None, reproducible=False):
+    """Merges wheels, this only needs the wheel module."""
+    from conda_press.wheel import Wheel, merge
+
+    wheels = {f: Wheel.from_file(f) for f in files}
+    output = files[-1] if output is None else output
+    if output in wheels:
+        wheels[output]._top = True
+    merge(wheels, output=output, reproducible=reproducible)
+
+
+def run_main(ns, config):
+    if ns.merge:
+        run_merge(ns.files, output=ns.output, reproducible=config.reproducible)
+        return
+
+    from conda_press.cache import ArtifactCache
+    from conda_press.download import set_artifact_cache
+    from conda_press.pypi import PypiIndex, set_pypi_index
+    from conda_press.repodata import RepodataIndex, set_repodata_index
+
+    set_artifact_cache(ArtifactCache.from_config(config))
+    set_repodata_index(RepodataIndex.from_config(config))
+    set_pypi_index(PypiIndex.from_config(config))
+
+    if ns.manifest:
+        from conda_press.batch import BatchEntry, convert_entries, load_manifest
+
+        entries = load_manifest(ns.manifest, config)
+        entries.extend(BatchEntry(f, config) for f in ns.files)
+        report = convert_entries(entries, config=config)
+        print(report.format())
+        return
+
+    run_convert_wheel(ns.files, config)
+
+
+def run_convert_wheel(files, config):
+    from conda_press.condatools import artifact_ref_dependency_tree_to_wheels, artifact_to_wheel
+    from conda_press.wheel import fatten_from_seen
+
+    for fname in files:
+        if "=" in fname:
+            print(f'Converting {fname} tree to wheels')
+            seen = artifact_ref_dependency_tree_to_wheels(fname, config=config)
+            if config.fatten:
+                fatten_from_seen(
+                    seen, output=config.output, skipped_deps=config.exclude_deps,
+                    fingerprint=config.fingerprint(CONVERSION_FIELDS),
+                    reproducible=config.reproducible,
+                )
+        elif os.path.isfile(fname):
+            print(f'Converting {fname} to wheel')
+            artifact_to_wheel(fname, config=config)
+        else:
+            raise ValueError(f"File receive is not valid.\nFiles: {fname}\n")
+
+
+if __name__ == "__main__":
+    main()
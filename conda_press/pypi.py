@@ -0,0 +1,171 @@
+"""Tools for checking which packages are available on PyPI, or a mirror of it"""
+import os
+import re
+import json
+import time
+import tempfile
+import threading
+from hashlib import sha256
+from urllib.parse import urlparse
+from urllib.request import url2pathname
+from concurrent.futures import ThreadPoolExecutor
+
+from conda_press.config import DEFAULT_PYPI_INDEX_URL, DEFAULT_PYPI_TTL
+
+DEFAULT_PYPI_JOBS = 16
+
+_INDEX = None
+_INDEX_LOCK = threading.Lock()
+
+
+def project_name(req):
+    """Gets the project name from a requirement string, such as "numpy >=1.17"."""
+    return re.match(r"[A-Za-z0-9_.-]*", req.strip()).group(0)
+
+
+def normalize_name(name):
+    """Normalizes a project name, as described in PEP 503."""
+    return re.sub(r"[-_.]+", "-", name).lower()
+
+
+class PypiIndex:
+    """Answers whether projects exist on a package index, caching the answers.
+
+    The index URL may either point at a JSON API, such as
+    "https://pypi.org/pypi", in which case "<url>/<name>/json" is looked up,
+    or at a PEP 503 simple repository, whose URL ends in "/simple", in which
+    case "<url>/<name>/" is looked up. file:// URLs are supported for both,
+    for mirrors kept on the local filesystem.
+
+    Answers are held in memory for the whole run, and if a cache directory is
+    given, also persisted there for the time-to-live.
+    """
+
+    def __init__(self, index_url=DEFAULT_PYPI_INDEX_URL, cachedir=None, ttl=DEFAULT_PYPI_TTL,
+                 jobs=DEFAULT_PYPI_JOBS):
+        """
+        Parameters
+        ----------
+        index_url : str, optional
+            URL of the JSON API or PEP 503 simple repository of the index.
+        cachedir : str or None, optional
+            Directory to persist the answers in, they are only held in memory if None.
+        ttl : int or float, optional
+            Number of seconds that persisted answers are valid for.
+        jobs : int, optional
+            Maximum number of concurrent lookups.
+        """
+        self.index_url = index_url.rstrip("/")
+        self.simple = self.index_url.endswith("/simple")
+        self.cachedir = cachedir
+        self.ttl = ttl
+        self.jobs = jobs
+        self._exists = None
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_config(cls, config):
+        cachedir = config.pypi_cache_dir if config.pypi_cache else None
+        return cls(index_url=config.pypi_index_url, cachedir=cachedir,
+                   ttl=config.pypi_cache_ttl)
+
+    def project_url(self, name):
+        name = normalize_name(name)
+        if self.simple:
+            return f"{self.index_url}/{name}/"
+        return f"{self.index_url}/{name}/json"
+
+    def _cache_file(self):
+        key = sha256(self.index_url.encode()).hexdigest()
+        return os.path.join(self.cachedir, key + ".json")
+
+    def _load(self):
+        """Returns the name to (exists, time checked) dict, reading it from
+        the cache directory the first time.
+        """
+        if self._exists is not None:
+            return self._exists
+        self._exists = {}
+        if self.cachedir is not None and os.path.isfile(self._cache_file()):
+            with open(self._cache_file()) as f:
+                data = json.load(f)
+            now = time.time()
+            self._exists = {name: tuple(v) for name, v in data["projects"].items()
+                            if now - v[1] < self.ttl}
+        return self._exists
+
+    def _persist(self):
+        if self.cachedir is None:
+            return
+        os.makedirs(self.cachedir, exist_ok=True)
+        data = {"index_url": self.index_url, "projects": self._exists}
+        fd, tmpname = tempfile.mkstemp(suffix=".json.part", dir=self.cachedir)
+        with os.fdopen(fd, "w") as f:
+            json.dump(data, f, sort_keys=True)
+        os.replace(tmpname, self._cache_file())
+
+    def _lookup(self, name):
+        """Asks the index whether a project exists. Returns None if the
+        answer is unknown, such as when the index could not be reached.
+        """
+        url = self.project_url(name)
+        if url.startswith("file://"):
+            path = url2pathname(urlparse(url).path)
+            return os.path.isdir(path) if self.simple else os.path.isfile(path)
+        from conda_press.download import get_session
+
+        try:
+            resp = get_session().get(url, timeout=30)
+        except Exception:
+            return None
+        with resp:
+            if resp.status_code == 200:
+                return True
+            elif resp.status_code in (404, 410):
+                return False
+        return None
+
+    def exists(self, names):
+        """Returns a dict mapping each of the project names to whether or
+        not it exists on the index. Names that have not been seen before are
+        looked up concurrently.
+        """
+        names = set(names)
+        with self._lock:
+            known = self._load()
+            missing = sorted({normalize_name(n) for n in names} - set(known))
+        if missing:
+            with ThreadPoolExecutor(max_workers=max(1, min(self.jobs, len(missing)))) as executor:
+                answers = list(executor.map(self._lookup, missing))
+            now = time.time()
+            with self._lock:
+                known.update({n: (a, now) for n, a in zip(missing, answers) if a is not None})
+                self._persist()
+        return {n: known.get(normalize_name(n), (False,))[0] for n in names}
+
+    def clear(self):
+        """Forgets all of the answers held in memory."""
+        with self._lock:
+            self._exists = None
+
+
+def get_pypi_index(config=None):
+    """Returns the PyPI index that is shared for the whole run. The first
+    call creates it, from the config if given. It is also recreated if the
+    config points at a different index URL.
+    """
+    global _INDEX
+    with _INDEX_LOCK:
+        if config is not None and (_INDEX is None or
+                                   _INDEX.index_url != config.pypi_index_url.rstrip("/")):
+            _INDEX = PypiIndex.from_config(config)
+        elif _INDEX is None:
+            _INDEX = PypiIndex()
+    return _INDEX
+
+
+def set_pypi_index(index):
+    """Replaces the PyPI index that is shared for the whole run."""
+    global _INDEX
+    with _INDEX_LOCK:
+        _INDEX = index
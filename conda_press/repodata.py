@@ -0,0 +1,245 @@
+"""An in-process (and optionally persistent) index of channel repodata"""
+import os
+import sys
+import json
+import time
+import atexit
+import tempfile
+import threading
+from hashlib import sha256
+from urllib.parse import urlparse
+from urllib.request import url2pathname
+from concurrent.futures import ThreadPoolExecutor
+
+from conda_press.config import DEFAULT_REPODATA_TTL
+
+_INDEX = None
+_INDEX_LOCK = threading.Lock()
+
+
+def python_tag():
+    return "py{vi.major}{vi.minor}".format(vi=sys.version_info)
+
+
+def filter_python_records(pkg_records, pytag=None):
+    """Removes the records of Python packages that were built for other
+    versions of Python.
+    """
+    pytag = python_tag() if pytag is None else pytag
+    return [r for r in pkg_records if "py" not in r.build or pytag in r.build]
+
+
+class RepodataIndex:
+    """Maps (channel, subdir, package name) to the package records available,
+    so that repeated lookups during a run are dictionary hits rather than
+    SubdirData queries. Records for architecture specific subdirs are
+    already filtered down to the running version of Python.
+
+    If a cache directory is given, the records are also persisted there, one
+    file per channel and subdir, so that later runs start warm. The files are
+    written by flush() or close(), which is done at exit for the shared
+    index, rather than on every lookup. Each name is persisted with the
+    time that its records were queried, and names older than the
+    time-to-live are ignored and dropped from the file.
+    """
+
+    def __init__(self, cachedir=None, ttl=DEFAULT_REPODATA_TTL):
+        """
+        Parameters
+        ----------
+        cachedir : str or None, optional
+            Directory to persist the index in, it is only held in memory if None.
+        ttl : int or float, optional
+            Number of seconds that persisted records are valid for.
+        """
+        self.cachedir = cachedir
+        self.ttl = ttl
+        self._subdirs = {}
+        self._fetched = {}
+        self._dirty = set()
+        self._lock = threading.RLock()
+
+    @classmethod
+    def from_config(cls, config):
+        cachedir = config.repodata_cache_dir if config.repodata_cache else None
+        return cls(cachedir=cachedir, ttl=config.repodata_cache_ttl)
+
+    def _cache_file(self, channel, subdir):
+        key = sha256(f"{channel}/{subdir}".encode()).hexdigest()
+        return os.path.join(self.cachedir, key + ".json")
+
+    def _load(self, channel, subdir):
+        """Returns the (possibly persisted) name to records dict of a subdir"""
+        key = (channel, subdir)
+        if key in self._subdirs:
+            return self._subdirs[key]
+        names = {}
+        fetched = {}
+        if self.cachedir is not None and os.path.isfile(self._cache_file(channel, subdir)):
+            from conda.models.records import PackageRecord
+
+            with open(self._cache_file(channel, subdir)) as f:
+                data = json.load(f)
+            now = time.time()
+            for name, recs in data["names"].items():
+                # names without a fetch time are from older files, and expired
+                fetched_at = data.get("fetched", {}).get(name, 0)
+                if now - fetched_at < self.ttl:
+                    names[name] = [PackageRecord(**r) for r in recs]
+                    fetched[name] = fetched_at
+        self._subdirs[key] = names
+        self._fetched[key] = fetched
+        return names
+
+    def _persist(self, channel, subdir):
+        if self.cachedir is None:
+            return
+        os.makedirs(self.cachedir, exist_ok=True)
+        names = self._subdirs[(channel, subdir)]
+        fetched = self._fetched[(channel, subdir)]
+        # names that expired during the run are not written back
+        now = time.time()
+        fresh = sorted(name for name in names if now - fetched[name] < self.ttl)
+        data = {"channel": channel, "subdir": subdir,
+                "names": {name: [r.dump() for r in names[name]] for name in fresh},
+                "fetched": {name: fetched[name] for name in fresh}}
+        fd, tmpname = tempfile.mkstemp(suffix=".json.part", dir=self.cachedir)
+        with os.fdopen(fd, "w") as f:
+            json.dump(data, f)
+        os.replace(tmpname, self._cache_file(channel, subdir))
+
+    def records(self, channel, subdir, name):
+        """Returns all of the package records of a package name in a channel
+        and subdir. These are only queried from the channel once.
+        """
+        with self._lock:
+            names = self._load(channel, subdir)
+            if name not in names:
+                from conda.api import SubdirData
+
+                pkg_records = list(SubdirData(channel + "/" + subdir).query(name))
+                if subdir != "noarch":
+                    pkg_records = filter_python_records(pkg_records)
+                names[name] = pkg_records
+                self._fetched[(channel, subdir)][name] = time.time()
+                self._dirty.add((channel, subdir))
+            return names[name]
+
+    def query(self, channel, subdir, spec):
+        """Returns the package records in a channel and subdir that match a
+        spec string, such as "numpy=1.17".
+        """
+        from conda.models.match_spec import MatchSpec
+
+        match_spec = MatchSpec(spec)
+        return [r for r in self.records(channel, subdir, match_spec.name)
+                if match_spec.match(r)]
+
+    def flush(self):
+        """Persists the records of the subdirs that were queried since the
+        last flush, one write per subdir.
+        """
+        with self._lock:
+            for channel, subdir in sorted(self._dirty):
+                self._persist(channel, subdir)
+            self._dirty.clear()
+
+    def close(self):
+        """Persists any records that have not been yet, the index may still
+        be used afterwards.
+        """
+        self.flush()
+
+    def clear(self):
+        """Forgets all of the records held in memory, after persisting them."""
+        with self._lock:
+            self.flush()
+            self._subdirs.clear()
+            self._fetched.clear()
+
+
+def repodata_urls(channels, subdirs):
+    """Returns the URLs of the repodata.json files for channels and subdirs.
+    Channels may be names, such as "conda-forge", or full URLs.
+    """
+    from conda.models.channel import Channel
+
+    urls = []
+    for channel in channels:
+        for url in Channel(channel).urls(with_credentials=True, subdirs=tuple(subdirs)):
+            urls.append(url + "/repodata.json")
+    return urls
+
+
+def _repodata_url_state(url, session=None):
+    """Returns a string that changes whenever the repodata at a URL does,
+    or None if this could not be determined.
+    """
+    if url.startswith("file://"):
+        try:
+            st = os.stat(url2pathname(urlparse(url).path))
+        except OSError:
+            return None
+        return f"{st.st_size}:{st.st_mtime_ns}"
+    from conda_press.download import get_session
+
+    session = get_session() if session is None else session
+    try:
+        resp = session.head(url, allow_redirects=True, timeout=30)
+        resp.raise_for_status()
+    except Exception:
+        return None
+    headers = [resp.headers.get(h) for h in ("ETag", "Last-Modified", "Content-Length")]
+    if not any(headers):
+        return None
+    return ":".join(h or "" for h in headers)
+
+
+def repodata_fingerprint(channels, subdirs, session=None):
+    """Computes a hash that identifies the current repodata of a set of
+    channels and subdirs, without downloading any of it. Remote repodata is
+    identified by the ETag, Last-Modified and Content-Length headers of a HEAD
+    request and local repodata by its size and modification time.
+
+    Returns None if the state of any of the repodata could not be
+    determined, such as when a channel is unreachable.
+    """
+    urls = repodata_urls(channels, subdirs)
+    with ThreadPoolExecutor(max_workers=max(1, min(8, len(urls)))) as executor:
+        states = list(executor.map(lambda url: _repodata_url_state(url, session=session), urls))
+    if any(state is None for state in states):
+        return None
+    hasher = sha256()
+    for url, state in zip(urls, states):
+        hasher.update(f"{url} {state}\n".encode())
+    return hasher.hexdigest()
+
+
+def get_repodata_index(config=None):
+    """Returns the repodata index that is shared for the whole run. The first
+    call creates it, from the config if given.
+    """
+    global _INDEX
+    with _INDEX_LOCK:
+        if _INDEX is None:
+            _INDEX = RepodataIndex() if config is None else RepodataIndex.from_config(config)
+    return _INDEX
+
+
+def set_repodata_index(index):
+    """Replaces the repodata index that is shared for the whole run, closing
+    the one it replaces.
+    """
+    global _INDEX
+    with _INDEX_LOCK:
+        old, _INDEX = _INDEX, index
+    if old is not None and old is not index:
+        old.close()
+
+
+@atexit.register
+def _close_repodata_index():
+    with _INDEX_LOCK:
+        index = _INDEX
+    if index is not None:
+        index.close()
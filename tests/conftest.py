@@ -1,9 +1,17 @@
 import os
+import io
 import sys
+import json
 import glob
+import hashlib
+import tarfile
 import tempfile
 import builtins
+import functools
+import threading
 import subprocess
+from http.server import ThreadingHTTPServer, SimpleHTTPRequestHandler
+from zipfile import ZipFile
 
 import pytest
 import requests
@@ -166,3 +174,89 @@ def xonsh(request):
 @pytest.fixture
 def data_folder(request):
     return os.path.join(os.path.dirname(request.module.__file__), "data")
+
+
+def _make_tarball(files, links, mode):
+    buf = io.BytesIO()
+    with tarfile.open(fileobj=buf, mode=mode) as tf:
+        for arcname, data in files.items():
+            tinfo = tarfile.TarInfo(arcname)
+            tinfo.size = len(data)
+            tinfo.mode = 0o755 if data.startswith((b"#!", b"\x7fELF")) else 0o644
+            tinfo.mtime = 1500000000
+            tf.addfile(tinfo, io.BytesIO(data))
+        for arcname, target in links.items():
+            tinfo = tarfile.TarInfo(arcname)
+            tinfo.type = tarfile.SYMTYPE
+            tinfo.linkname = target
+            tinfo.mtime = 1500000000
+            tf.addfile(tinfo)
+    return buf.getvalue()
+
+
+@pytest.fixture
+def make_artifact(tmpdir):
+    """Factory fixture for small, synthetic conda artifacts. Files are given
+    as a mapping of relative paths to bytes and links as a mapping of
+    relative paths to link targets.
+    """
+    def create_artifact(name="synthetic", version="1.0", build="0", files=None,
+                        links=None, depends=(), subdir="linux-64", ext=".tar.bz2",
+                        paths_json=None):
+        files = {} if files is None else files
+        links = {} if links is None else links
+        index = {"name": name, "version": version, "build": build,
+                 "build_number": 0, "depends": list(depends), "subdir": subdir}
+        info = {
+            "info/index.json": json.dumps(index).encode(),
+            "info/files": "\n".join(sorted(list(files) + list(links))).encode(),
+            "info/test/run_test.sh": b"exit 0\n",
+            "info/recipe/build.sh": b"make install\n",
+        }
+        if paths_json is not None:
+            # paths_json maps file names to sha256 digests that override the real ones
+            paths = [{"_path": p, "path_type": "hardlink", "size_in_bytes": len(data),
+                      "sha256": paths_json.get(p, hashlib.sha256(data).hexdigest())}
+                     for p, data in sorted(files.items())]
+            paths += [{"_path": p, "path_type": "softlink"} for p in sorted(links)]
+            info["info/paths.json"] = json.dumps({"paths": paths, "paths_version": 1}).encode()
+        canonical_name = f"{name}-{version}-{build}"
+        fname = str(tmpdir.join(canonical_name + ext))
+        if ext == ".conda":
+            import zstandard
+
+            cctx = zstandard.ZstdCompressor()
+            with ZipFile(fname, "w") as zf:
+                zf.writestr("metadata.json", json.dumps({"conda_pkg_format_version": 2}))
+                info_tar = _make_tarball(info, {}, "w")
+                zf.writestr(f"info-{canonical_name}.tar.zst", cctx.compress(info_tar))
+                pkg_tar = _make_tarball(files, links, "w")
+                zf.writestr(f"pkg-{canonical_name}.tar.zst", cctx.compress(pkg_tar))
+        else:
+            mode = {".tar.bz2": "w:bz2", ".tar.gz": "w:gz", ".tar": "w"}[ext]
+            with open(fname, "wb") as f:
+                f.write(_make_tarball(dict(info, **files), links, mode))
+        return fname
+
+    return create_artifact
+
+
+class _QuietHandler(SimpleHTTPRequestHandler):
+
+    def log_message(self, format, *args):
+        pass
+
+
+@pytest.fixture
+def http_channel(tmpdir):
+    """Serves a (fake) channel directory over HTTP on localhost, yields the
+    channel directory and its URL.
+    """
+    channel_dir = tmpdir.mkdir("channel")
+    handler = functools.partial(_QuietHandler, directory=str(channel_dir))
+    server = ThreadingHTTPServer(("127.0.0.1", 0), handler)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield channel_dir, f"http://127.0.0.1:{server.server_address[1]}"
+    server.shutdown()
+    server.server_close()
@@ -0,0 +1,175 @@
+import os
+import json
+
+import pytest
+
+from conda_press.batch import BatchEntry, convert_entries, entries_from_manifest, load_manifest
+from conda_press.config import Config
+
+
+def test_entries_from_manifest():
+    config = Config(channels=["my-channel"])
+    entries = entries_from_manifest({"specs": [
+        "numpy=1.17",
+        {"spec": "scipy=1.3", "skip_python": True, "exclude_deps": "libgfortran",
+         "channels": "other"},
+    ]}, config=config)
+    assert [e.spec for e in entries] == ["numpy=1.17", "scipy=1.3"]
+    assert entries[0].config is config
+    assert entries[1].config.skip_python
+    assert entries[1].config.exclude_deps == {"libgfortran"}
+    assert entries[1].config.channels == ["other"]
+    # the overrides do not leak into the shared config
+    assert not config.skip_python
+
+
+@pytest.mark.parametrize("item", [
+    {"spec": "numpy", "not_an_option": 1},
+    {"spec": "numpy", "jobs": 4},
+    {"spec": "numpy", "prefetch_depth": 0},
+])
+def test_entries_from_manifest_bad_override(item):
+    with pytest.raises(ValueError):
+        entries_from_manifest([item])
+
+
+@pytest.mark.parametrize("ext", [".json", ".yaml"])
+def test_load_manifest(tmpdir, ext):
+    manifest = tmpdir.join("manifest" + ext)
+    if ext == ".json":
+        manifest.write(json.dumps(["numpy", {"spec": "scipy", "fatten": True}]))
+    else:
+        manifest.write("specs:\n  - numpy\n  - spec: scipy\n    fatten: true\n")
+    entries = load_manifest(str(manifest))
+    assert [(e.spec, e.config.fatten) for e in entries] == [("numpy", False), ("scipy", True)]
+
+
+def test_convert_entries_builds_shared_deps_once(xonsh, tmpdir, make_artifact, monkeypatch):
+    from conda.models.records import PackageRecord
+    from conda_press import condatools
+
+    def record(name, depends=()):
+        path = make_artifact(name=name, files={f"share/{name}.txt": name.encode()},
+                             depends=depends)
+        return PackageRecord(name=name, version="1.0", build="0", build_number=0,
+                             channel="local", subdir="linux-64", depends=list(depends),
+                             fn=os.path.basename(path), url="file://" + path)
+
+    common = record("common")
+    solutions = {
+        "a": [common, record("a", ["common"])],
+        "b": [common, record("b", ["common"])],
+    }
+    converted = []
+    package_to_wheel = condatools.package_to_wheel
+
+    def counting_package_to_wheel(package_rec, config=None, _top=True):
+        converted.append(package_rec.name)
+        return package_to_wheel(package_rec, config=config, _top=_top)
+
+    monkeypatch.setattr(condatools, "solve_artifact_ref", lambda spec, config=None: solutions[spec])
+    monkeypatch.setattr(condatools, "package_to_wheel", counting_package_to_wheel)
+    config = Config(strip_symbols=False, artifact_cache_dir=str(tmpdir.join("artifacts")))
+    fat_config = Config(strip_symbols=False, fatten=True, output=str(tmpdir.join("bfat-1.0-py2.py3-none-linux_x86_64.whl")),
+                        artifact_cache_dir=config.artifact_cache_dir)
+    entries = [BatchEntry("a", config), BatchEntry("b", fat_config)]
+    out = tmpdir.mkdir("out")
+    with out.as_cwd():
+        report = convert_entries(entries, config=config)
+        assert sorted(converted) == ["a", "b", "common"]
+        assert [(s.spec, s.built, s.shared) for s in report.specs] == [("a", 2, 0), ("b", 1, 1)]
+        assert sorted(key[0] for key in report.build_times) == sorted(
+            str(r.to_match_spec()) for r in solutions["a"] + solutions["b"][1:])
+        # the shared wheel survives fattening the second spec
+        assert sorted(os.listdir(str(out))) == [f"{name}-1.0-0_0-py2.py3-none-linux_x86_64.whl"
+                                                for name in ("a", "b", "common")]
+    assert report.specs[1].fat_wheel == fat_config.output
+    assert os.path.isfile(fat_config.output)
+    assert "3 unique packages converted for 2 specs" in report.format()
+
+
+def test_convert_entries_keeps_variants_apart(xonsh, tmpdir, make_artifact, monkeypatch):
+    from zipfile import ZipFile
+    from conda.models.records import PackageRecord
+    from conda_press import condatools
+    from conda_press.batch import VARIANTS_DIR
+
+    def record(name, depends=()):
+        path = make_artifact(name=name, files={f"share/{name}.txt": name.encode() * 1000},
+                             depends=depends)
+        return PackageRecord(name=name, version="1.0", build="0", build_number=0,
+                             channel="local", subdir="linux-64", depends=list(depends),
+                             fn=os.path.basename(path), url="file://" + path)
+
+    common = record("common")
+    solutions = {
+        "a": [common, record("a", ["common"])],
+        "b": [common, record("b", ["common"])],
+    }
+    monkeypatch.setattr(condatools, "solve_artifact_ref", lambda spec, config=None: solutions[spec])
+    out = tmpdir.mkdir("out")
+    config = Config(strip_symbols=False, artifact_cache_dir=str(tmpdir.join("artifacts")))
+    # the overrides change how the shared record is converted
+    stored = Config(strip_symbols=False, compress_level=0, fatten=True,
+                    output=str(out.join("b-1.0-0_0-py2.py3-none-linux_x86_64.whl")),
+                    artifact_cache_dir=config.artifact_cache_dir)
+    entries = [BatchEntry("a", config), BatchEntry("b", stored)]
+    common_whl = "common-1.0-0_0-py2.py3-none-linux_x86_64.whl"
+    with out.as_cwd():
+        report = convert_entries(entries, config=config)
+    assert [(s.spec, s.built, s.shared) for s in report.specs] == [("a", 2, 0), ("b", 2, 0)]
+    common_keys = [key for key in report.build_times if key[0] == str(common.to_match_spec())]
+    assert len(common_keys) == 2
+    variants = out.join(VARIANTS_DIR).listdir()
+    assert len(variants) == 1
+    with ZipFile(str(out.join(common_whl))) as zf:
+        deflated = zf.getinfo("share/common.txt")
+        assert deflated.compress_size < deflated.file_size
+    with ZipFile(str(variants[0].join(common_whl))) as zf:
+        stored_info = zf.getinfo("share/common.txt")
+        assert stored_info.compress_size >= stored_info.file_size
+    # the fat wheel of the second spec has its own variant of the shared record
+    with ZipFile(stored.output) as zf:
+        assert zf.getinfo("share/common.txt").compress_size == stored_info.compress_size
+    assert report.format().count("(variant ") == 2
+
+
+@pytest.mark.parametrize("jobs", [1, 2])
+def test_convert_entries_prefetches_within_cache_size(xonsh, tmpdir, make_artifact, monkeypatch,
+                                                      jobs):
+    from conda.models.records import PackageRecord
+    from conda_press import condatools, download
+
+    solutions = {}
+    for i in range(5):
+        name = f"pkg{i}"
+        path = make_artifact(name=name, files={f"share/{name}.txt": name.encode() * 1000})
+        solutions[name] = [PackageRecord(name=name, version="1.0", build="0", build_number=0,
+                                         channel="local", subdir="linux-64", depends=[],
+                                         fn=os.path.basename(path), url="file://" + path)]
+    cachedir = tmpdir.join("artifacts")
+    cached_at_conversion = []
+    package_to_wheel = condatools.package_to_wheel
+
+    def counting_package_to_wheel(package_rec, config=None, _top=True):
+        cached_at_conversion.append(len(cachedir.listdir(lambda p: p.ext == ".bz2")))
+        return package_to_wheel(package_rec, config=config, _top=_top)
+
+    monkeypatch.setattr(download, "_CACHE", None)
+    monkeypatch.setattr(condatools, "solve_artifact_ref", lambda spec, config=None: solutions[spec])
+    monkeypatch.setattr(condatools, "package_to_wheel", counting_package_to_wheel)
+    # the cache is too small to hold more than the artifacts in use
+    config = Config(strip_symbols=False, artifact_cache_dir=str(cachedir),
+                    artifact_cache_max_size=1, prefetch_depth=1, jobs=jobs)
+    out = tmpdir.mkdir("out")
+    with out.as_cwd():
+        report = convert_entries([BatchEntry(name, config) for name in solutions], config=config)
+        assert len(out.listdir(lambda p: p.ext == ".whl")) == 5
+    assert len(report.build_times) == 5
+    if jobs == 1:
+        # only the record being converted and the one prefetched are kept
+        assert len(cached_at_conversion) == 5
+        assert max(cached_at_conversion) <= 2
+    # nothing is left pinned, so all of it may be evicted
+    cache = download.get_artifact_cache(config)
+    assert all(cache.remove(e["fn"], blocking=False) for e in cache.entries())
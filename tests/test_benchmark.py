@@ -0,0 +1,99 @@
+import os
+import sys
+import copy
+import shutil
+import tarfile
+
+import pytest
+
+from conda_press import benchmark, elf
+from conda_press.benchmark import (
+    SHORT_RPATH,
+    STAGES,
+    SYNTHETIC_RPATH,
+    Scenario,
+    compare_results,
+    format_results,
+    load_results,
+    make_scenario_artifacts,
+    run_scenario,
+    save_results,
+)
+
+
+def test_make_scenario_artifacts(tmpdir):
+    scenario = Scenario("tiny", files=4, size=4000, symlinks=3, fanout=2)
+    top, channel, deps, generated = make_scenario_artifacts(scenario, str(tmpdir))
+    assert generated == scenario
+    assert channel.startswith("file://")
+    assert [os.path.basename(d) for d in deps] == ["synthdep0-1.0-0.tar.bz2",
+                                                   "synthdep1-1.0-0.tar.bz2"]
+    with tarfile.open(top) as tf:
+        members = [m for m in tf.getmembers() if not m.name.startswith("info/")]
+    assert sum(m.isfile() for m in members) == 4
+    assert sum(m.size for m in members) == 4000
+    # links to files of the artifact, and one into each dependency
+    assert sum(m.issym() for m in members) == 3 + 2
+
+
+@pytest.mark.skipif(not sys.platform.startswith("linux") or shutil.which("gcc") is None,
+                    reason="needs gcc to build ELF files")
+@pytest.mark.parametrize("have_patchelf", [True, False])
+def test_make_scenario_artifacts_patchelf(tmpdir, monkeypatch, have_patchelf):
+    which = shutil.which
+    monkeypatch.setattr(benchmark.shutil, "which", lambda cmd: (
+        ("/usr/bin/patchelf" if have_patchelf else None) if cmd == "patchelf" else which(cmd)))
+    scenario = Scenario("tiny", files=2, size=100, elf=3, patchelf=2)
+    top, _, _, generated = make_scenario_artifacts(scenario, str(tmpdir))
+    assert generated.elf == 3
+    assert generated.patchelf == (2 if have_patchelf else 0)
+    rpaths = []
+    with tarfile.open(top) as tf:
+        for member in sorted(tf.getmembers(), key=lambda m: m.name):
+            if member.name.endswith(".so"):
+                lib = tmpdir.join(os.path.basename(member.name))
+                lib.write_binary(tf.extractfile(member).read())
+                rpaths.append(elf.read_rpath(str(lib)))
+    expected = [SHORT_RPATH] * generated.patchelf
+    assert rpaths == expected + [SYNTHETIC_RPATH] * (3 - len(expected))
+
+
+def test_run_scenario(tmpdir):
+    scenario = Scenario("tiny", files=4, size=4000, symlinks=2, fanout=1)
+    workdir = tmpdir.mkdir("work")
+    result = run_scenario(scenario, repeat=2, workdir=str(workdir))
+    assert result["params"]["files"] == 4
+    assert list(result["stages"]) == list(STAGES)
+    for stage in result["stages"].values():
+        assert len(stage["times"]) == 2
+        assert 0 <= stage["min"] <= stage["median"]
+    fat = os.listdir(str(workdir.join("fat")))
+    assert len(fat) == 1 and fat[0].startswith("synth-1.0-0_0-")
+
+
+def _results(extract=1.0, rss=100 << 20, files=10):
+    stages = {stage: {"min": 0.5, "median": 0.5, "times": [0.5]} for stage in STAGES}
+    stages["extract"] = {"min": extract, "median": extract, "times": [extract]}
+    return {"format": 1, "meta": {}, "scenarios": {"tiny": {
+        "params": {"name": "tiny", "files": files}, "stages": stages, "peak_rss": rss}}}
+
+
+def test_compare_results():
+    baseline = _results()
+    assert compare_results(baseline, copy.deepcopy(baseline)) == ([], [])
+    regressions, skipped = compare_results(baseline, _results(extract=2.0, rss=200 << 20))
+    assert [(r.scenario, r.metric) for r in regressions] == [("tiny", "extract"),
+                                                             ("tiny", "peak_rss")]
+    assert regressions[0].ratio == 2.0
+    # too small a slowdown to tell from noise
+    assert compare_results(_results(extract=0.01), _results(extract=0.03)) == ([], [])
+    # different parameters are not comparable
+    assert compare_results(baseline, _results(extract=2.0, files=20)) == ([], ["tiny"])
+
+
+def test_save_load_results(tmpdir):
+    results = _results()
+    fname = str(tmpdir.join("results.json"))
+    save_results(results, fname)
+    assert load_results(fname) == results
+    assert "x2.00" in format_results(_results(extract=2.0), baseline=results)
@@ -0,0 +1,225 @@
+import os
+import time
+from types import SimpleNamespace
+from hashlib import md5, sha256
+
+import pytest
+
+from conda_press.cache import (
+    ArtifactCache,
+    FileLock,
+    SolveCache,
+    WheelCache,
+    file_digests,
+    file_sha256,
+    parse_size,
+)
+from conda_press.config import Config
+
+
+@pytest.mark.parametrize("size, expected", [
+    (42, 42),
+    ("42", 42),
+    ("1K", 1024),
+    ("512MB", 512 * 1024 ** 2),
+    ("1.5G", int(1.5 * 1024 ** 3)),
+])
+def test_parse_size(size, expected):
+    assert parse_size(size) == expected
+
+
+def _make_file(path, size):
+    with open(path, "wb") as f:
+        f.write(os.urandom(size))
+    return str(path)
+
+
+def test_wheel_cache_key(tmpdir):
+    cache = WheelCache(str(tmpdir.join("cache")), "1M")
+    artifact = _make_file(tmpdir.join("a-1.0-0.tar.bz2"), 100)
+    key = cache.key(artifact, Config())
+    assert key == cache.key(artifact, Config(output="elsewhere.whl"))
+    assert key != cache.key(artifact, Config(strip_symbols=False))
+    other = _make_file(tmpdir.join("b-1.0-0.tar.bz2"), 100)
+    assert key != cache.key(other, Config())
+    assert len(file_sha256(artifact)) == 64
+    # a known digest saves hashing the artifact
+    assert key == cache.key(artifact, Config(), sha256_digest=file_sha256(artifact))
+
+
+def test_wheel_cache_put_get_restore(tmpdir):
+    cache = WheelCache(str(tmpdir.join("cache")), "1M")
+    whl = _make_file(tmpdir.join("a-1.0-py2.py3-none-any.whl"), 100)
+    assert cache.get("abc123") is None
+    cache.put("abc123", whl, python_dep=False)
+    entry = cache.get("abc123")
+    assert entry["wheel"] == "a-1.0-py2.py3-none-any.whl"
+    assert not entry["python_dep"]
+    dest = tmpdir.mkdir("dest")
+    restored = cache.restore(entry, dest=str(dest))
+    assert file_sha256(restored) == file_sha256(whl)
+    # entries without wheels are allowed too
+    cache.put("def456", None, python_dep=True)
+    assert cache.get("def456")["wheel"] is None
+    assert cache.purge(["abc123"]) == 1
+    assert cache.get("abc123") is None
+    assert cache.purge() == 1
+    assert cache.entries() == []
+
+
+def test_wheel_cache_lru_eviction(tmpdir):
+    cache = WheelCache(str(tmpdir.join("cache")), 2500)
+    for i, key in enumerate(["aa1", "bb2"]):
+        whl = _make_file(tmpdir.join(f"w{i}-1.0-py2.py3-none-any.whl"), 1000)
+        cache.put(key, whl)
+        # make sure mtimes differ, even on coarse filesystems
+        os.utime(os.path.join(cache._entry_dir(key), cache.entry_filename),
+                 (time.time() - 100 + i, time.time() - 100 + i))
+    # using the first entry makes the second one least recently used
+    cache.get("aa1")
+    whl = _make_file(tmpdir.join("w2-1.0-py2.py3-none-any.whl"), 1000)
+    cache.put("cc3", whl)
+    keys = {e["key"] for e in cache.entries()}
+    assert keys == {"aa1", "cc3"}
+    assert cache.size() <= 2500
+
+
+def test_solve_cache(tmpdir):
+    from conda.models.records import PackageRecord
+
+    cache = SolveCache(str(tmpdir.join("solves")))
+    key = cache.key("numpy", ["conda-forge"], ["linux-64", "noarch"], "abc")
+    assert key != cache.key("numpy", ["conda-forge"], ["linux-64", "noarch"], "abd")
+    assert key != cache.key("numpy=1.17", ["conda-forge"], ["linux-64", "noarch"], "abc")
+    assert cache.get(key) is None
+    recs = [PackageRecord(name=name, version="1.0", build="0", build_number=0,
+                          channel="conda-forge", subdir="linux-64", fn=f"{name}-1.0-0.tar.bz2")
+            for name in ("zlib", "python", "numpy")]
+    cache.put(key, recs, spec="numpy")
+    assert [r.name for r in cache.get(key)] == ["zlib", "python", "numpy"]
+    assert cache.get(key) == recs
+    cache.purge()
+    assert cache.get(key) is None
+
+
+def _add_artifact(cache, fn, data):
+    """Puts an artifact into the cache, as a download would."""
+    rec = SimpleNamespace(fn=fn, url=f"file:///{fn}", md5=md5(data).hexdigest(),
+                          sha256=sha256(data).hexdigest())
+    os.makedirs(cache.cachedir, exist_ok=True)
+    part = os.path.join(cache.cachedir, fn + ".part")
+    with open(part, "wb") as f:
+        f.write(data)
+    cache.put(rec, part, md5=rec.md5, sha256=rec.sha256)
+    return rec
+
+
+def test_file_digests(tmpdir):
+    path = _make_file(tmpdir.join("a"), 1000)
+    with open(path, "rb") as f:
+        data = f.read()
+    assert file_digests(path) == (md5(data).hexdigest(), sha256(data).hexdigest())
+
+
+def test_file_lock(tmpdir):
+    path = str(tmpdir.join("locks", "a.lock"))
+    with FileLock(path):
+        other = FileLock(path)
+        assert not other.acquire(blocking=False)
+    assert other.acquire(blocking=False)
+    other.release()
+
+
+def test_artifact_cache_get(tmpdir):
+    cache = ArtifactCache(str(tmpdir.join("cache")))
+    rec = _add_artifact(cache, "a-1.0-0.tar.bz2", b"some data")
+    assert cache.get(rec) == cache.path("a-1.0-0.tar.bz2")
+    # a record with other checksums does not match
+    other = SimpleNamespace(fn=rec.fn, md5="0" * 32, sha256=None)
+    assert cache.get(other) is None
+    # nor does a modified artifact
+    with open(cache.path(rec.fn), "wb") as f:
+        f.write(b"other data")
+    assert cache.get(rec) is None
+
+
+def test_artifact_cache_verified_sha256(tmpdir):
+    cache = ArtifactCache(str(tmpdir.join("cache")))
+    rec = _add_artifact(cache, "a-1.0-0.tar.bz2", b"some data")
+    assert cache.verified_sha256(cache.path(rec.fn)) == rec.sha256
+    assert cache.verified_sha256(_make_file(tmpdir.join(rec.fn), 10)) is None
+    with open(cache.path(rec.fn), "ab") as f:
+        f.write(b" and more")
+    assert cache.verified_sha256(cache.path(rec.fn)) is None
+
+
+def test_artifact_cache_adopts_unknown_files(tmpdir):
+    cache = ArtifactCache(str(tmpdir.join("cache")))
+    os.makedirs(cache.cachedir)
+    with open(cache.path("a-1.0-0.tar.bz2"), "wb") as f:
+        f.write(b"some data")
+    rec = SimpleNamespace(fn="a-1.0-0.tar.bz2", md5=md5(b"some data").hexdigest())
+    assert cache.get(rec) == cache.path("a-1.0-0.tar.bz2")
+    assert cache.entries()[0]["meta"]["sha256"] == sha256(b"some data").hexdigest()
+
+
+def test_artifact_cache_lru_eviction(tmpdir):
+    cache = ArtifactCache(str(tmpdir.join("cache")), max_size=2500)
+    recs = [_add_artifact(cache, f"p{i}-1.0-0.tar.bz2", os.urandom(1000)) for i in range(3)]
+    for i, rec in enumerate(recs):
+        meta_file = cache._meta_file(rec.fn)
+        os.utime(meta_file, (time.time() - 100 + i, time.time() - 100 + i))
+    # use the oldest, so that the next oldest gets evicted
+    cache.get(recs[0])
+    with cache.lock(recs[0].fn):
+        assert cache.evict(keep={recs[2].fn}) == [recs[1].fn]
+    assert [e["fn"] for e in cache.entries()] == [recs[2].fn, recs[0].fn]
+
+
+def test_artifact_cache_eviction_skips_locked(tmpdir):
+    cache = ArtifactCache(str(tmpdir.join("cache")), max_size=1500)
+    recs = [_add_artifact(cache, f"p{i}-1.0-0.tar.bz2", os.urandom(1000)) for i in range(2)]
+    os.utime(cache._meta_file(recs[0].fn), (time.time() - 100, time.time() - 100))
+    with cache.lock(recs[0].fn):
+        assert cache.evict() == [recs[1].fn]
+    assert [e["fn"] for e in cache.entries()] == [recs[0].fn]
+
+
+def test_artifact_cache_eviction_skips_pinned(tmpdir):
+    cache = ArtifactCache(str(tmpdir.join("cache")), max_size=500)
+    recs = [_add_artifact(cache, f"p{i}-1.0-0.tar.bz2", os.urandom(1000)) for i in range(2)]
+    # an artifact may be pinned by many at once
+    pins = [cache.pin(recs[0].fn), cache.pin(recs[0].fn)]
+    assert cache.evict() == [recs[1].fn]
+    assert not cache.remove(recs[0].fn, blocking=False)
+    pins[0].release()
+    assert cache.evict() == []
+    pins[1].release()
+    assert cache.evict() == [recs[0].fn]
+
+
+def test_artifact_cache_prune(tmpdir):
+    cache = ArtifactCache(str(tmpdir.join("cache")))
+    _add_artifact(cache, "a-1.0-0.tar.bz2", b"some data")
+    stale = _make_file(tmpdir.join("cache", "b-1.0-0.tar.bz2.abc.part"), 10)
+    fresh = _make_file(tmpdir.join("cache", "c-1.0-0.tar.bz2.abc.part"), 10)
+    old = time.time() - 2 * cache.stale_part_age
+    os.utime(stale, (old, old))
+    assert cache.prune() == ["b-1.0-0.tar.bz2.abc.part"]
+    assert os.path.exists(fresh)
+    assert [e["fn"] for e in cache.entries()] == ["a-1.0-0.tar.bz2"]
+
+
+def test_artifact_cache_verify(tmpdir):
+    cache = ArtifactCache(str(tmpdir.join("cache")))
+    good = _add_artifact(cache, "a-1.0-0.tar.bz2", b"some data")
+    bad = _add_artifact(cache, "b-1.0-0.tar.bz2", b"more data")
+    with open(cache.path(bad.fn), "r+b") as f:
+        f.write(b"M")
+    # artifacts that are in use are reported, but not removed
+    pin = cache.pin(bad.fn)
+    assert cache.verify() == [bad.fn]
+    assert sorted(e["fn"] for e in cache.entries()) == [good.fn, bad.fn]
+    pin.release()
+    assert cache.verify() == [bad.fn]
+    assert [e["fn"] for e in cache.entries()] == [good.fn]
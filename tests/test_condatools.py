@@ -3,12 +3,25 @@ import sys
 import ast
 import stat
 import glob
+import pickle
+import shutil
 import subprocess
+from types import SimpleNamespace
+from zipfile import ZipFile
 
 import pytest
 
-from conda_press.condatools import artifact_to_wheel, ArtifactInfo, get_only_deps_on_pypi
-from conda_press.config import Config, SYSTEM, SO_EXT
+from conda_press.condatools import (
+    artifact_to_wheel,
+    ArtifactInfo,
+    get_only_deps_on_pypi,
+    extract_artifact_info,
+    prefer_conda_format,
+    is_elf,
+    reuse_fat_wheel_components,
+    strip_files,
+)
+from conda_press.config import CONVERSION_FIELDS, Config, SYSTEM, SO_EXT
 
 ON_LINUX = (SYSTEM == "Linux")
 ON_WINDOWS = (SYSTEM == "Windows")
@@ -179,6 +192,470 @@ def test_from_tarballs(xonsh, tmpdir, data_folder, extension):
     ArtifactInfo.from_tarball(os.path.join(data_folder, f"test-deps-0.0.1-py_0{extension}"))
 
 
+@pytest.fixture
+def shared_libs(tmpdir):
+    """Compiles a few small shared libraries, with debugging symbols"""
+    if shutil.which("gcc") is None:
+        pytest.skip("gcc is required to build shared libraries")
+    src = tmpdir.join("lib.c")
+    src.write("int answer(void) { return 42; }\nint question(int x) { return x + 1; }\n")
+    libs = []
+    for i in range(5):
+        lib = str(tmpdir.join(f"libtest{i}.so"))
+        subprocess.run(["gcc", "-g", "-shared", "-fPIC", "-o", lib, str(src)], check=True)
+        libs.append(lib)
+    return libs
+
+
+@skip_if_not_on_linux
+def test_is_elf(tmpdir, shared_libs):
+    assert all(map(is_elf, shared_libs))
+    script = tmpdir.join("script.sh")
+    script.write("#!/bin/sh\n")
+    assert not is_elf(str(script))
+    assert not is_elf(str(tmpdir.join("does-not-exist")))
+
+
+@skip_if_not_on_linux
+def test_strip_files(shared_libs):
+    sizes = [os.path.getsize(lib) for lib in shared_libs]
+    saved = strip_files(shared_libs, jobs=2)
+    assert saved > 0
+    assert saved == sum(sizes) - sum(os.path.getsize(lib) for lib in shared_libs)
+    # everything is still a valid binary
+    assert all(map(is_elf, shared_libs))
+    assert strip_files([]) == 0
+
+
+@skip_if_not_on_linux
+def test_strip_symbols_keeps_object_files(tmpdir, make_artifact, shared_libs):
+    obj = str(tmpdir.join("crt.o"))
+    subprocess.run(["gcc", "-g", "-c", "-o", obj, str(tmpdir.join("lib.c"))], check=True)
+    files = {}
+    for name, fname in (("lib/crt.o", obj), ("lib/libtest.so", shared_libs[0])):
+        with open(fname, "rb") as f:
+            files[name] = f.read()
+    path = make_artifact(name="objects", files=files)
+    info = ArtifactInfo.from_tarball(path, config=Config())
+    try:
+        with open(os.path.join(info.artifactdir, "lib", "crt.o"), "rb") as f:
+            assert f.read() == files["lib/crt.o"]
+        assert os.path.getsize(os.path.join(info.artifactdir, "lib", "libtest.so")) < \
+            len(files["lib/libtest.so"])
+    finally:
+        info.clean()
+
+
+def _wheel_contents(filename):
+    with ZipFile(filename) as zf:
+        return {zi.filename: (zf.read(zi), zi.external_attr) for zi in zf.infolist()}
+
+
+@pytest.mark.parametrize("level", [None, 0, 9])
+def test_stream_matches_extract(xonsh, tmpdir, make_artifact, level):
+    files = {
+        "bin/tool": b"#!/usr/bin/env python\nprint('hi')\n",
+        "lib/libfoo.so.1": b"\x7fELF not really a binary",
+        "share/data/big.txt": b"some data\n" * 10000,
+        "share/data/other.txt": b"other\n",
+    }
+    links = {"lib/libfoo.so": "libfoo.so.1", "share/data/alias.txt": "big.txt"}
+    path = make_artifact(files=files, links=links)
+    with tmpdir.as_cwd():
+        extracted = artifact_to_wheel(path, Config(strip_symbols=False, compress_level=level))
+        expected = _wheel_contents(extracted.filename)
+        with ZipFile(extracted.filename) as zf:
+            expected_size = zf.getinfo("share/data/big.txt").compress_size
+        streamed = artifact_to_wheel(path, Config(strip_symbols=False, stream=True,
+                                                  compress_level=level))
+        observed = _wheel_contents(streamed.filename)
+        with ZipFile(streamed.filename) as zf:
+            observed_size = zf.getinfo("share/data/big.txt").compress_size
+    assert observed == expected
+    # the streamed members are compressed at the configured level too
+    assert observed_size == expected_size
+    assert "share/data/big.txt" in streamed.artifact_info.streamed
+    assert "share/data/alias.txt" in streamed.artifact_info.streamed
+    artifactdir = streamed.artifact_info.artifactdir
+    assert not os.path.exists(os.path.join(artifactdir, "share", "data", "big.txt"))
+    assert not os.path.exists(os.path.join(artifactdir, "info", "test"))
+    assert not os.path.exists(os.path.join(artifactdir, "info", "recipe", "build.sh"))
+    streamed.clean()
+    extracted.clean()
+
+
+@pytest.mark.parametrize("stream", [False, True])
+def test_conda_format(xonsh, tmpdir, make_artifact, stream):
+    pytest.importorskip("zstandard")
+    files = {"share/data.txt": b"data\n", "bin/tool": b"#!/usr/bin/env python\n"}
+    path = make_artifact(files=files, ext=".conda")
+    info = ArtifactInfo.from_tarball(path, config=Config(stream=stream, strip_symbols=False))
+    assert info.index_json["name"] == "synthetic"
+    assert sorted(info.files) == ["bin/tool", "share/data.txt"]
+    assert os.path.isfile(os.path.join(info.artifactdir, "bin", "tool"))
+    assert ("share/data.txt" in info.streamed) == stream
+    info.clean()
+    # metadata only needs the info tarball
+    dest = str(tmpdir.join("info-only"))
+    extract_artifact_info(path, dest)
+    assert os.path.isfile(os.path.join(dest, "info", "index.json"))
+    assert not os.path.exists(os.path.join(dest, "share"))
+    assert not os.path.exists(os.path.join(dest, "info", "test"))
+
+
+def test_extract_artifact_info_stops_after_info(tmpdir, make_artifact):
+    import io
+    import json
+    import tarfile
+
+    # random data spans many bz2 blocks, the first of which holds info/
+    files = {"share/noise.bin": os.urandom(3 << 20)}
+    path = make_artifact(name="early", files=files)
+    # a truncated payload cannot be read, but it is never reached
+    with open(path, "r+b") as f:
+        f.truncate(os.path.getsize(path) - (100 << 10))
+    dest = str(tmpdir.join("early"))
+    extract_artifact_info(path, dest)
+    with open(os.path.join(dest, "info", "index.json")) as f:
+        assert json.load(f)["name"] == "early"
+    assert not os.path.exists(os.path.join(dest, "share"))
+
+    # artifacts with info/ last are read through to it
+    late = str(tmpdir.join("late-1.0-0.tar.bz2"))
+    members = [("share/late.txt", b"late\n"),
+               ("info/index.json", json.dumps({"name": "late"}).encode())]
+    with tarfile.open(late, "w:bz2") as tf:
+        for name, data in members:
+            tinfo = tarfile.TarInfo(name)
+            tinfo.size = len(data)
+            tf.addfile(tinfo, io.BytesIO(data))
+    dest = str(tmpdir.join("late"))
+    extract_artifact_info(late, dest)
+    with open(os.path.join(dest, "info", "index.json")) as f:
+        assert json.load(f)["name"] == "late"
+    assert not os.path.exists(os.path.join(dest, "share"))
+
+
+def test_replace_symlinks_into_dependency(xonsh, make_artifact, monkeypatch):
+    import conda_press.condatools as condatools
+
+    dep = make_artifact(
+        name="libfoo",
+        files={"lib/libfoo.so.1.2": b"\x7fELF not really a binary"},
+        links={"lib/libfoo.so.1": "libfoo.so.1.2"},
+    )
+    links = {f"lib/libfoo-{i}.so": "libfoo.so.1" for i in range(20)}
+    pkg = make_artifact(name="pkg", links=links, depends=["libfoo 1.0 0"])
+    downloads = []
+    extractions = []
+    from_tarball = ArtifactInfo.from_tarball.__func__
+
+    def fake_download(ref, channels=None, subdir=None, pins=None):
+        downloads.append(ref)
+        return dep
+
+    def counting_from_tarball(cls, path, config=None, replace_symlinks=True):
+        if not replace_symlinks:
+            extractions.append(path)
+        return from_tarball(cls, path, config=config, replace_symlinks=replace_symlinks)
+
+    monkeypatch.setattr(condatools, "download_artifact", fake_download)
+    monkeypatch.setattr(ArtifactInfo, "from_tarball", classmethod(counting_from_tarball))
+    info = ArtifactInfo.from_tarball(pkg, config=Config(strip_symbols=False))
+    for name in links:
+        absname = os.path.join(info.artifactdir, name)
+        assert not os.path.islink(absname)
+        with open(absname, "rb") as f:
+            assert f.read() == b"\x7fELF not really a binary"
+    assert downloads == ["libfoo=1.0=0"]
+    assert extractions == [dep]
+    info.clean()
+
+
+def test_merge_copies_members(xonsh, tmpdir, make_artifact):
+    from conda_press.wheel import Wheel, merge, parse_records
+
+    top = make_artifact(name="top", files={"share/top.txt": b"top\n" * 1000},
+                        depends=["dep 1.0 0"])
+    dep = make_artifact(name="dep", files={"share/dep.txt": b"dep\n" * 1000})
+    with tmpdir.as_cwd():
+        top_whl = artifact_to_wheel(top, Config(strip_symbols=False))
+        dep_whl = artifact_to_wheel(dep, Config(strip_symbols=False))
+        filenames = {w.distribution: str(tmpdir.join(w.filename)) for w in (top_whl, dep_whl)}
+        components = {f: Wheel.from_file(f) for f in filenames.values()}
+        assert all(w.basedir is None for w in components.values())
+        components[filenames["top"]]._top = True
+        output = str(tmpdir.join("fat", top_whl.filename))
+        os.makedirs(os.path.dirname(output))
+        merge(components, output=output)
+        with ZipFile(output) as zf:
+            names = zf.namelist()
+            assert len(names) == len(set(names))
+            for dist, filename in filenames.items():
+                with ZipFile(filename) as component:
+                    zinfo = component.getinfo(f"share/{dist}.txt")
+                    assert zf.getinfo(zinfo.filename).compress_size == zinfo.compress_size
+                    assert zf.getinfo(zinfo.filename).CRC == zinfo.CRC
+        merged = Wheel.from_file(output)
+        with ZipFile(output) as zf:
+            metadata = zf.read(f"{merged.distribution}-{merged.version}.dist-info/METADATA")
+        assert b"Requires-Dist: dep" not in metadata
+        dep_records = {r[0]: r for r in parse_records(components[filenames["dep"]])}
+        merged_records = {r[0]: r for r in parse_records(merged)}
+        assert merged_records["share/dep.txt"] == dep_records["share/dep.txt"]
+    top_whl.clean()
+    dep_whl.clean()
+
+
+def test_incremental_fat_wheel_rebuild(xonsh, tmpdir, make_artifact):
+    from conda_press.wheel import COMPONENTS_FILENAME, fat_wheel_components, fatten_from_seen
+
+    config = Config(strip_symbols=False, fatten=True)
+    fingerprint = config.fingerprint(CONVERSION_FIELDS)
+    top = make_artifact(name="top", files={"share/top.txt": b"top\n" * 1000},
+                        depends=["dep 1.0 0", "gone 1.0 0"])
+    dep0 = make_artifact(name="dep", build="0", files={"share/dep.txt": b"old\n" * 1000})
+    gone = make_artifact(name="gone", files={"share/gone.txt": b"gone\n" * 1000})
+    dep1 = make_artifact(name="dep", build="1", files={"share/dep.txt": b"new\n" * 1000})
+    new = make_artifact(name="new", files={"share/new.txt": b"new\n" * 1000})
+    builddir = tmpdir.mkdir("build")
+    with builddir.as_cwd():
+        seen = {}
+        for ref, path in [("c::top==1.0=0", top), ("c::dep==1.0=0", dep0),
+                          ("c::gone==1.0=0", gone)]:
+            seen[ref] = artifact_to_wheel(path, config)
+            seen[ref]._top = ref.startswith("c::top")
+        fat = str(builddir.join(seen["c::top==1.0=0"].filename))
+        assert list(fatten_from_seen(seen, output=fat, fingerprint=fingerprint)) == [fat]
+        with ZipFile(fat) as zf:
+            before = {zi.filename: zi for zi in zf.infolist()}
+        assert f"top-1.0.dist-info/{COMPONENTS_FILENAME}" in before
+        assert fat_wheel_components(fat, fingerprint="other") == {}
+        components = fat_wheel_components(fat, fingerprint=fingerprint)
+        assert sorted(components) == ["c::dep==1.0=0", "c::gone==1.0=0", "c::top==1.0=0"]
+        assert components["c::top==1.0=0"]._top
+        assert "share/gone.txt" in [a for _, a in components["c::gone==1.0=0"].files]
+
+        # dep changes, gone is removed, and new is added
+        to_build = [("c::top==1.0=0", None, True), ("c::dep==1.0=1", None, False),
+                    ("c::new==1.0=0", None, False)]
+        seen = dict.fromkeys(ref for ref, _, _ in to_build)
+        incremental = Config(strip_symbols=False, fatten=True, incremental=fat)
+        remaining = reuse_fat_wheel_components(to_build, seen, incremental)
+        assert [ref for ref, _, _ in remaining] == ["c::dep==1.0=1", "c::new==1.0=0"]
+        seen["c::dep==1.0=1"] = artifact_to_wheel(dep1, config)
+        seen["c::new==1.0=0"] = artifact_to_wheel(new, config)
+        # rebuilt in place, over the previous fat wheel
+        assert list(fatten_from_seen(seen, output=fat, fingerprint=fingerprint)) == [fat]
+        with ZipFile(fat) as zf:
+            after = {zi.filename: zi for zi in zf.infolist()}
+            assert zf.read("share/dep.txt") == b"new\n" * 1000
+            metadata = zf.read("top-1.0.dist-info/METADATA").decode()
+        assert "share/gone.txt" not in after
+        assert "share/new.txt" in after
+        assert (after["share/top.txt"].CRC, after["share/top.txt"].compress_size) == (
+            before["share/top.txt"].CRC, before["share/top.txt"].compress_size)
+        # the requirement on gone comes back, since it is no longer merged in
+        assert "Requires-Dist: dep" not in metadata
+        assert "Requires-Dist: gone" in metadata
+        assert sorted(fat_wheel_components(fat, fingerprint=fingerprint)) == [
+            "c::dep==1.0=1", "c::new==1.0=0", "c::top==1.0=0"]
+    for w in seen.values():
+        if w is not None:
+            w.clean()
+
+
+@pytest.mark.parametrize("level", [None, 0, 9])
+def test_parallel_compression_matches_zipfile(xonsh, tmpdir, make_artifact, level):
+    files = {f"share/data/file{i}.txt": (b"line %d\n" % i) * (1000 * i) for i in range(20)}
+    path = make_artifact(files=files)
+    with tmpdir.as_cwd():
+        wheel = artifact_to_wheel(path, Config(strip_symbols=False, compress_level=level))
+        filename = str(tmpdir.join(wheel.filename))
+    expected = str(tmpdir.join("expected.zip"))
+    with ZipFile(filename) as zf, ZipFile(expected, "w") as ref:
+        members = [zi for zi in zf.infolist() if zi.filename.startswith("share/")]
+        assert [zi.filename for zi in members] == [a for _, a in wheel.files]
+        for zi in members:
+            ref.writestr(zi, zf.read(zi), compress_type=zi.compress_type, compresslevel=level)
+    with open(filename, "rb") as f, open(expected, "rb") as g:
+        observed, reference = f.read(), g.read()
+    # the members are byte for byte what ZipFile itself would have written
+    with ZipFile(expected) as ref:
+        for zi in ref.infolist():
+            start = zi.header_offset
+            end = start + 30 + len(zi.filename) + zi.compress_size
+            assert reference[start:end] in observed
+    wheel.clean()
+
+
+@pytest.mark.parametrize("depth", [0, 1])
+def test_dependency_tree_downloads_ahead_of_conversion(xonsh, tmpdir, make_artifact,
+                                                       monkeypatch, depth):
+    from conda.models.records import PackageRecord
+    from conda_press import condatools
+
+    recs = []
+    for i in range(5):
+        path = make_artifact(name=f"pkg{i}", files={f"share/pkg{i}.txt": b"x"})
+        recs.append(PackageRecord(name=f"pkg{i}", version="1.0", build="0", build_number=0,
+                                  channel="local", subdir="linux-64", depends=[],
+                                  fn=os.path.basename(path), url="file://" + path))
+    cachedir = tmpdir.join("artifacts")
+    downloaded_at_conversion = []
+
+    def fake_package_to_wheel(package_rec, config=None, _top=True):
+        assert cachedir.join(package_rec.fn).check(file=True)
+        downloaded_at_conversion.append(len(cachedir.listdir(lambda p: p.ext == ".bz2")))
+        return package_rec.name
+
+    monkeypatch.setattr(condatools, "solve_artifact_ref", lambda spec, config=None: recs)
+    monkeypatch.setattr(condatools, "package_to_wheel", fake_package_to_wheel)
+    config = Config(artifact_cache_dir=str(cachedir), prefetch_depth=depth, download_jobs=2)
+    seen = condatools.artifact_ref_dependency_tree_to_wheels("pkg4=1.0=0", config=config)
+    assert list(seen.values()) == [r.name for r in recs]
+    # downloads run at most prefetch_depth records ahead of the conversions
+    for i, n in enumerate(downloaded_at_conversion):
+        assert i + 1 <= n <= i + 1 + depth
+
+
+def test_dependency_tree_in_parallel(xonsh, tmpdir, make_artifact, monkeypatch):
+    from conda.models.records import PackageRecord
+    from conda_press import condatools
+
+    recs = []
+    for i in range(4):
+        # the first records are the largest, so they finish last in the pool
+        files = {f"share/pkg{i}/data{j}.txt": f"{i} {j}\n".encode() * 20000
+                 for j in range(8 - 2 * i)}
+        path = make_artifact(name=f"pkg{i}", files=files, depends=[f"pkg{i + 1}"])
+        recs.append(PackageRecord(name=f"pkg{i}", version="1.0", build="0", build_number=0,
+                                  channel="local", subdir="linux-64", depends=[],
+                                  fn=os.path.basename(path), url="file://" + path))
+    monkeypatch.setattr(condatools, "solve_artifact_ref", lambda spec, config=None: recs)
+    parallel_calls = []
+    parallel = condatools._package_recs_to_wheels_parallel
+
+    def counting_parallel(to_build, downloaded, seen, config):
+        parallel_calls.append(len(to_build))
+        parallel(to_build, downloaded, seen, config)
+
+    monkeypatch.setattr(condatools, "_package_recs_to_wheels_parallel", counting_parallel)
+
+    def convert(jobs):
+        config = Config(artifact_cache_dir=str(tmpdir.join("artifacts")), jobs=jobs)
+        with tmpdir.mkdir(f"jobs{jobs}").as_cwd():
+            seen = condatools.artifact_ref_dependency_tree_to_wheels("pkg0=1.0=0",
+                                                                       config=config)
+            wheels = {}
+            for ref, wheel in seen.items():
+                with ZipFile(wheel.filename) as zf:
+                    contents = {n: zf.read(n) for n in zf.namelist()}
+                wheels[ref] = (wheel.filename, wheel._top, contents)
+                wheel.clean()
+        return list(seen), wheels
+
+    serial_order, serial = convert(1)
+    assert parallel_calls == []
+    parallel_order, parallel_wheels = convert(2)
+    assert parallel_calls == [4]
+    # the wheels come back from the pool in the order that the records were solved
+    assert parallel_order == serial_order == [str(r.to_match_spec()) for r in recs]
+    assert parallel_wheels == serial
+    assert [top for _, top, _ in serial.values()] == [True, False, False, False]
+
+
+@pytest.mark.parametrize("epoch, date_time", [
+    (None, (1980, 1, 1, 0, 0, 0)),
+    ("1577836800", (2020, 1, 1, 0, 0, 0)),
+])
+def test_reproducible_wheel(xonsh, tmpdir, make_artifact, monkeypatch, epoch, date_time):
+    if epoch is None:
+        monkeypatch.delenv("SOURCE_DATE_EPOCH", raising=False)
+    else:
+        monkeypatch.setenv("SOURCE_DATE_EPOCH", epoch)
+    files = {"share/b.txt": b"b\n" * 100, "share/a.txt": b"a\n" * 100,
+             "bin/tool": b"#!/usr/bin/env python\nprint(1)\n"}
+    path = make_artifact(name="repro", files=files)
+    config = Config(strip_symbols=False, reproducible=True)
+    with tmpdir.as_cwd():
+        wheel = artifact_to_wheel(path, config)
+        filename = str(tmpdir.join(wheel.filename))
+        with open(filename, "rb") as f:
+            first = f.read()
+        os.utime(filename, (0, 0))
+        # converted again from scratch, with new files on disk
+        wheel.clean()
+        wheel = artifact_to_wheel(path, config)
+    with open(filename, "rb") as f:
+        assert f.read() == first
+    # the identical wheel was not replaced
+    assert os.path.getmtime(filename) == 0
+    with ZipFile(filename) as zf:
+        infos = zf.infolist()
+    assert {zi.date_time for zi in infos} == {date_time}
+    modes = {zi.filename: zi.external_attr >> 16 for zi in infos}
+    assert set(modes.values()) <= {0o100644, 0o100755}
+    assert modes["share/a.txt"] == 0o100644
+    assert modes["bin/tool"] == 0o100755
+    names = [zi.filename for zi in infos]
+    assert names.index("share/a.txt") < names.index("share/b.txt")
+    wheel.clean()
+
+
+def test_large_files_are_streamed(xonsh, tmpdir, make_artifact, monkeypatch):
+    import conda_press.wheel
+    from conda_press.wheel import parse_records, Wheel
+
+    files = {"share/small.txt": b"small\n", "share/large.bin": os.urandom(300000)}
+    path = make_artifact(files=files)
+    records = {}
+    for threshold in (conda_press.wheel.STREAM_WRITE_THRESHOLD, 1000):
+        monkeypatch.setattr(conda_press.wheel, "STREAM_WRITE_THRESHOLD", threshold)
+        with tmpdir.as_cwd():
+            wheel = artifact_to_wheel(path, Config(strip_symbols=False))
+            filename = str(tmpdir.join(wheel.filename))
+        with ZipFile(filename) as zf:
+            assert zf.read("share/large.bin") == files["share/large.bin"]
+            assert zf.testzip() is None
+        records[threshold] = parse_records(Wheel.from_file(filename))
+        wheel.clean()
+    streamed, in_memory = records.values()
+    assert streamed == in_memory
+
+
+def test_record_reuses_paths_json_digests(xonsh, tmpdir, make_artifact):
+    from conda_press.wheel import parse_records, Wheel, record_hash, record_hash_from_digest
+
+    files = {
+        "share/data.txt": b"data\n",
+        "share/other.txt": b"other\n",
+        "bin/tool": b"#!/usr/bin/env python\nprint('hi')\n",
+    }
+    fake = "ab" * 32
+    path = make_artifact(files=files, paths_json={"share/data.txt": fake, "bin/tool": fake})
+    with tmpdir.as_cwd():
+        wheel = artifact_to_wheel(path, Config(strip_symbols=False))
+        filename = str(tmpdir.join(wheel.filename))
+    records = {r[0]: r[1] for r in parse_records(Wheel.from_file(filename))}
+    # unmodified files take their hash from paths.json, without rehashing
+    assert records["share/data.txt"] == record_hash_from_digest(bytes.fromhex(fake))
+    assert records["share/other.txt"] == record_hash(b"other\n")
+    # the shebang of the script was rewritten, so it is hashed again
+    with ZipFile(filename) as zf:
+        assert records["bin/tool"] == record_hash(zf.read("bin/tool"))
+    wheel.clean()
+
+
+def test_prefer_conda_format():
+    recs = [
+        SimpleNamespace(subdir="linux-64", fn="xz-5.2.4-h1_0.tar.bz2"),
+        SimpleNamespace(subdir="linux-64", fn="xz-5.2.4-h1_0.conda"),
+        SimpleNamespace(subdir="linux-64", fn="xz-5.2.5-h1_0.tar.bz2"),
+    ]
+    assert prefer_conda_format(recs) == recs[1:]
+
+
 def test_get_only_deps_on_pypi_by_artifact(tmpdir, xonsh, data_folder):
     with tmpdir.as_cwd():
         conda_pkg = os.path.join(data_folder, "test-deps-0.0.1-py_0.tar.bz2")
@@ -204,3 +681,141 @@ def test_pygobject(pip_install_artifact_tree, xonsh):
     wheel, test_env, sp = pip_install_artifact_tree(
         "pygobject=3.30.4", skip_python=True, fatten=True, skipped_deps={"gobject-introspection"},
     )
+
+
+def test_solve_artifact_ref_cache(tmpdir, monkeypatch):
+    import conda.api
+    from conda.models.records import PackageRecord
+    from conda_press import condatools
+
+    solves = []
+
+    class FakeSolver:
+        def __init__(self, prefix, channels, subdirs=(), specs_to_add=()):
+            self.specs = specs_to_add
+
+        def solve_final_state(self):
+            solves.append(self.specs)
+            return [PackageRecord(name="zlib", version="1.2.11", build="0", build_number=0,
+                                  channel="conda-forge", subdir="linux-64",
+                                  fn="zlib-1.2.11-0.tar.bz2")]
+
+    fingerprint = ["repodata-1"]
+    # the solver is imported when solving, so it is replaced where it comes from
+    monkeypatch.setattr(conda.api, "Solver", FakeSolver)
+    monkeypatch.setattr(condatools, "repodata_fingerprint", lambda c, s: fingerprint[0])
+    config = Config(solve_cache=True, solve_cache_dir=str(tmpdir.join("solves")))
+    recs = condatools.solve_artifact_ref("zlib", config=config)
+    assert [r.name for r in recs] == ["zlib"]
+    assert condatools.solve_artifact_ref("zlib", config=config) == recs
+    assert len(solves) == 1
+    # forcing a re-solve, or new repodata, runs the solver again
+    config.force_solve = True
+    condatools.solve_artifact_ref("zlib", config=config)
+    assert len(solves) == 2
+    config.force_solve = False
+    fingerprint[0] = "repodata-2"
+    condatools.solve_artifact_ref("zlib", config=config)
+    assert len(solves) == 3
+    condatools.solve_artifact_ref("zlib", config=config)
+    assert len(solves) == 3
+
+
+def test_artifact_info_loads_metadata_lazily(xonsh, tmpdir, make_artifact, monkeypatch):
+    path = make_artifact(name="lazy", files={"share/lazy.txt": b"lazy\n"}, depends=["zlib 1.2.*"])
+    yaml_loads = []
+    monkeypatch.setattr(ArtifactInfo, "_load_meta_yaml",
+                        lambda self: yaml_loads.append(self) or None)
+    info = ArtifactInfo.from_tarball_metadata(path)
+    assert info.metadata_only
+    # only info/ has been extracted
+    assert os.listdir(info.artifactdir) == ["info"]
+    assert info.run_requirements == {"zlib": "1.2.*"}
+    assert info.files == ["share/lazy.txt"]
+    # index.json has the dependencies, so meta.yaml is never parsed
+    assert yaml_loads == []
+    with pytest.raises(ValueError):
+        artifact_to_wheel(info)
+    info.clean()
+
+
+def test_artifact_info_pickles_unloaded_metadata(xonsh, tmpdir, make_artifact):
+    path = make_artifact(name="pickled", files={"share/pickled.txt": b"pickled\n"},
+                         depends=["zlib 1.2.*"])
+    info = ArtifactInfo.from_tarball_metadata(path)
+    # nothing has been read yet, as when a wheel comes back from a worker
+    copy = pickle.loads(pickle.dumps(info))
+    assert copy.index_json["name"] == "pickled"
+    assert copy.files == ["share/pickled.txt"]
+    assert copy.run_requirements == {"zlib": "1.2.*"}
+    # loaded values are pickled along
+    assert pickle.loads(pickle.dumps(copy)).index_json == copy.index_json
+    info.clean()
+
+
+def test_inspect_artifact(xonsh, tmpdir, make_artifact):
+    from conda_press.condatools import inspect_artifact
+
+    path = make_artifact(name="insp", files={"share/insp.txt": b"insp\n"},
+                         depends=["zlib 1.2.*", "python >=3.7"])
+    report = inspect_artifact(path, Config(skip_python=True))
+    with tmpdir.as_cwd():
+        wheel = artifact_to_wheel(path, Config(strip_symbols=False, skip_python=True))
+    assert report["filename"] == wheel.filename
+    assert report["requirements"] == ["zlib ==1.2.*"]
+    wheel.clean()
+
+
+def test_stages_share_the_file_index(make_artifact, tmpdir, monkeypatch):
+    import conda_press.condatools as condatools
+    import conda_press.fileindex as fileindex
+
+    classified = []
+    classify_file = fileindex.classify_file
+
+    def counting_classify_file(absname, name=None):
+        classified.append(name)
+        return classify_file(absname, name)
+
+    monkeypatch.setattr(fileindex, "classify_file", counting_classify_file)
+    monkeypatch.setattr(condatools, "classify_file", counting_classify_file)
+    path = make_artifact(name="indexed", files={
+        "bin/indexed": b"#!/usr/bin/env python\nprint(1)\n",
+        "bin/tool": b"\x7fELF" + b"\0" * 60,
+        "share/indexed.txt": b"data\n",
+    })
+    with tmpdir.as_cwd():
+        wheel = artifact_to_wheel(path, config=Config(strip_symbols=False))
+    # classified once, and once more after the shebang was rewritten
+    assert sorted(classified) == ["bin/indexed", "bin/indexed", "bin/tool", "share/indexed.txt"]
+    with ZipFile(str(tmpdir.join(wheel.filename))) as zf:
+        assert zf.getinfo("share/indexed.txt").file_size == 5
+        assert zf.read("bin/indexed").startswith(b"#!python\n")
+
+
+def test_wheel_cache_key_reuses_verified_digest(xonsh, tmpdir, make_artifact, monkeypatch,
+                                                capsys):
+    from conda.models.records import PackageRecord
+    from conda_press import cache as cache_mod, download
+    from conda_press.cache import ArtifactCache
+    from conda_press.condatools import package_to_wheel
+
+    def no_hashing(path):
+        raise AssertionError(f"{path} should not be hashed again")
+
+    monkeypatch.setattr(download, "_CACHE", ArtifactCache(str(tmpdir.join("artifacts"))))
+    monkeypatch.setattr(cache_mod, "file_sha256", no_hashing)
+    path = make_artifact(name="cached", files={"share/cached.txt": b"cached\n"})
+    rec = PackageRecord(name="cached", version="1.0", build="0", build_number=0,
+                        channel="local", subdir="linux-64", depends=[],
+                        fn=os.path.basename(path), url="file://" + path)
+    config = Config(strip_symbols=False, wheel_cache=True,
+                    wheel_cache_dir=str(tmpdir.join("wheels")))
+    out = tmpdir.mkdir("out")
+    with out.as_cwd():
+        first = package_to_wheel(rec, config=config)
+        os.remove(first.filename)
+        second = package_to_wheel(rec, config=config)
+        assert os.path.isfile(second.filename)
+    assert "Using cached wheel" in capsys.readouterr().out
+    first.clean()
@@ -1,3 +1,5 @@
+from dataclasses import asdict
+
 import pytest
 from ruamel import yaml
 
@@ -11,13 +13,35 @@ def config_obj(tmpdir):
         output="OUTPUT",
         channels=["FOO-CHANNEL", "CHANNEL2"],
         fatten=True,
+        incremental="FAT-WHEEL",
         skip_python=True,
         strip_symbols=False,
         merge=True,
         exclude_deps={"EXCLUDE1", "EXCLUDE2"},
         add_deps={"ADD1", "ADD2"},
         only_pypi=True,
+        pypi_index_url="PYPI-INDEX",
+        pypi_cache=True,
+        pypi_cache_dir="PYPI-CACHE",
+        pypi_cache_ttl=30,
         include_requirements=False,
+        jobs=4,
+        download_jobs=8,
+        prefetch_depth=2,
+        stream=True,
+        compress_level=9,
+        reproducible=True,
+        wheel_cache=True,
+        wheel_cache_dir="WHEEL-CACHE",
+        wheel_cache_max_size="1G",
+        artifact_cache_dir="ARTIFACT-CACHE",
+        artifact_cache_max_size="2G",
+        repodata_cache=True,
+        repodata_cache_dir="REPODATA-CACHE",
+        repodata_cache_ttl=60,
+        solve_cache=True,
+        solve_cache_dir="SOLVE-CACHE",
+        force_solve=True,
     )
 
 
@@ -35,13 +59,35 @@ def test_fields(config_obj):
     assert config_obj.subdir == "SUBDIR"
     assert config_obj.output == "OUTPUT"
     assert config_obj.fatten
+    assert config_obj.incremental == "FAT-WHEEL"
     assert config_obj.skip_python
     assert not config_obj.strip_symbols
     assert config_obj.merge
     assert config_obj.exclude_deps == {"EXCLUDE1", "EXCLUDE2"}
     assert config_obj.add_deps == {"ADD1", "ADD2"}
     assert config_obj.only_pypi
+    assert config_obj.pypi_index_url == "PYPI-INDEX"
+    assert config_obj.pypi_cache
+    assert config_obj.pypi_cache_dir == "PYPI-CACHE"
+    assert config_obj.pypi_cache_ttl == 30
     assert not config_obj.include_requirements
+    assert config_obj.jobs == 4
+    assert config_obj.download_jobs == 8
+    assert config_obj.prefetch_depth == 2
+    assert config_obj.stream
+    assert config_obj.compress_level == 9
+    assert config_obj.reproducible
+    assert config_obj.wheel_cache
+    assert config_obj.wheel_cache_dir == "WHEEL-CACHE"
+    assert config_obj.wheel_cache_max_size == "1G"
+    assert config_obj.artifact_cache_dir == "ARTIFACT-CACHE"
+    assert config_obj.artifact_cache_max_size == "2G"
+    assert config_obj.repodata_cache
+    assert config_obj.repodata_cache_dir == "REPODATA-CACHE"
+    assert config_obj.repodata_cache_ttl == 60
+    assert config_obj.solve_cache
+    assert config_obj.solve_cache_dir == "SOLVE-CACHE"
+    assert config_obj.force_solve
 
 
 def test_clean_deps(config_obj):
@@ -51,18 +97,50 @@ def test_clean_deps(config_obj):
     assert config_obj.clean_deps(all_deps) == {"DEP0", "DEP1", "DEP3", "DEP5"}
 
 
+def test_fingerprint(config_obj):
+    other = Config(**asdict(config_obj))
+    assert other.fingerprint() == config_obj.fingerprint()
+    other.exclude_deps = {"EXCLUDE2", "EXCLUDE1"}
+    assert other.fingerprint() == config_obj.fingerprint()
+    other.output = "OTHER-OUTPUT"
+    assert other.fingerprint() != config_obj.fingerprint()
+    assert other.fingerprint(["strip_symbols"]) == config_obj.fingerprint(["strip_symbols"])
+
+
 DICT_CONFIG_CONTENT = {
     "subdir": "SUBDIR",
     "output": "OUTPUT",
     "channels": ["FOO-CHANNEL", "CHANNEL2"],
     "fatten": True,
+    "incremental": "FAT-WHEEL",
     "skip_python": True,
     "strip_symbols": False,
     "merge": True,
     "exclude_deps": ["EXCLUDE1", "EXCLUDE2"],
     "add_deps": ["ADD1", "ADD2"],
     "only_pypi": True,
+    "pypi_index_url": "PYPI-INDEX",
+    "pypi_cache": True,
+    "pypi_cache_dir": "PYPI-CACHE",
+    "pypi_cache_ttl": 30,
     "include_requirements": False,
+    "jobs": 4,
+    "download_jobs": 8,
+    "prefetch_depth": 2,
+    "stream": True,
+    "compress_level": 9,
+    "reproducible": True,
+    "wheel_cache": True,
+    "wheel_cache_dir": "WHEEL-CACHE",
+    "wheel_cache_max_size": "1G",
+    "artifact_cache_dir": "ARTIFACT-CACHE",
+    "artifact_cache_max_size": "2G",
+    "repodata_cache": True,
+    "repodata_cache_dir": "REPODATA-CACHE",
+    "repodata_cache_ttl": 60,
+    "solve_cache": True,
+    "solve_cache_dir": "SOLVE-CACHE",
+    "force_solve": True,
 }
 
 
@@ -86,10 +164,32 @@ def test_populate_config_by_yaml(config_content, tmpdir):
     assert config_read.get_all_subdir() == ["SUBDIR", "noarch"]
     assert config_read.output == "OUTPUT"
     assert config_read.fatten
+    assert config_read.incremental == "FAT-WHEEL"
     assert config_read.skip_python
     assert not config_read.strip_symbols
     assert config_read.merge
     assert config_read.exclude_deps == {"EXCLUDE1", "EXCLUDE2"}
     assert config_read.add_deps == {"ADD1", "ADD2"}
     assert config_read.only_pypi
+    assert config_read.pypi_index_url == "PYPI-INDEX"
+    assert config_read.pypi_cache
+    assert config_read.pypi_cache_dir == "PYPI-CACHE"
+    assert config_read.pypi_cache_ttl == 30
     assert not config_read.include_requirements
+    assert config_read.jobs == 4
+    assert config_read.download_jobs == 8
+    assert config_read.prefetch_depth == 2
+    assert config_read.stream
+    assert config_read.compress_level == 9
+    assert config_read.reproducible
+    assert config_read.wheel_cache
+    assert config_read.wheel_cache_dir == "WHEEL-CACHE"
+    assert config_read.wheel_cache_max_size == "1G"
+    assert config_read.artifact_cache_dir == "ARTIFACT-CACHE"
+    assert config_read.artifact_cache_max_size == "2G"
+    assert config_read.repodata_cache
+    assert config_read.repodata_cache_dir == "REPODATA-CACHE"
+    assert config_read.repodata_cache_ttl == 60
+    assert config_read.solve_cache
+    assert config_read.solve_cache_dir == "SOLVE-CACHE"
+    assert config_read.force_solve
@@ -0,0 +1,151 @@
+import os
+import time
+from hashlib import md5, sha256
+from types import SimpleNamespace
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+from conda_press.cache import ArtifactCache
+from conda_press.download import (
+    download_package_rec,
+    iter_prefetched_package_recs,
+    prefetch_package_recs,
+)
+
+
+def _add_package(channel_dir, url, fn, data, **kwargs):
+    channel_dir.ensure_dir("linux-64")
+    channel_dir.join("linux-64", fn).write_binary(data)
+    rec = dict(fn=fn, url=f"{url}/linux-64/{fn}", md5=md5(data).hexdigest(),
+               sha256=sha256(data).hexdigest())
+    rec.update(kwargs)
+    return SimpleNamespace(**rec)
+
+
+def _artifacts(cachedir):
+    """Lists the artifacts in a cache directory, without its bookkeeping."""
+    return sorted(fn for fn in os.listdir(cachedir) if not fn.startswith("."))
+
+
+def test_download_package_rec(tmpdir, http_channel):
+    channel_dir, url = http_channel
+    data = os.urandom(3 * 1024 * 1024 + 17)
+    rec = _add_package(channel_dir, url, "a-1.0-0.tar.bz2", data)
+    cachedir = str(tmpdir.join("cache"))
+    local_fn = download_package_rec(rec, cachedir=cachedir)
+    assert local_fn == os.path.join(cachedir, "a-1.0-0.tar.bz2")
+    with open(local_fn, "rb") as f:
+        assert f.read() == data
+    assert _artifacts(cachedir) == ["a-1.0-0.tar.bz2"]
+
+
+@pytest.mark.parametrize("bad", ["md5", "sha256"])
+def test_download_package_rec_bad_checksum(tmpdir, http_channel, bad):
+    channel_dir, url = http_channel
+    rec = _add_package(channel_dir, url, "a-1.0-0.tar.bz2", b"some data", **{bad: "0" * 32})
+    cachedir = str(tmpdir.join("cache"))
+    with pytest.raises(RuntimeError):
+        download_package_rec(rec, cachedir=cachedir)
+    # no partial or unverified files are left behind
+    assert _artifacts(cachedir) == []
+
+
+def test_download_file_url(tmpdir):
+    src = tmpdir.join("b-1.0-0.tar.bz2")
+    src.write_binary(b"local data")
+    rec = SimpleNamespace(fn="b-1.0-0.tar.bz2", url="file://" + str(src), md5=None, sha256=None)
+    local_fn = download_package_rec(rec, cachedir=str(tmpdir.join("cache")))
+    with open(local_fn, "rb") as f:
+        assert f.read() == b"local data"
+
+
+def test_prefetch_package_recs(tmpdir, http_channel):
+    channel_dir, url = http_channel
+    recs = [_add_package(channel_dir, url, f"p{i}-1.0-0.tar.bz2", os.urandom(1000 + i))
+            for i in range(10)]
+    cachedir = str(tmpdir.join("cache"))
+    local_fns = prefetch_package_recs(recs, jobs=4, cachedir=cachedir)
+    assert local_fns == [os.path.join(cachedir, r.fn) for r in recs]
+    assert _artifacts(cachedir) == sorted(r.fn for r in recs)
+
+
+@pytest.mark.parametrize("depth", [0, 1, 3])
+def test_iter_prefetched_package_recs(tmpdir, http_channel, depth):
+    channel_dir, url = http_channel
+    recs = [_add_package(channel_dir, url, f"p{i}-1.0-0.tar.bz2", os.urandom(1000 + i))
+            for i in range(8)]
+    cachedir = str(tmpdir.join("cache"))
+    consumed = []
+    for rec, local_fn in iter_prefetched_package_recs(recs, depth=depth, jobs=2,
+                                                      cachedir=cachedir):
+        assert local_fn == os.path.join(cachedir, rec.fn)
+        assert os.path.isfile(local_fn)
+        consumed.append(rec)
+        # never more than depth downloads ahead of the one being consumed
+        assert len(_artifacts(cachedir)) <= len(consumed) + depth
+    assert consumed == recs
+    assert _artifacts(cachedir) == sorted(r.fn for r in recs)
+
+
+def test_iter_prefetched_package_recs_stops_early(tmpdir, http_channel):
+    channel_dir, url = http_channel
+    recs = [_add_package(channel_dir, url, f"p{i}-1.0-0.tar.bz2", os.urandom(1000 + i))
+            for i in range(8)]
+    cachedir = str(tmpdir.join("cache"))
+    downloaded = iter_prefetched_package_recs(recs, depth=2, jobs=2, cachedir=cachedir)
+    assert next(downloaded)[0] is recs[0]
+    downloaded.close()
+    assert len(_artifacts(cachedir)) <= 3
+
+
+def test_prefetched_artifacts_are_not_evicted(tmpdir, http_channel):
+    channel_dir, url = http_channel
+    recs = [_add_package(channel_dir, url, f"p{i}-1.0-0.tar.bz2", os.urandom(1000))
+            for i in range(6)]
+    # only fits one artifact, so each download evicts whatever is not in use
+    cache = ArtifactCache(str(tmpdir.join("cache")), max_size=1500)
+    for rec, local_fn in iter_prefetched_package_recs(recs, depth=2, jobs=2, cache=cache):
+        # give the downloads ahead of this one the time to finish
+        time.sleep(0.1)
+        assert os.path.isfile(local_fn)
+    assert len(_artifacts(cache.cachedir)) < len(recs)
+
+
+def test_corrupt_cached_artifact_is_downloaded_again(tmpdir, http_channel):
+    channel_dir, url = http_channel
+    data = os.urandom(1000)
+    rec = _add_package(channel_dir, url, "a-1.0-0.tar.bz2", data)
+    cachedir = str(tmpdir.join("cache"))
+    local_fn = download_package_rec(rec, cachedir=cachedir)
+    # a half written file, as left by an older conda-press
+    with open(local_fn, "wb") as f:
+        f.write(data[:500])
+    assert download_package_rec(rec, cachedir=cachedir) == local_fn
+    with open(local_fn, "rb") as f:
+        assert f.read() == data
+
+
+def test_concurrent_downloads_of_the_same_artifact(tmpdir, http_channel, capsys):
+    channel_dir, url = http_channel
+    data = os.urandom(2 * 1024 * 1024)
+    rec = _add_package(channel_dir, url, "a-1.0-0.tar.bz2", data)
+    cachedir = str(tmpdir.join("cache"))
+    with ThreadPoolExecutor(max_workers=8) as executor:
+        # separate caches, as separate processes would have
+        futures = [executor.submit(download_package_rec, rec, cache=ArtifactCache(cachedir))
+                   for _ in range(8)]
+        local_fns = {future.result() for future in futures}
+    assert local_fns == {os.path.join(cachedir, "a-1.0-0.tar.bz2")}
+    assert capsys.readouterr().out.count("Downloading") == 1
+    assert _artifacts(cachedir) == ["a-1.0-0.tar.bz2"]
+
+
+def test_downloads_evict_old_artifacts(tmpdir, http_channel):
+    channel_dir, url = http_channel
+    recs = [_add_package(channel_dir, url, f"p{i}-1.0-0.tar.bz2", os.urandom(1000))
+            for i in range(4)]
+    cache = ArtifactCache(str(tmpdir.join("cache")), max_size=2500)
+    for rec in recs:
+        download_package_rec(rec, cache=cache)
+    assert _artifacts(cache.cachedir) == ["p2-1.0-0.tar.bz2", "p3-1.0-0.tar.bz2"]
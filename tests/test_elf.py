@@ -0,0 +1,89 @@
+import os
+import shutil
+import subprocess
+
+import pytest
+
+from conda_press.config import SYSTEM
+from conda_press.elf import (
+    ElfFile,
+    ET_DYN,
+    ET_REL,
+    has_symbols,
+    is_elf,
+    is_strippable,
+    prepend_rpaths,
+    read_rpath,
+    set_rpath,
+)
+
+pytestmark = [
+    pytest.mark.skipif(SYSTEM != "Linux", reason="can only be run on Linux"),
+    pytest.mark.skipif(shutil.which("gcc") is None, reason="gcc is required"),
+]
+
+
+def _build_lib(tmpdir, name, ldflags=()):
+    src = tmpdir.join("lib.c")
+    src.write("int answer(void) { return 42; }\n")
+    lib = str(tmpdir.join(name))
+    subprocess.run(["gcc", "-g", "-shared", "-fPIC", "-o", lib, str(src)] + list(ldflags),
+                   check=True)
+    return lib
+
+
+def test_read_rpath(tmpdir):
+    runpath = _build_lib(tmpdir, "librunpath.so", ["-Wl,--enable-new-dtags,-rpath,$ORIGIN/../../.."])
+    rpath = _build_lib(tmpdir, "librpath.so", ["-Wl,--disable-new-dtags,-rpath,/opt/a:/opt/b"])
+    norpath = _build_lib(tmpdir, "libnorpath.so")
+    assert read_rpath(runpath) == "$ORIGIN/../../.."
+    assert read_rpath(rpath) == "/opt/a:/opt/b"
+    assert read_rpath(norpath) == ""
+    assert is_elf(norpath)
+
+
+def test_set_rpath_in_place(tmpdir):
+    lib = _build_lib(tmpdir, "libtest.so", ["-Wl,-rpath,/some/long/run/path"])
+    size = os.path.getsize(lib)
+    assert set_rpath(lib, "$ORIGIN/lib")
+    assert read_rpath(lib) == "$ORIGIN/lib"
+    assert os.path.getsize(lib) == size
+    if shutil.which("readelf") is not None:
+        out = subprocess.check_output(["readelf", "-d", lib], universal_newlines=True)
+        assert "[$ORIGIN/lib]" in out
+    # longer run paths do not fit, and leave the file alone
+    assert not set_rpath(lib, "$ORIGIN/lib:/a/much/longer/run/path")
+    assert read_rpath(lib) == "$ORIGIN/lib"
+    # neither do libraries without a run path
+    assert not set_rpath(_build_lib(tmpdir, "libnorpath.so"), "$ORIGIN")
+
+
+def test_prepend_rpaths(tmpdir):
+    done = _build_lib(tmpdir, "libdone.so", ["-Wl,-rpath,$ORIGIN/lib:/opt/a"])
+    grow = _build_lib(tmpdir, "libgrow.so", ["-Wl,-rpath,/opt/a"])
+    new_rpaths, leftover = prepend_rpaths({done: "$ORIGIN/lib", grow: "$ORIGIN/lib"})
+    assert new_rpaths == {done: "$ORIGIN/lib:/opt/a", grow: "$ORIGIN/lib:/opt/a"}
+    assert leftover == {grow: "$ORIGIN/lib:/opt/a"}
+
+
+def test_has_symbols(tmpdir):
+    lib = _build_lib(tmpdir, "libtest.so")
+    assert has_symbols(lib)
+    assert ElfFile(lib).elfclass in (1, 2)
+    subprocess.run(["strip", "--strip-all", lib], check=True)
+    assert not has_symbols(lib)
+
+
+def test_is_strippable(tmpdir):
+    lib = _build_lib(tmpdir, "libtest.so")
+    obj = str(tmpdir.join("crt.o"))
+    subprocess.run(["gcc", "-g", "-c", "-o", obj, str(tmpdir.join("lib.c"))], check=True)
+    assert ElfFile(lib).type == ET_DYN
+    assert ElfFile(obj).type == ET_REL
+    assert is_strippable(lib)
+    # relocatable objects need their symbols to be linked
+    assert has_symbols(obj)
+    assert not is_strippable(obj)
+    assert not is_strippable(str(tmpdir.join("lib.c")))
+    subprocess.run(["strip", "--strip-all", lib], check=True)
+    assert not is_strippable(lib)
@@ -0,0 +1,57 @@
+import os
+import stat
+
+from conda_press.fileindex import (
+    DIR,
+    FILE,
+    LINK,
+    MISSING,
+    FileRecord,
+    classify_file,
+    is_shared_lib,
+    scan_files,
+)
+
+
+def _write(path, data):
+    with open(str(path), "wb") as f:
+        f.write(data)
+
+
+def test_classify_file(tmpdir):
+    _write(tmpdir.join("libfoo.so"), b"\x7fELF" + b"\0" * 60)
+    _write(tmpdir.join("script"), b"#!/usr/bin/env python\n")
+    _write(tmpdir.join("empty"), b"")
+    os.chmod(str(tmpdir.join("script")), 0o755)
+    lib = classify_file(str(tmpdir.join("libfoo.so")))
+    assert (lib.kind, lib.size, lib.elf, lib.shebang) == (FILE, 64, True, False)
+    assert lib.shared_lib == is_shared_lib("libfoo.so")
+    script = classify_file(str(tmpdir.join("script")))
+    assert (script.kind, script.elf, script.shebang, script.shared_lib) == (FILE, False, True, False)
+    assert stat.S_IMODE(script.mode) == 0o755
+    assert script.mtime == os.stat(str(tmpdir.join("script"))).st_mtime
+    empty = classify_file(str(tmpdir.join("empty")))
+    assert (empty.kind, empty.size, empty.elf, empty.shebang) == (FILE, 0, False, False)
+
+
+def test_classify_file_links_dirs_and_missing(tmpdir):
+    _write(tmpdir.join("libfoo.so.1"), b"\x7fELF")
+    os.symlink("libfoo.so.1", str(tmpdir.join("libfoo.so")))
+    tmpdir.mkdir("sub")
+    # links are not followed
+    link = classify_file(str(tmpdir.join("libfoo.so")))
+    assert (link.kind, link.elf) == (LINK, False)
+    assert classify_file(str(tmpdir.join("sub"))).kind == DIR
+    assert classify_file(str(tmpdir.join("nope"))) == FileRecord(MISSING)
+
+
+def test_scan_files(tmpdir):
+    tmpdir.mkdir("lib")
+    _write(tmpdir.join("lib", "libfoo.so"), b"not elf")
+    index = scan_files(str(tmpdir), ["lib/libfoo.so", "lib/missing.so"])
+    assert list(index) == ["lib/libfoo.so", "lib/missing.so"]
+    assert index["lib/libfoo.so"].size == 7
+    assert not index["lib/libfoo.so"].elf
+    # the shared library flag comes from the name in the artifact
+    assert index["lib/libfoo.so"].shared_lib == is_shared_lib("libfoo.so")
+    assert index["lib/missing.so"].kind == MISSING
@@ -0,0 +1,108 @@
+import os
+import json
+from concurrent.futures import ProcessPoolExecutor
+
+import pytest
+
+from conda_press import instrument
+from conda_press.condatools import artifact_to_wheel
+from conda_press.config import Config
+from conda_press.instrument import (
+    StageEvent,
+    TraceRecorder,
+    add_listener,
+    chrome_trace,
+    count_subprocess,
+    listening,
+    remove_listener,
+    stage,
+    summarize_events,
+)
+
+
+def test_stage_emits_event():
+    events = []
+    with listening(events.append):
+        with stage("outer", "pkg") as s:
+            s.add_bytes(10)
+            with stage("inner", "pkg") as inner:
+                inner.add_bytes(5)
+                count_subprocess(2)
+    assert [e.name for e in events] == ["inner", "outer"]
+    inner, outer = events
+    assert (inner.nbytes, inner.subprocesses, inner.label) == (5, 2, "pkg")
+    assert (outer.nbytes, outer.subprocesses) == (10, 2)
+    assert outer.wall >= inner.wall >= 0
+    assert outer.pid == os.getpid()
+
+
+def test_stage_without_listeners():
+    assert not instrument._LISTENERS
+    with stage("quiet") as s:
+        s.add_bytes(1)
+    events = []
+    add_listener(events.append)
+    remove_listener(events.append)
+    with stage("quiet"):
+        pass
+    assert events == []
+
+
+def test_stage_emits_on_error():
+    events = []
+    with listening(events.append), pytest.raises(RuntimeError):
+        with stage("failing"):
+            raise RuntimeError("boom")
+    assert [e.name for e in events] == ["failing"]
+
+
+def test_chrome_trace():
+    events = [StageEvent("write", "a.whl", start=100.5, wall=0.25, cpu=0.2, nbytes=7, pid=1, tid=2),
+              StageEvent("extract", "a", start=100.0, wall=0.5, cpu=0.4, nbytes=3, pid=1, tid=2)]
+    trace = chrome_trace(events)
+    assert [(e["name"], e["ts"], e["dur"]) for e in trace["traceEvents"]] == [
+        ("extract", 0.0, 500000.0), ("write", 500000.0, 250000.0)]
+    assert trace["traceEvents"][0]["args"]["bytes"] == 3
+    assert list(trace["otherData"]["stages"]) == ["extract", "write"]
+    summary = summarize_events(events + events)
+    assert summary["write"]["count"] == 2
+    assert summary["write"]["nbytes"] == 14
+
+
+def _worker_stage(name):
+    with stage(name, "worker"):
+        pass
+    return os.getpid()
+
+
+def test_trace_recorder_collects_worker_processes(tmpdir):
+    fname = str(tmpdir.join("trace.json"))
+    with TraceRecorder(fname) as recorder:
+        with stage("parent"):
+            with ProcessPoolExecutor(max_workers=1) as executor:
+                worker_pid = executor.submit(_worker_stage, "child").result()
+    assert sorted((e.name, e.pid) for e in recorder.events) == [
+        ("child", worker_pid), ("parent", os.getpid())]
+    assert instrument.PROFILE_DIR_ENV not in os.environ
+    with open(fname) as f:
+        trace = json.load(f)
+    assert sorted(e["name"] for e in trace["traceEvents"]) == ["child", "parent"]
+
+
+def test_artifact_to_wheel_stages(make_artifact, tmpdir):
+    path = make_artifact(name="inst", files={"lib/libinst.so": b"\x7fELF" + b"\0" * 60,
+                                             "bin/inst": b"#!/usr/bin/env python\nprint(1)\n"},
+                         links={"lib/libinst.so.1": "libinst.so"})
+    events = []
+    with tmpdir.as_cwd(), listening(events.append):
+        artifact_to_wheel(path, config=Config(strip_symbols=False))
+    names = [e.name for e in events]
+    for name in ("extract", "replace_symlinks", "rewrite_shebang", "rewrite_rpaths", "write",
+                 "convert"):
+        assert name in names
+    assert names[-1] == "convert"
+    by_name = {e.name: e for e in events}
+    assert by_name["extract"].nbytes == os.path.getsize(path)
+    assert by_name["extract"].label == "inst-1.0-0"
+    assert by_name["replace_symlinks"].nbytes == 64
+    assert by_name["write"].nbytes == os.path.getsize(str(tmpdir.join(by_name["write"].label)))
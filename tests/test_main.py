@@ -1,6 +1,11 @@
 import os
+import sys
+import subprocess
+from types import SimpleNamespace
+from zipfile import ZipFile
 
 from conda_press import main
+from conda_press.config import Config
 
 
 def test_main(script_runner, data_folder):
@@ -18,3 +23,92 @@ def test_main_empty_config_yaml(tmpdir, script_runner, data_folder):
         main.__file__, conda_pkg, "--config", str(cp_yaml)
     )
     assert response.success, response.stderr
+
+
+def test_main_cache_list_and_purge(tmpdir, script_runner):
+    cachedir = str(tmpdir.join("wheel-cache"))
+    response = script_runner.run(main.__file__, "cache", "list", "--wheel-cache-dir", cachedir)
+    assert response.success, response.stderr
+    assert "0 cached wheels" in response.stdout
+    response = script_runner.run(main.__file__, "cache", "purge", "--wheel-cache-dir", cachedir)
+    assert response.success, response.stderr
+
+
+def test_main_cache_verify_exit_status(tmpdir):
+    from conda_press.cache import ArtifactCache
+
+    cache = ArtifactCache(str(tmpdir.join("artifacts")))
+    args = [sys.executable, "-m", "conda_press", "cache", "verify", "--artifact-cache-dir",
+            cache.cachedir, "--wheel-cache-dir", str(tmpdir.join("wheels"))]
+    proc = subprocess.run(args, env=_cli_env(), stdout=subprocess.PIPE)
+    assert proc.returncode == 0
+    assert b"0 corrupt artifacts" in proc.stdout
+    # a corrupt artifact makes the command fail
+    part = tmpdir.join("artifacts").ensure_dir().join("a-1.0-0.tar.bz2.part")
+    part.write_binary(b"some data")
+    cache.put(SimpleNamespace(fn="a-1.0-0.tar.bz2"), str(part), md5="0" * 32)
+    proc = subprocess.run(args, env=_cli_env(), stdout=subprocess.PIPE)
+    assert proc.returncode == 1
+    assert b"Removed corrupt artifact a-1.0-0.tar.bz2" in proc.stdout
+
+
+# modules that the fast paths of the command line interface must not import,
+# since they make it slow to start. Startup is timed by the benchmarks rather
+# than here, where wall-clock limits would be flaky on loaded machines.
+HEAVY_MODULES = {"conda", "requests", "ruamel"}
+
+CLI_SCRIPT = """
+import sys
+from conda_press.main import main
+try:
+    main(sys.argv[1:])
+except SystemExit:
+    pass
+print(" ".join(sorted({m.partition(".")[0] for m in sys.modules})), file=sys.stderr)
+"""
+
+
+def _cli_env():
+    """Returns the environment to run the command line interface in, which
+    finds the conda_press being tested wherever the command runs.
+    """
+    pkgroot = os.path.dirname(os.path.dirname(os.path.abspath(main.__file__)))
+    env = dict(os.environ)
+    env["PYTHONPATH"] = os.pathsep.join(filter(None, [pkgroot, env.get("PYTHONPATH")]))
+    return env
+
+
+def _run_cli(args, cwd=None):
+    """Runs the command line interface in a fresh interpreter. Returns the
+    top-level modules that were imported.
+    """
+    proc = subprocess.run([sys.executable, "-c", CLI_SCRIPT] + args, cwd=cwd, env=_cli_env(),
+                          stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    assert proc.returncode == 0, proc.stderr.decode()
+    return set(proc.stderr.decode().splitlines()[-1].split())
+
+
+def test_help_startup():
+    modules = _run_cli(["--help"])
+    assert not modules & (HEAVY_MODULES | {"xonsh", "tqdm"})
+
+
+def test_merge_startup(make_artifact, tmpdir):
+    from conda_press.condatools import artifact_to_wheel
+
+    config = Config(strip_symbols=False)
+    with tmpdir.as_cwd():
+        for name in ("a", "b"):
+            path = make_artifact(name=name, files={f"share/{name}.txt": b"text\n"})
+            artifact_to_wheel(path, config=config)
+    wheels = sorted(f for f in os.listdir(str(tmpdir)) if f.endswith(".whl"))
+    modules = _run_cli(["--merge"] + wheels, cwd=str(tmpdir))
+    with ZipFile(str(tmpdir.join(wheels[-1]))) as zf:
+        assert {"share/a.txt", "share/b.txt"} <= set(zf.namelist())
+    assert not modules & HEAVY_MODULES
+
+
+def test_inspect_startup(make_artifact, tmpdir):
+    path = make_artifact(name="a", files={"share/a.txt": b"text\n"}, depends=["b >=1.0"])
+    modules = _run_cli(["inspect", path], cwd=str(tmpdir))
+    assert not modules & HEAVY_MODULES
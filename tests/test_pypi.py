@@ -0,0 +1,99 @@
+import os
+import time
+
+import pytest
+
+from conda_press.config import Config
+from conda_press.condatools import get_only_deps_on_pypi
+from conda_press.pypi import PypiIndex, normalize_name, project_name
+
+
+def _make_index(index_dir, projects, simple):
+    for name in projects:
+        if simple:
+            index_dir.ensure(name, "index.html")
+        else:
+            index_dir.ensure(name, "json").write("{}")
+    return index_dir
+
+
+@pytest.fixture
+def count_lookups(monkeypatch):
+    calls = []
+    lookup = PypiIndex._lookup
+
+    def counting_lookup(self, name):
+        calls.append(name)
+        return lookup(self, name)
+
+    monkeypatch.setattr(PypiIndex, "_lookup", counting_lookup)
+    return calls
+
+
+@pytest.mark.parametrize("req, name", [
+    ("numpy", "numpy"),
+    ("numpy >=1.17", "numpy"),
+    ("ruamel.yaml>=0.15", "ruamel.yaml"),
+    ("pytest-xdist 1.0 py_0", "pytest-xdist"),
+])
+def test_project_name(req, name):
+    assert project_name(req) == name
+
+
+def test_normalize_name():
+    assert normalize_name("Ruamel.YAML") == "ruamel-yaml"
+    assert normalize_name("pytest__xdist") == "pytest-xdist"
+
+
+@pytest.mark.parametrize("simple", [True, False])
+def test_http_index(http_channel, count_lookups, simple):
+    channel_dir, url = http_channel
+    path = "simple" if simple else "pypi"
+    _make_index(channel_dir.join(path), ["pytest", "pytest-xdist"], simple)
+    index = PypiIndex(index_url=f"{url}/{path}")
+    assert index.simple == simple
+    exists = index.exists(["pytest", "pytest_xdist", "not-a-package-000"])
+    assert exists == {"pytest": True, "pytest_xdist": True, "not-a-package-000": False}
+    assert len(count_lookups) == 3
+    # answers are remembered
+    assert index.exists(["pytest", "Pytest-Xdist"]) == {"pytest": True, "Pytest-Xdist": True}
+    assert len(count_lookups) == 3
+
+
+def test_unreachable_index_is_not_cached(count_lookups):
+    index = PypiIndex(index_url="http://127.0.0.1:1/pypi")
+    assert index.exists(["pytest"]) == {"pytest": False}
+    assert index.exists(["pytest"]) == {"pytest": False}
+    assert len(count_lookups) == 2
+
+
+def test_persisted_index(tmpdir, count_lookups):
+    index_dir = _make_index(tmpdir.join("simple"), ["pytest"], simple=True)
+    index_url = "file://" + str(index_dir)
+    cachedir = str(tmpdir.join("cache"))
+    assert PypiIndex(index_url, cachedir=cachedir).exists(["pytest"]) == {"pytest": True}
+    assert len(count_lookups) == 1
+    # a new index, as in a new run, starts warm from disk
+    assert PypiIndex(index_url, cachedir=cachedir).exists(["pytest"]) == {"pytest": True}
+    assert len(count_lookups) == 1
+    # unless the answers have expired
+    time.sleep(0.01)
+    assert PypiIndex(index_url, cachedir=cachedir, ttl=0.001).exists(["pytest"]) == {"pytest": True}
+    assert len(count_lookups) == 2
+
+
+def test_from_config():
+    config = Config(pypi_index_url="https://mirror.example.com/simple/", pypi_cache_ttl=5)
+    index = PypiIndex.from_config(config)
+    assert index.index_url == "https://mirror.example.com/simple"
+    assert index.simple
+    assert index.cachedir is None
+    assert index.ttl == 5
+    assert index.project_url("Ruamel.YAML") == "https://mirror.example.com/simple/ruamel-yaml/"
+
+
+def test_get_only_deps_on_pypi_mirror(tmpdir):
+    index_dir = _make_index(tmpdir.join("pypi"), ["numpy", "ruamel-yaml"], simple=False)
+    index = PypiIndex("file://" + str(index_dir))
+    deps = ["numpy >=1.17", "ruamel.yaml", "libgcc-ng >=7.3.0"]
+    assert get_only_deps_on_pypi(deps, index=index) == {"numpy >=1.17", "ruamel.yaml"}
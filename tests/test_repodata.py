@@ -0,0 +1,206 @@
+import os
+import json
+import time
+from types import SimpleNamespace
+
+import pytest
+
+from conda_press import repodata
+from conda_press.config import Config
+from conda_press.repodata import (
+    RepodataIndex,
+    filter_python_records,
+    python_tag,
+    repodata_fingerprint,
+)
+
+
+def _record(name, version, build, subdir):
+    fn = f"{name}-{version}-{build}.tar.bz2"
+    return fn, dict(name=name, version=version, build=build, build_number=0,
+                    depends=[], md5="0" * 32, subdir=subdir)
+
+
+def _make_channel(channel_dir, packages):
+    """Writes the repodata.json files of a local channel, packages maps
+    subdirs to lists of (name, version, build) tuples.
+    """
+    for subdir in ("linux-64", "noarch"):
+        recs = dict(_record(*pkg, subdir) for pkg in packages.get(subdir, ()))
+        channel_dir.ensure_dir(subdir)
+        channel_dir.join(subdir, "repodata.json").write(json.dumps(
+            {"info": {"subdir": subdir}, "packages": recs, "packages.conda": {}}))
+    return "file://" + str(channel_dir)
+
+
+@pytest.fixture
+def local_channel(tmpdir):
+    pytag = python_tag()
+    packages = {
+        "linux-64": [
+            ("numpy", "1.17.0", f"{pytag}h1234_0"),
+            ("numpy", "1.17.0", "py27h1234_0"),
+            ("numpy", "1.18.0", f"{pytag}h1234_0"),
+            ("zlib", "1.2.11", "h1234_0"),
+        ],
+        "noarch": [("six", "1.12.0", "py_0")],
+    }
+    return _make_channel(tmpdir.join("channel"), packages)
+
+
+@pytest.fixture
+def count_queries(monkeypatch):
+    from conda.api import SubdirData
+
+    calls = []
+    query = SubdirData.query
+
+    def counting_query(self, *args, **kwargs):
+        calls.append(args)
+        return query(self, *args, **kwargs)
+
+    monkeypatch.setattr(SubdirData, "query", counting_query)
+    return calls
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    """Replaces the clock of the repodata module, the current time is the
+    first item of the returned list.
+    """
+    now = [time.time()]
+    monkeypatch.setattr(repodata, "time", SimpleNamespace(time=lambda: now[0]))
+    return now
+
+
+def test_filter_python_records():
+    class Rec:
+        def __init__(self, build):
+            self.build = build
+
+    recs = [Rec("py37h1_0"), Rec("py38h1_0"), Rec("h1_0")]
+    assert [r.build for r in filter_python_records(recs, "py37")] == ["py37h1_0", "h1_0"]
+
+
+def test_query_filters_python(local_channel, count_queries):
+    index = RepodataIndex()
+    recs = index.query(local_channel, "linux-64", "numpy")
+    assert sorted(r.version for r in recs) == ["1.17.0", "1.18.0"]
+    assert all(python_tag() in r.build for r in recs)
+    recs = index.query(local_channel, "linux-64", "numpy=1.17")
+    assert [r.version for r in recs] == ["1.17.0"]
+    # noarch records are never filtered
+    assert [r.name for r in index.query(local_channel, "noarch", "six")] == ["six"]
+    # only the first lookup of a name queries the channel
+    assert len(count_queries) == 2
+
+
+def test_query_missing(local_channel):
+    index = RepodataIndex()
+    assert index.query(local_channel, "noarch", "numpy") == []
+
+
+def test_persisted_index(tmpdir, local_channel, count_queries, clock):
+    cachedir = str(tmpdir.join("repodata"))
+    index = RepodataIndex(cachedir=cachedir)
+    expected = index.query(local_channel, "linux-64", "numpy")
+    index.close()
+    assert len(os.listdir(cachedir)) == 1
+    # a new index, as in a new run, starts warm from disk
+    index = RepodataIndex(cachedir=cachedir)
+    assert index.query(local_channel, "linux-64", "numpy") == expected
+    assert len(count_queries) == 1
+    # but expired names are ignored
+    clock[0] += 120
+    index = RepodataIndex(cachedir=cachedir, ttl=60)
+    assert index.query(local_channel, "linux-64", "numpy") == expected
+    assert len(count_queries) == 2
+
+
+def test_persisted_once_per_subdir(tmpdir, local_channel, monkeypatch):
+    cachedir = str(tmpdir.join("repodata"))
+    index = RepodataIndex(cachedir=cachedir)
+    writes = []
+    persist = index._persist
+
+    def counting_persist(channel, subdir):
+        writes.append((channel, subdir))
+        persist(channel, subdir)
+
+    monkeypatch.setattr(index, "_persist", counting_persist)
+    for name in ("numpy", "zlib", "missing"):
+        index.query(local_channel, "linux-64", name)
+    index.query(local_channel, "noarch", "six")
+    # lookups of new names do not write anything
+    assert writes == []
+    assert not os.path.exists(cachedir)
+    index.close()
+    assert writes == [(local_channel, "linux-64"), (local_channel, "noarch")]
+    index.close()
+    assert len(writes) == 2
+    # every name looked up was persisted
+    warm = RepodataIndex(cachedir=cachedir)
+    assert set(warm._load(local_channel, "linux-64")) == {"numpy", "zlib", "missing"}
+
+
+def test_persisted_names_expire_separately(tmpdir, local_channel, count_queries, clock):
+    cachedir = str(tmpdir.join("repodata"))
+    index = RepodataIndex(cachedir=cachedir, ttl=60)
+    index.query(local_channel, "linux-64", "numpy")
+    index.close()
+    # a later run adds a new name to the same subdir file
+    clock[0] += 40
+    index = RepodataIndex(cachedir=cachedir, ttl=60)
+    index.query(local_channel, "linux-64", "numpy")
+    index.query(local_channel, "linux-64", "zlib")
+    index.close()
+    assert len(count_queries) == 2
+    # which does not renew numpy, that expires on its own schedule
+    clock[0] += 40
+    index = RepodataIndex(cachedir=cachedir, ttl=60)
+    assert set(index._load(local_channel, "linux-64")) == {"zlib"}
+    index.query(local_channel, "linux-64", "zlib")
+    index.query(local_channel, "linux-64", "numpy")
+    assert count_queries[2:] == [("numpy",)]
+    # expired names are not written back either
+    clock[0] += 40
+    index.close()
+    index = RepodataIndex(cachedir=cachedir, ttl=60)
+    assert set(index._load(local_channel, "linux-64")) == {"numpy"}
+
+
+def test_repodata_fingerprint(tmpdir, local_channel):
+    subdirs = ["linux-64", "noarch"]
+    fingerprint = repodata_fingerprint([local_channel], subdirs)
+    assert fingerprint is not None
+    assert repodata_fingerprint([local_channel], subdirs) == fingerprint
+    assert repodata_fingerprint([local_channel], ["noarch"]) != fingerprint
+    # any change to the repodata changes the fingerprint
+    repodata_json = tmpdir.join("channel", "noarch", "repodata.json")
+    repodata_json.write(repodata_json.read() + "\n")
+    assert repodata_fingerprint([local_channel], subdirs) != fingerprint
+    # unknown repodata has no fingerprint
+    missing = "file://" + str(tmpdir.join("missing"))
+    assert repodata_fingerprint([local_channel, missing], subdirs) is None
+
+
+def test_from_config(tmpdir):
+    config = Config(repodata_cache_dir=str(tmpdir), repodata_cache_ttl=10)
+    index = RepodataIndex.from_config(config)
+    assert index.cachedir is None
+    assert index.ttl == 10
+    config.repodata_cache = True
+    assert RepodataIndex.from_config(config).cachedir == str(tmpdir)
+
+
+def test_shared_index(monkeypatch):
+    monkeypatch.setattr(repodata, "_INDEX", None)
+    index = repodata.get_repodata_index()
+    assert repodata.get_repodata_index() is index
+    new_index = RepodataIndex()
+    closed = []
+    monkeypatch.setattr(index, "close", lambda: closed.append(index))
+    repodata.set_repodata_index(new_index)
+    assert repodata.get_repodata_index() is new_index
+    # the replaced index is closed, so that its records are persisted
+    assert closed == [index]